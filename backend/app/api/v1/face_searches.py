@@ -1,42 +1,199 @@
 # backend/app/api/v1/faces_search.py
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from app.services.faiss_index import faiss_manager
-from app.services.face_detection import compute_embedding_from_image, detect_faces_from_image_bytes
-from app.db.mongo import embeddings_collection, images_collection
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
+from app.services.faiss_index import tenant_indexes, DEFAULT_NAMESPACE, NAMESPACE_PATTERN
+from app.services.face_detection import compute_embeddings_from_images, detect_faces_from_image_bytes
+from app.services.face_metadata import get_face_metadata
+from app.services.inference_pool import run_inference
+from app.services.embedding_batcher import embed_probe
+from app.db.mongo import settings_collection
+from app.models.schemas import BatchSearchRequest
+from app.core.config import settings
 from app.utils.jwt import decode_token
-import numpy as np
+from app.utils.image_io import check_image_size, ImageTooLarge
+from typing import List, Optional
 
 router = APIRouter()
 
-@router.post("/search")
-async def search_face(probe: UploadFile = File(...), top_k: int = 5, user=Depends(decode_token)):
-    b = await probe.read()
-    # decode to numpy image
-    import cv2
-    arr = np.frombuffer(b, np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if img is None:
-        raise HTTPException(status_code=400, detail="Invalid image")
+MAX_BATCH_PROBES = 256
+MAX_RANGE_RESULTS = 1000
+MAX_TOP_K = 100
 
-    emb = compute_embedding_from_image(img)
-    if not emb:
-        raise HTTPException(status_code=400, detail="Could not compute embedding")
 
-    # search using FAISS
-    results = faiss_manager.search(emb, top_k=top_k)
-    # Look up metadata from DB for the returned face_ids
+async def _hydrate_batch(batch):
+    # one metadata lookup for every hit across all probes
+    meta = await get_face_metadata({face_id for results in batch for face_id, _ in results})
+    return [_format_results(results, meta) for results in batch]
+
+
+async def _hydrate(results):
+    return (await _hydrate_batch([results]))[0]
+
+
+def search_filters(
+    label: Optional[str] = None,
+    enrolled: Optional[bool] = None,
+    gender: Optional[str] = None,
+    emotion: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None
+) -> Optional[dict]:
+    """Attribute filters, pushed down into FAISS as an IDSelector."""
+    filters = {
+        "label": label, "enrolled": enrolled, "gender": gender,
+        "emotion": emotion, "min_age": min_age, "max_age": max_age
+    }
+    return {k: v for k, v in filters.items() if v is not None} or None
+
+
+def _format_results(results, meta):
     out = []
     for face_id, score in results:
-        doc = await embeddings_collection.find_one({"face_id": face_id})
-        if doc:
-            img_doc = None
-            if doc.get("image_id"):
-                img_doc = await images_collection.find_one({"_id": ObjectId(doc["image_id"])})
+        m = meta.get(face_id)
+        if m:
             out.append({
                 "face_id": face_id,
-                "image_id": doc.get("image_id"),
+                "image_id": m["image_id"],
                 "score": float(score),
-                "label": doc.get("label"),
-                "s3_crop": img_doc.get("faces", [{}])[0].get("crop_s3") if img_doc else None
+                "label": m["label"],
+                "s3_crop": m["s3_crop"]
             })
+    return out
+
+
+def _check_probe(data: bytes) -> bytes:
+    try:
+        check_image_size(data)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return data
+
+
+async def _probe_embedding(probe: UploadFile):
+    try:
+        # cached by content; otherwise batched with probes from concurrent requests
+        emb = await embed_probe(await probe.read(), settings.DETECTOR_POLICY_SEARCH)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if emb is None:
+        raise HTTPException(status_code=400, detail="Invalid image")
+    if not emb:
+        raise HTTPException(status_code=400, detail="Could not compute embedding")
+    return emb
+
+
+async def _user_threshold(user_id: str) -> int:
+    s = await settings_collection.find_one({"user_id": user_id}, {"threshold_percentage": 1})
+    return (s or {}).get("threshold_percentage", 75)
+
+
+@router.post("/search")
+async def search_face(
+    probe: UploadFile = File(...),
+    top_k: int = Query(5, ge=1, le=MAX_TOP_K),
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    namespace: str = Query(DEFAULT_NAMESPACE, pattern=NAMESPACE_PATTERN),
+    filters: Optional[dict] = Depends(search_filters),
+    user=Depends(decode_token)
+):
+    emb = await _probe_embedding(probe)
+
+    # search using FAISS
+    index = await tenant_indexes.get(user["sub"], namespace)
+    results = index.search(emb, top_k=top_k, nprobe=nprobe, ef_search=ef_search, filters=filters)
+    return {"results": await _hydrate(results)}
+
+
+@router.post("/search/range")
+async def search_face_range(
+    probe: UploadFile = File(...),
+    max_results: int = Query(100, ge=1, le=MAX_RANGE_RESULTS),
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    namespace: str = Query(DEFAULT_NAMESPACE, pattern=NAMESPACE_PATTERN),
+    filters: Optional[dict] = Depends(search_filters),
+    user=Depends(decode_token)
+):
+    """Every gallery face above the user's configured similarity threshold."""
+    emb = await _probe_embedding(probe)
+    threshold = await _user_threshold(user["sub"])
+
+    index = await tenant_indexes.get(user["sub"], namespace)
+    results = index.range_search(
+        emb, min_score=threshold / 100.0, max_results=max_results,
+        nprobe=nprobe, ef_search=ef_search, filters=filters
+    )
+    return {"threshold": threshold, "results": await _hydrate(results)}
+
+
+@router.post("/search/match")
+async def search_face_match(
+    probe: UploadFile = File(...),
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    namespace: str = Query(DEFAULT_NAMESPACE, pattern=NAMESPACE_PATTERN),
+    filters: Optional[dict] = Depends(search_filters),
+    user=Depends(decode_token)
+):
+    """Watchlist check: does anyone in the gallery clear the user's threshold?"""
+    emb = await _probe_embedding(probe)
+    threshold = await _user_threshold(user["sub"])
+
+    index = await tenant_indexes.get(user["sub"], namespace)
+    best = index.best_match(emb, min_score=threshold / 100.0, nprobe=nprobe, ef_search=ef_search, filters=filters)
+    if best is None:
+        return {"match": False, "threshold": threshold, "best": None}
+    return {"match": True, "threshold": threshold, "best": (await _hydrate([best]) or [None])[0]}
+
+
+@router.post("/search/batch")
+async def search_faces_batch(
+    probes: List[UploadFile] = File(...),
+    top_k: int = Query(5, ge=1, le=MAX_TOP_K),
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    namespace: str = Query(DEFAULT_NAMESPACE, pattern=NAMESPACE_PATTERN),
+    filters: Optional[dict] = Depends(search_filters),
+    user=Depends(decode_token)
+):
+    """Search many probe images: one embedding batch, one FAISS call."""
+    if len(probes) > MAX_BATCH_PROBES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_PROBES} probes per batch")
+
+    # only headers are read here; the pool decodes and embeds
+    datas = [_check_probe(await probe.read()) for probe in probes]
+    embeddings = await run_inference(compute_embeddings_from_images, datas, settings.DETECTOR_POLICY_SEARCH)
+    searchable = [(i, emb) for i, emb in enumerate(embeddings) if emb]
+    index = await tenant_indexes.get(user["sub"], namespace)
+    hits = index.search_batch(
+        [emb for _, emb in searchable], top_k=top_k, nprobe=nprobe, ef_search=ef_search, filters=filters
+    )
+    hits_by_probe = dict(zip([i for i, _ in searchable], await _hydrate_batch(hits)))
+
+    out = []
+    for i, probe in enumerate(probes):
+        entry = {"probe": i, "filename": probe.filename}
+        if embeddings[i] is None:
+            entry["error"] = "Invalid image"
+        elif i not in hits_by_probe:
+            entry["error"] = "Could not compute embedding"
+        else:
+            entry["results"] = hits_by_probe[i]
+        out.append(entry)
     return {"results": out}
+
+
+@router.post("/search/batch/embeddings")
+async def search_embeddings_batch(req: BatchSearchRequest, user=Depends(decode_token)):
+    """Search with precomputed probe embeddings."""
+    if len(req.embeddings) > MAX_BATCH_PROBES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_PROBES} probes per batch")
+    if any(len(emb) != tenant_indexes.dim for emb in req.embeddings):
+        raise HTTPException(status_code=400, detail=f"Embeddings must have {tenant_indexes.dim} dimensions")
+
+    index = await tenant_indexes.get(user["sub"], req.namespace)
+    filters = search_filters(**req.filters.model_dump()) if req.filters else None
+    hits = index.search_batch(
+        req.embeddings, top_k=req.top_k, nprobe=req.nprobe, ef_search=req.ef_search, filters=filters
+    )
+    return {"results": [{"probe": i, "results": h} for i, h in enumerate(await _hydrate_batch(hits))]}
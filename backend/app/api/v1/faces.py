@@ -1,20 +1,31 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Query
 from bson import ObjectId
 from app.db.mongo import images_collection, embeddings_collection
 from app.schemas.face_schemas import EnrollRequest, VerifyRequest
 from app.services.face_verification import verify_embeddings
-from app.services.face_detection import detect_faces_from_image_bytes, compute_embedding_from_image
+from app.services.face_detection import detect_faces_from_image_bytes, EMBED_MODEL_NAME
+from app.services.faiss_index import (
+    tenant_indexes, filter_attributes, record_index_change, DEFAULT_NAMESPACE, NAMESPACE_PATTERN
+)
+from app.services.face_metadata import invalidate_face_metadata
+from app.services.embedding_batcher import embed_probe
 from app.utils.jwt import decode_token
-import numpy as np
-import cv2
+from app.utils.embedding_codec import encode_embedding, decode_embedding
+from app.utils.image_io import ImageTooLarge
+from app.core.config import settings
+import asyncio
 
 router = APIRouter()
 
 
 @router.post("/enroll")
-async def enroll_face(req: EnrollRequest, user=Depends(decode_token)):
+async def enroll_face(
+    req: EnrollRequest,
+    namespace: str = Query(DEFAULT_NAMESPACE, pattern=NAMESPACE_PATTERN),
+    user=Depends(decode_token)
+):
     # Get image
-    img = await images_collection.find_one({"_id": ObjectId(req.image_id)})
+    img = await images_collection.find_one({"_id": ObjectId(req.image_id), "user_id": user["sub"]})
     if not img:
         raise HTTPException(status_code=404, detail="Image not found")
 
@@ -23,20 +34,61 @@ async def enroll_face(req: EnrollRequest, user=Depends(decode_token)):
     if not face:
         raise HTTPException(status_code=404, detail="Face ID not found")
 
-    embedding = face.get("embedding")
-    if not embedding:
+    stored = await embeddings_collection.find_one({"face_id": req.face_id}, {"vector": 1})
+    stored_vector = stored.get("vector") if stored else None
+    # images uploaded before binary storage still carry the embedding inline
+    embedding = decode_embedding(stored_vector if stored_vector is not None else face.get("embedding"))
+    if embedding is None:
         raise HTTPException(status_code=400, detail="No embedding available for this face")
 
-    doc = {
-        "face_id": req.face_id,
+    # upload already stored this face_id (unique), so upsert the label onto it
+    update = {
         "label": req.label,
-        "embedding": embedding
+        "image_id": req.image_id,
+        "user_id": user["sub"],
+        "namespace": namespace,
+        "age": face.get("age"),
+        "gender": face.get("gender"),
+        "emotion": face.get("emotion")
     }
-
-    await embeddings_collection.insert_one(doc)
+    if stored_vector is None:
+        update["vector"] = encode_embedding(embedding, settings.EMBEDDING_STORAGE_DTYPE, EMBED_MODEL_NAME)
+    previous = await embeddings_collection.find_one_and_update(
+        {"face_id": req.face_id},
+        {"$set": update},
+        projection={"namespace": 1},
+        upsert=True
+    )
+
+    # moving between namespaces moves the face between tenant indexes
+    old_namespace = (previous or {}).get("namespace") or DEFAULT_NAMESPACE
+    if previous and old_namespace != namespace:
+        await record_index_change(user["sub"], old_namespace, [req.face_id])
+        (await tenant_indexes.get(user["sub"], old_namespace)).remove([req.face_id])
+    await record_index_change(user["sub"], namespace, [req.face_id])
+    attrs = filter_attributes({**face, "label": req.label})
+    (await tenant_indexes.get(user["sub"], namespace)).add([req.face_id], [embedding], [attrs])
+    invalidate_face_metadata(req.face_id)
     return {"status": "enrolled", "face_id": req.face_id}
 
 
+@router.delete("/{face_id}")
+async def delete_face(face_id: str, user=Depends(decode_token)):
+    doc = await embeddings_collection.find_one_and_delete(
+        {"face_id": face_id, "user_id": user["sub"]},
+        projection={"namespace": 1}
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail="Face ID not found")
+
+    namespace = doc.get("namespace") or DEFAULT_NAMESPACE
+    await record_index_change(user["sub"], namespace, [face_id])
+    index = await tenant_indexes.get(user["sub"], namespace)
+    index.remove([face_id])
+    invalidate_face_metadata(face_id)
+    return {"status": "deleted", "face_id": face_id}
+
+
 # ------------------------ VERIFY USING IMAGE IDs ------------------------
 @router.post("/verify/ids")
 async def verify_ids(req: VerifyRequest):
@@ -48,17 +100,29 @@ async def verify_ids(req: VerifyRequest):
     if not probe or not candidate:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    probe_emb = probe["faces"][0].get("embedding")
-    candidate_emb = candidate["faces"][0].get("embedding")
+    if not probe.get("faces") or not candidate.get("faces"):
+        raise HTTPException(status_code=400, detail="Missing embeddings")
+
+    probe_face, candidate_face = probe["faces"][0], candidate["faces"][0]
+    stored = {
+        d["face_id"]: d["vector"]
+        async for d in embeddings_collection.find(
+            {"face_id": {"$in": [probe_face["face_id"], candidate_face["face_id"]]}},
+            {"_id": 0, "face_id": 1, "vector": 1}
+        )
+    }
+    # decode straight into numpy; legacy image docs still carry the embedding inline
+    probe_emb = decode_embedding(stored.get(probe_face["face_id"], probe_face.get("embedding")))
+    candidate_emb = decode_embedding(stored.get(candidate_face["face_id"], candidate_face.get("embedding")))
 
-    if not probe_emb or not candidate_emb:
+    if probe_emb is None or candidate_emb is None:
         raise HTTPException(status_code=400, detail="Missing embeddings")
 
     result = verify_embeddings(probe_emb, candidate_emb, threshold)
 
     result.update({
-        "probe_confidence": probe["faces"][0]["confidence"],
-        "candidate_confidence": candidate["faces"][0]["confidence"]
+        "probe_confidence": probe_face["confidence"],
+        "candidate_confidence": candidate_face["confidence"]
     })
 
     return result
@@ -71,18 +135,18 @@ async def verify_files(
     candidate: UploadFile = File(...),
     threshold: int = 75
 ):
-    probe_bytes = await probe.read()
-    cand_bytes = await candidate.read()
-
-    # Convert bytes -> numpy array
-    arr1 = np.frombuffer(probe_bytes, np.uint8)
-    arr2 = np.frombuffer(cand_bytes, np.uint8)
-    img1 = cv2.imdecode(arr1, cv2.IMREAD_COLOR)
-    img2 = cv2.imdecode(arr2, cv2.IMREAD_COLOR)
-
-    # Compute embeddings
-    emb1 = compute_embedding_from_image(img1)
-    emb2 = compute_embedding_from_image(img2)
+    # Compute embeddings: repeated images come from the cache, the rest
+    # land in the same micro-batch
+    policy = settings.DETECTOR_POLICY_VERIFY
+    try:
+        emb1, emb2 = await asyncio.gather(
+            embed_probe(await probe.read(), policy),
+            embed_probe(await candidate.read(), policy)
+        )
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if emb1 is None or emb2 is None:
+        raise HTTPException(status_code=400, detail="Invalid image")
 
     result = verify_embeddings(emb1, emb2, threshold)
     result.update({
@@ -1,46 +1,130 @@
 # backend/app/api/v1/images.py
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
-from app.services.image_storage import upload_to_s3
-from app.services.face_detection import detect_faces_from_image_bytes, compute_embedding_from_image
-from app.db.mongo import images_collection, embeddings_collection
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks, Query, Response
+from app.services.storage_service import storage_service
+from app.services.face_detection import ATTRIBUTE_MODE_PATTERN, CROP_MODE_PATTERN
+from app.services.face_attributes import user_attribute_mode, patch_face_attributes
+from app.services.face_crops import user_crop_mode, get_face_crop
+from app.services.ingestion import ingest_image, ingest_bulk, create_upload_job, get_job, INGESTION_MODE_PATTERN
 from app.services.webhook import dispatch_event_async
+from app.services.uploads import receive_upload, UploadRejected
 from app.utils.jwt import decode_token
-from bson import ObjectId
-import uuid
-import base64
+from app.utils.image_io import ImageTooLarge
+from app.utils.archive_io import aiter_archive_images
+from app.models.schemas import BulkManifestRequest
+from app.core.config import settings
+from app.worker import enqueue_upload_job
+from typing import Optional
 
 router = APIRouter()
 
+
+async def _stored_images(keys):
+    # manifest entries are fetched one at a time, like archive entries
+    for key in keys:
+        try:
+            yield key, await storage_service.download_file(key), None
+        except Exception as e:
+            yield key, None, str(e)
+
+
 @router.post("/upload")
-async def upload_image(file: UploadFile = File(...), user=Depends(decode_token)):
-    content = await file.read()
-    s3_key = upload_to_s3(content, file.filename)
-
-    # detect faces & attributes: detect_faces_from_image_bytes should now return embedding + attributes
-    faces = detect_faces_from_image_bytes(content)
-
-    # persist image doc
-    image_doc = {
-        "user_id": user["sub"],
-        "filename": file.filename,
-        "s3_key": s3_key,
-        "faces": faces
-    }
-    res = await images_collection.insert_one(image_doc)
-    image_id = str(res.inserted_id)
-
-    # Persist embeddings per face to embeddings_collection
-    for f in faces:
-        if f.get("embedding"):
-            emb_doc = {
-                "face_id": f["face_id"],
-                "image_id": image_id,
-                "vector": f["embedding"],
-                "label": None
-            }
-            await embeddings_collection.insert_one(emb_doc)
+async def upload_image(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    attributes: Optional[str] = Query(None, pattern=ATTRIBUTE_MODE_PATTERN),
+    crops: Optional[str] = Query(None, pattern=CROP_MODE_PATTERN),
+    ingestion: Optional[str] = Query(None, pattern=INGESTION_MODE_PATTERN),
+    user=Depends(decode_token)
+):
+    # age/gender/emotion are opt-in: per request, else the user's setting
+    mode = await user_attribute_mode(user["sub"], attributes)
+    # crops stored at upload only if the user wants them (else cut on first view)
+    crop_mode = await user_crop_mode(user["sub"], crops)
+    queued = (ingestion or settings.INGESTION_MODE) == "async"
+
+    # streamed to storage as it arrives; type, header size and byte limit are
+    # checked on the way. Inline processing also keeps the bytes for detection
+    try:
+        upload = await receive_upload(
+            file, lambda ext, content_type: storage_service.open_upload(ext, user["sub"], content_type),
+            keep=not queued
+        )
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    # async: queue the stored image for the workers and answer right away
+    if queued:
+        job_id = await create_upload_job(user["sub"], file.filename, upload["storage_key"], mode, crop_mode)
+        await enqueue_upload_job(job_id)
+        return {"job_id": job_id, "status": "queued"}
+
+    result, pending = await ingest_image(
+        user["sub"], upload["content"], file.filename, upload["storage_key"], mode, crop_mode=crop_mode
+    )
+
+    # attributes are computed after the response is sent, then patched in
+    if pending:
+        background_tasks.add_task(
+            patch_face_attributes, user["sub"], result["image_id"], [f["face_id"] for f in result["faces"]], pending
+        )
 
     # dispatch webhook (async)
-    await dispatch_event_async("image.uploaded", {"image_id": image_id, "user_id": user["sub"], "faces": len(faces)})
+    await dispatch_event_async("image.uploaded", {"image_id": result["image_id"], "user_id": user["sub"], "faces": len(result["faces"])})
+
+    return result
+
+
+@router.get("/jobs/{job_id}")
+async def get_upload_job(job_id: str, user=Depends(decode_token)):
+    job = await get_job(user["sub"], job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/bulk")
+async def bulk_upload(
+    file: UploadFile = File(...),
+    attributes: Optional[str] = Query(None, pattern=ATTRIBUTE_MODE_PATTERN),
+    crops: Optional[str] = Query(None, pattern=CROP_MODE_PATTERN),
+    user=Depends(decode_token)
+):
+    """Ingest every image in a zip or tar(.gz) archive; entries are read one at a time."""
+    mode = await user_attribute_mode(user["sub"], attributes)
+    crop_mode = await user_crop_mode(user["sub"], crops)
+    try:
+        return await ingest_bulk(
+            user["sub"], aiter_archive_images(file.file, settings.BULK_MAX_ENTRY_BYTES), mode, crop_mode=crop_mode
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/bulk/manifest")
+async def bulk_ingest_stored(
+    request: BulkManifestRequest,
+    attributes: Optional[str] = Query(None, pattern=ATTRIBUTE_MODE_PATTERN),
+    crops: Optional[str] = Query(None, pattern=CROP_MODE_PATTERN),
+    user=Depends(decode_token)
+):
+    """Ingest images already in storage, by key."""
+    if len(request.keys) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BULK_MAX_ITEMS} keys per request")
+    foreign = [k for k in request.keys if not storage_service.owns_key(k, user["sub"])]
+    if foreign:
+        raise HTTPException(status_code=403, detail=f"Not your storage keys: {foreign[:5]}")
+    mode = await user_attribute_mode(user["sub"], attributes)
+    crop_mode = await user_crop_mode(user["sub"], crops)
+    return await ingest_bulk(user["sub"], _stored_images(request.keys), mode, stored=True, crop_mode=crop_mode)
+
 
-    return {"image_id": image_id, "faces": faces}
+@router.get("/{image_id}/faces/{face_id}/crop")
+async def get_crop(image_id: str, face_id: str, user=Depends(decode_token)):
+    """The face's JPEG crop; cut from the original (and stored) on first request unless stored at upload."""
+    jpeg = await get_face_crop(user["sub"], image_id, face_id)
+    if jpeg is None:
+        raise HTTPException(status_code=404, detail="Face not found")
+    # crop keys are content hashes, so a crop never changes
+    return Response(content=jpeg, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=86400"})
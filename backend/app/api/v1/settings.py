@@ -2,13 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException
 from app.db.mongo import settings_collection
 from bson import ObjectId
 from app.utils.jwt import decode_token
+from app.services.face_detection import ATTRIBUTE_MODES, CROP_MODES
+from app.services.face_attributes import user_attribute_mode
+from app.services.face_crops import user_crop_mode
 
 router = APIRouter()
 
 @router.get("/threshold")
 async def get_threshold(user=Depends(decode_token)):
     s = await settings_collection.find_one({"user_id": user["sub"]})
-    return {"threshold": s["threshold_percentage"] if s else 75}
+    # the /attributes and /crops upserts create settings docs without a threshold
+    return {"threshold": (s or {}).get("threshold_percentage", 75)}
 
 
 @router.post("/threshold")
@@ -23,3 +27,43 @@ async def set_threshold(value: int, user=Depends(decode_token)):
     )
 
     return {"status": "updated", "threshold": value}
+
+
+@router.get("/attributes")
+async def get_attribute_analysis(user=Depends(decode_token)):
+    return {"attribute_analysis": await user_attribute_mode(user["sub"])}
+
+
+@router.post("/attributes")
+async def set_attribute_analysis(mode: str, user=Depends(decode_token)):
+    """Age/gender/emotion at upload: off, sync, or deferred (computed after the response)."""
+    if mode not in ATTRIBUTE_MODES:
+        raise HTTPException(status_code=400, detail=f"Mode must be one of {', '.join(ATTRIBUTE_MODES)}")
+
+    await settings_collection.update_one(
+        {"user_id": user["sub"]},
+        {"$set": {"attribute_analysis": mode}},
+        upsert=True
+    )
+
+    return {"status": "updated", "attribute_analysis": mode}
+
+
+@router.get("/crops")
+async def get_crop_storage(user=Depends(decode_token)):
+    return {"crop_storage": await user_crop_mode(user["sub"])}
+
+
+@router.post("/crops")
+async def set_crop_storage(mode: str, user=Depends(decode_token)):
+    """Face crops: eager (stored at upload), lazy (stored on first view) or off (cut per view, never stored)."""
+    if mode not in CROP_MODES:
+        raise HTTPException(status_code=400, detail=f"Mode must be one of {', '.join(CROP_MODES)}")
+
+    await settings_collection.update_one(
+        {"user_id": user["sub"]},
+        {"$set": {"crop_storage": mode}},
+        upsert=True
+    )
+
+    return {"status": "updated", "crop_storage": mode}
@@ -20,18 +20,89 @@ class Settings(BaseSettings):
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
     AWS_S3_BUCKET: Optional[str] = None
     AWS_REGION: Optional[str] = "us-east-1"
+    # Custom S3 endpoint (MinIO, or a moto server in tests)
+    AWS_S3_ENDPOINT_URL: Optional[str] = None
+    # S3 calls run in threads: pooled connections, and transfers in flight at once
+    S3_MAX_POOL_CONNECTIONS: int = 32
+    S3_MAX_CONCURRENCY: int = 10
     
     # Use local storage if S3 not configured
     USE_S3: bool = False
     LOCAL_STORAGE_PATH: str = "./uploads"
+    # Uploads are streamed in UPLOAD_CHUNK_SIZE reads and rejected past UPLOAD_MAX_BYTES
+    UPLOAD_MAX_BYTES: int = 10 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    # S3 parts must be at least 5 MB (except the last)
+    S3_MULTIPART_PART_SIZE: int = 8 * 1024 * 1024
     
     # Face Detection
     FACE_DETECTION_BACKEND: str = "opencv"
     FACE_DETECTION_MODEL: str = "VGG-Face"
+    # Embedding model; also recorded in every packed embedding
+    EMBED_MODEL_NAME: str = "ArcFace"
+    # Load and warm all models at startup; /ready reports 503 until done
+    MODEL_WARMUP: bool = True
+    
+    # Inference process pool; 0 runs model calls in a thread of the API process.
+    # Intra-op threads per worker, 0 = split the cores evenly between workers
+    INFERENCE_WORKERS: int = 2
+    INFERENCE_INTRA_OP_THREADS: int = 0
+    
+    # Cross-request micro-batching of probe embeddings (search, verify)
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0
+    
+    # Image preprocessing: reject decompression bombs from the header, decode large
+    # images at reduced scale, and run detection on a copy capped at DETECTION_MAX_SIDE
+    IMAGE_MAX_PIXELS: int = 100_000_000
+    IMAGE_DECODE_MIN_SIDE: int = 2048
+    DETECTION_MAX_SIDE: int = 1280
+    
+    # Detector policy per endpoint: fast | balanced | accurate (or a single backend name).
+    # fast/balanced try opencv first and fall back to mtcnn when it finds no face;
+    # balanced also falls back on faces below the confidence / size (detection px) floor
+    DETECTOR_POLICY_SEARCH: str = "fast"
+    DETECTOR_POLICY_VERIFY: str = "fast"
+    DETECTOR_POLICY_UPLOAD: str = "balanced"
+    CASCADE_MIN_CONFIDENCE: float = 0.9
+    CASCADE_MIN_FACE_SIZE: int = 40
+    
+    # Content-addressed inference cache (sha256 of the image bytes + models/policy).
+    # Local LRU always; Redis layer when a URL is set, e.g. redis://redis:6379/1
+    INFERENCE_CACHE_SIZE: int = 10000
+    INFERENCE_CACHE_TTL_SECONDS: int = 86400
+    INFERENCE_CACHE_REDIS_URL: Optional[str] = None
+    
+    # Embeddings are stored as packed binary: float32 or float16
+    EMBEDDING_STORAGE_DTYPE: str = "float32"
+    
+    # Search result metadata cache (face_id -> image_id, label, crop key)
+    FACE_METADATA_CACHE_SIZE: int = 100000
+    FACE_METADATA_CACHE_TTL_SECONDS: int = 300
     
     # Celery
     CELERY_BROKER_URL: str = "redis://redis:6379/0"
     CELERY_RESULT_BACKEND: str = "redis://redis:6379/0"
+    # Runs tasks in-process instead of through the broker (tests)
+    CELERY_TASK_ALWAYS_EAGER: bool = False
+    CELERY_WORKER_CONCURRENCY: int = 2
+    
+    # Uploads: "sync" processes inline, "async" stores the image and enqueues a job
+    INGESTION_MODE: str = "sync"
+    # How often the API adds faces from finished jobs to its loaded indexes
+    JOB_INDEX_INTERVAL_SECONDS: float = 2.0
+    # A "processing" job is only taken over by another worker once its lease ran out
+    JOB_LEASE_SECONDS: int = 600
+    
+    # Bulk ingestion: images in flight at once, docs per Mongo/index write, limits
+    BULK_MAX_IN_FLIGHT: int = 8
+    BULK_WRITE_BATCH_SIZE: int = 100
+    BULK_MAX_ITEMS: int = 10000
+    BULK_MAX_ENTRY_BYTES: int = 50 * 1024 * 1024
+    
+    # Ingestion events (image.uploaded, ...) are POSTed here as JSON when set
+    WEBHOOK_URL: Optional[str] = None
+    WEBHOOK_TIMEOUT_SECONDS: float = 5.0
     
     class Config:
         case_sensitive = True
@@ -0,0 +1,105 @@
+"""
+One-off migration: convert embeddings stored as BSON arrays of doubles (or
+under the legacy "embedding" field) to packed binary "vector", and drop the
+duplicate copies kept inline in images.faces[] once the packed doc exists.
+
+    python -m app.db.migrate_embeddings [--dtype float16] [--batch-size 1000]
+"""
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from app.core.config import settings
+from app.db.mongo import connect_to_mongo, close_mongo_connection, embeddings_collection, images_collection
+from app.utils.embedding_codec import encode_embedding
+
+
+def _packed(value, dtype: str):
+    # already-packed values are kept as they are, whatever dtype they were written in
+    if isinstance(value, (bytes, bytearray)):
+        return value
+    return encode_embedding(value, dtype, settings.EMBED_MODEL_NAME)
+
+
+async def migrate_embeddings(dtype: str, batch_size: int) -> int:
+    converted = 0
+    ops = []
+    cursor = embeddings_collection.find(
+        {"$or": [{"vector": {"$type": "array"}}, {"embedding": {"$exists": True}}]},
+        {"_id": 1, "vector": 1, "embedding": 1}, batch_size=batch_size
+    )
+    async for doc in cursor:
+        source = doc.get("vector") if doc.get("vector") is not None else doc.get("embedding")
+        update = {"$unset": {"embedding": ""}}
+        if source is not None:
+            update["$set"] = {"vector": _packed(source, dtype)}
+        ops.append(UpdateOne({"_id": doc["_id"]}, update))
+        if len(ops) >= batch_size:
+            converted += (await embeddings_collection.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        converted += (await embeddings_collection.bulk_write(ops, ordered=False)).modified_count
+    return converted
+
+
+async def _drop_inline_batch(images: list) -> int:
+    face_ids = [f["face_id"] for img in images for f in img["faces"] if "embedding" in f and f.get("face_id")]
+    packed = set()
+    async for d in embeddings_collection.find(
+        {"face_id": {"$in": face_ids}, "vector": {"$type": "binData"}}, {"_id": 0, "face_id": 1}
+    ):
+        packed.add(d["face_id"])
+    ops = []
+    for img in images:
+        # by position, guarded on the face_id in case the array changed since the read
+        match, unset = {"_id": img["_id"]}, {}
+        for i, f in enumerate(img["faces"]):
+            if "embedding" in f and f.get("face_id") in packed:
+                match[f"faces.{i}.face_id"] = f["face_id"]
+                unset[f"faces.{i}.embedding"] = ""
+        if unset:
+            ops.append(UpdateOne(match, {"$unset": unset}))
+    if not ops:
+        return 0
+    return (await images_collection.bulk_write(ops, ordered=False)).modified_count
+
+
+async def drop_inline_embeddings(batch_size: int = 1000) -> int:
+    """
+    Unset images.faces[].embedding only for faces whose packed embedding
+    doc exists, so a face the migration missed keeps its only copy.
+    """
+    cleaned = 0
+    batch = []
+    async for img in images_collection.find(
+        {"faces.embedding": {"$exists": True}}, {"_id": 1, "faces.face_id": 1, "faces.embedding": 1},
+        batch_size=batch_size
+    ):
+        batch.append(img)
+        if len(batch) >= batch_size:
+            cleaned += await _drop_inline_batch(batch)
+            batch = []
+    if batch:
+        cleaned += await _drop_inline_batch(batch)
+    return cleaned
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dtype", default=settings.EMBEDDING_STORAGE_DTYPE, choices=["float32", "float16"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--keep-inline", action="store_true", help="keep images.faces[].embedding")
+    args = parser.parse_args()
+
+    await connect_to_mongo()
+    try:
+        converted = await migrate_embeddings(args.dtype, args.batch_size)
+        print(f"Converted {converted} embeddings to packed {args.dtype}")
+        if not args.keep_inline:
+            cleaned = await drop_inline_embeddings(args.batch_size)
+            print(f"Removed inline embeddings from {cleaned} image documents")
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
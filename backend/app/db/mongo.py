@@ -7,14 +7,26 @@ class MongoDB:
 
 mongodb = MongoDB()
 
+# Motor connects on first use, so the client and collections can be created at
+# import time; services import the collections directly.
+mongodb.client = AsyncIOMotorClient(settings.MONGODB_URL)
+mongodb.database = mongodb.client[settings.MONGODB_DB_NAME]
+
+users_collection = mongodb.database.users
+images_collection = mongodb.database.images
+embeddings_collection = mongodb.database.embeddings
+settings_collection = mongodb.database.settings
+jobs_collection = mongodb.database.jobs
+counters_collection = mongodb.database.counters
+
 async def connect_to_mongo():
-    mongodb.client = AsyncIOMotorClient(settings.MONGODB_URL)
-    mongodb.database = mongodb.client[settings.MONGODB_DB_NAME]
-    
     await mongodb.database.users.create_index("email", unique=True)
     await mongodb.database.users.create_index("api_key", unique=True)
     await mongodb.database.images.create_index("user_id")
     await mongodb.database.embeddings.create_index("face_id", unique=True)
+    await mongodb.database.embeddings.create_index([("user_id", 1), ("namespace", 1)])
+    await mongodb.database.jobs.create_index("user_id")
+    await mongodb.database.jobs.create_index("seq")
 
 async def close_mongo_connection():
     mongodb.client.close()
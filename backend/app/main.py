@@ -5,12 +5,48 @@ import os
 import uuid
 from datetime import datetime
 from typing import Optional
+from contextlib import asynccontextmanager
+import asyncio
 import shutil
+from app.core.config import settings
+from app.services.faiss_index import tenant_indexes
+from app.services.face_detection import models_ready
+from app.services import inference_pool
+from app.services.embedding_batcher import probe_embedder
+from app.services.detector_stats import detector_stats
+from app.services.ingestion import run_job_indexer
+from app.services.storage_service import LocalUpload
+from app.services.uploads import receive_upload, UploadRejected, UploadSizeLimit
+from app.utils.image_io import ImageTooLarge
+
+async def _warmup():
+    try:
+        await inference_pool.warmup()
+    except Exception as e:
+        # stay not-ready so the load balancer keeps traffic away
+        print(f"Model warmup failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tenant indexes load lazily; loaded ones are rebuilt from MongoDB in the background
+    rebuild_task = asyncio.create_task(tenant_indexes.run_periodic_rebuild())
+    # Faces from async upload jobs are indexed here once the workers finish them
+    job_index_task = asyncio.create_task(run_job_indexer())
+    # Warm models off the event loop so /health answers while they load
+    warmup_task = asyncio.create_task(_warmup()) if settings.MODEL_WARMUP else None
+    yield
+    rebuild_task.cancel()
+    job_index_task.cancel()
+    if warmup_task:
+        warmup_task.cancel()
+    probe_embedder.stop()
+    inference_pool.shutdown()
 
 app = FastAPI(
     title="FaceSaaS Platform",
     version="1.0.0",
-    docs_url="/docs"
+    docs_url="/docs",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -22,6 +58,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Cap upload bodies as they arrive, before FastAPI spools them (chunked bodies too)
+app.add_middleware(UploadSizeLimit)
+
 # FIX: Create uploads directory FIRST, before mounting it
 os.makedirs("uploads", exist_ok=True)
 
@@ -51,6 +90,17 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    # Liveness is /health; this one gates traffic on model warmup
+    if settings.MODEL_WARMUP and not models_ready():
+        raise HTTPException(status_code=503, detail="Models are warming up")
+    return {"status": "ready"}
+
+@app.get("/metrics/inference")
+async def inference_metrics():
+    return {"probe_embedding": probe_embedder.stats(), "detectors": detector_stats.snapshot()}
+
 @app.post("/api/v1/auth/register")
 async def register(email: str = Form(...), password: str = Form(...)):
     # Check if email already exists
@@ -99,23 +149,16 @@ async def upload_image(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="File must be an image")
    
     try:
-        # Read file
-        contents = await file.read()
-       
-        if len(contents) == 0:
-            raise HTTPException(status_code=400, detail="File is empty")
-       
-        # Validate file size (10MB limit)
-        if len(contents) > 10 * 1024 * 1024:
-            raise HTTPException(status_code=413, detail="File size must be less than 10MB")
-       
-        # Save file locally
-        file_extension = os.path.splitext(file.filename)[1] or '.jpg'
-        file_name = f"{uuid.uuid4()}{file_extension}"
-        file_path = f"uploads/{file_name}"
+        # Stream to disk in chunks; empty, oversized and non-image bodies stop early
+        try:
+            upload = await receive_upload(file, lambda ext, _: LocalUpload(f"uploads/{uuid.uuid4()}{ext}"))
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
        
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        file_path = upload["storage_key"]
+        file_name = os.path.basename(file_path)
        
         print(f"File saved successfully: {file_path}")
        
@@ -163,6 +206,8 @@ async def upload_image(file: UploadFile = File(...)):
         print(f"Returning response: {response_data}")
         return response_data
        
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
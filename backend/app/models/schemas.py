@@ -98,4 +98,24 @@ class FaceComparisonResponse(BaseModel):
     candidate_confidence: float
 
 class ThresholdUpdate(BaseModel):
-    threshold: float = Field(ge=70.0, le=90.0)
\ No newline at end of file
+    threshold: float = Field(ge=70.0, le=90.0)
+
+class SearchFilters(BaseModel):
+    label: Optional[str] = None
+    enrolled: Optional[bool] = None
+    gender: Optional[str] = None
+    emotion: Optional[str] = None
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+
+class BatchSearchRequest(BaseModel):
+    embeddings: List[List[float]]
+    top_k: int = Field(default=5, ge=1, le=100)
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    namespace: str = Field(default="default", pattern=r"^[A-Za-z0-9_.-]{1,64}$")
+    filters: Optional[SearchFilters] = None
+
+class BulkManifestRequest(BaseModel):
+    # storage keys of images already uploaded
+    keys: List[str] = Field(..., min_length=1)
@@ -1,11 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
 from datetime import datetime
 from bson import ObjectId
-import os
 from app.models.schemas import FaceComparisonRequest, FaceComparisonResponse
 from app.services.face_service import face_service
 from app.db.mongo import get_image_collection, get_user_collection
 from app.routers.auth import oauth2_scheme
+from app.utils.image_io import check_image_size, ImageTooLarge
 
 router = APIRouter(prefix="/faces", tags=["faces"])
 
@@ -44,33 +44,23 @@ async def compare_faces(
     if not image1.content_type.startswith('image/') or not image2.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="Both files must be images")
     
-    # Save files to temp location
-    temp_path1 = f"/tmp/{ObjectId()}_{image1.filename}"
-    temp_path2 = f"/tmp/{ObjectId()}_{image2.filename}"
-    
+    contents1 = await image1.read()
+    contents2 = await image2.read()
     try:
-        contents1 = await image1.read()
-        contents2 = await image2.read()
-        
-        with open(temp_path1, 'wb') as f:
-            f.write(contents1)
-        with open(temp_path2, 'wb') as f:
-            f.write(contents2)
-        
-        # Compare faces
-        comparison_result = await face_service.compare_faces(temp_path1, temp_path2)
-        
-        match_status = "MATCH" if comparison_result["similarity_score"] >= threshold else "NOT_MATCH"
-        
-        return FaceComparisonResponse(
-            similarity_score=comparison_result["similarity_score"],
-            threshold_used=threshold,
-            match_status=match_status,
-            probe_confidence=0.95,
-            candidate_confidence=0.95
-        )
-        
-    finally:
-        for path in [temp_path1, temp_path2]:
-            if os.path.exists(path):
-                os.remove(path)
\ No newline at end of file
+        check_image_size(contents1)
+        check_image_size(contents2)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    # Compare faces; the bytes are decoded in memory by the inference worker
+    comparison_result = await face_service.compare_faces(contents1, contents2)
+    
+    match_status = "MATCH" if comparison_result["similarity_score"] >= threshold else "NOT_MATCH"
+    
+    return FaceComparisonResponse(
+        similarity_score=comparison_result["similarity_score"],
+        threshold_used=threshold,
+        match_status=match_status,
+        probe_confidence=0.95,
+        candidate_confidence=0.95
+    )
\ No newline at end of file
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from datetime import datetime
 from bson import ObjectId
-import os
 from app.db.mongo import get_image_collection, get_embedding_collection
 from app.services.face_service import face_service
 from app.services.storage_service import storage_service
+from app.utils.embedding_codec import encode_embedding
+from app.core.config import settings
+from app.services.uploads import receive_upload, UploadRejected
+from app.utils.image_io import ImageTooLarge
 from app.routers.auth import oauth2_scheme
 
 router = APIRouter(prefix="/images", tags=["images"])
@@ -16,59 +19,62 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 @router.post("/upload")
 async def upload_image(
     file: UploadFile = File(...),
+    attributes: bool = False,
     user_id: str = Depends(get_current_user)
 ):
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    contents = await file.read()
-    file_extension = os.path.splitext(file.filename)[1]
+    # streamed to storage as it arrives; kept in memory (at most UPLOAD_MAX_BYTES) for detection
+    try:
+        upload = await receive_upload(
+            file, lambda ext, content_type: storage_service.open_upload(ext, user_id, content_type), keep=True
+        )
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    contents = upload["content"]
+    storage_key = upload["storage_key"]
     
-    storage_key = await storage_service.upload_file(contents, file_extension, user_id)
+    # one detector pass on the in-memory bytes; every face keeps its own embedding
+    faces = await face_service.analyze_image(contents, with_attributes=attributes)
+    faces_metadata = [{k: v for k, v in face.items() if k != "embedding"} for face in faces]
     
-    temp_path = f"/tmp/{ObjectId()}{file_extension}"
-    with open(temp_path, 'wb') as f:
-        f.write(contents)
+    image_doc = {
+        "user_id": ObjectId(user_id),
+        "storage_key": storage_key,
+        "file_name": file.filename,
+        "file_size": upload["size"],
+        "sha256": upload["sha256"],
+        "upload_time": datetime.utcnow(),
+        "faces": faces_metadata,
+        "face_count": len(faces_metadata)
+    }
     
-    try:
-        faces_metadata = await face_service.detect_faces(temp_path)
-        
-        image_doc = {
+    images_collection = get_image_collection()
+    result = await images_collection.insert_one(image_doc)
+    
+    embeddings_collection = get_embedding_collection()
+    embedding_docs = [
+        {
+            "face_id": face["face_id"],
+            "vector": encode_embedding(face["embedding"], settings.EMBEDDING_STORAGE_DTYPE, face_service.model_name),
             "user_id": ObjectId(user_id),
-            "storage_key": storage_key,
-            "file_name": file.filename,
-            "file_size": len(contents),
-            "upload_time": datetime.utcnow(),
-            "faces": faces_metadata,
-            "face_count": len(faces_metadata)
-        }
-        
-        images_collection = get_image_collection()
-        result = await images_collection.insert_one(image_doc)
-        
-        embeddings_collection = get_embedding_collection()
-        for face in faces_metadata:
-            embedding = await face_service.extract_embedding(temp_path)
-            if embedding:
-                embedding_doc = {
-                    "face_id": face["face_id"],
-                    "embedding": embedding,
-                    "user_id": ObjectId(user_id),
-                    "image_id": result.inserted_id,
-                    "created_at": datetime.utcnow()
-                }
-                await embeddings_collection.insert_one(embedding_doc)
-        
-        return {
-            "image_id": str(result.inserted_id),
-            "face_count": len(faces_metadata),
-            "faces": faces_metadata,
-            "storage_key": storage_key
+            "image_id": result.inserted_id,
+            "created_at": datetime.utcnow()
         }
-        
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        for face in faces if face.get("embedding")
+    ]
+    if embedding_docs:
+        await embeddings_collection.insert_many(embedding_docs)
+    
+    return {
+        "image_id": str(result.inserted_id),
+        "face_count": len(faces_metadata),
+        "faces": faces_metadata,
+        "storage_key": storage_key
+    }
 
 @router.get("/my-images")
 async def get_my_images(user_id: str = Depends(get_current_user)):
@@ -0,0 +1,62 @@
+# backend/app/services/detector_stats.py
+import multiprocessing
+from typing import Dict
+
+# DeepFace detector backends we keep counters for
+BACKENDS = ("opencv", "ssd", "dlib", "mtcnn", "fastmtcnn", "retinaface",
+            "mediapipe", "yolov8", "yunet", "centerface")
+_FIELDS = ("calls", "seconds", "max_seconds", "fallbacks")
+
+
+class DetectorStats:
+    """
+    Per-backend detection timings and cascade fallbacks. Counters live in a
+    shared-memory array so the inference pool workers (which run the
+    detectors) and the API process (which reports them) see the same numbers.
+    """
+
+    def __init__(self):
+        # spawn context: the array is handed to the spawned pool workers
+        self.array = multiprocessing.get_context("spawn").Array("d", len(BACKENDS) * len(_FIELDS))
+
+    def attach(self, array):
+        """Use the parent's counters (called in each pool worker's initializer)."""
+        self.array = array
+
+    def _offset(self, backend: str) -> int:
+        return BACKENDS.index(backend) * len(_FIELDS)
+
+    def record(self, backend: str, seconds: float):
+        if backend not in BACKENDS:
+            return
+        i = self._offset(backend)
+        with self.array.get_lock():
+            self.array[i] += 1
+            self.array[i + 1] += seconds
+            self.array[i + 2] = max(self.array[i + 2], seconds)
+
+    def record_fallback(self, backend: str):
+        if backend not in BACKENDS:
+            return
+        with self.array.get_lock():
+            self.array[self._offset(backend) + 3] += 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self.array.get_lock():
+            values = list(self.array)
+        out = {}
+        for backend in BACKENDS:
+            i = self._offset(backend)
+            calls, seconds, max_seconds, fallbacks = values[i:i + len(_FIELDS)]
+            if calls:
+                out[backend] = {
+                    "calls": int(calls),
+                    "avg_ms": 1000.0 * seconds / calls,
+                    "max_ms": 1000.0 * max_seconds,
+                    # times this backend's result wasn't good enough and the next one ran
+                    "fallbacks": int(fallbacks)
+                }
+        return out
+
+
+detector_stats = DetectorStats()
@@ -0,0 +1,145 @@
+"""
+Cross-request micro-batching for embedding inference.
+
+Concurrent handlers that each need one embedding (search probes, verify)
+submit to a shared queue; a scheduler packs whatever arrives within a
+few milliseconds into one model call and resolves each caller's future.
+"""
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Callable, List, Optional
+from app.core.config import settings
+from app.services.face_detection import embed_probes, EMBED_MODEL_NAME
+from app.services.inference_cache import inference_cache
+from app.services.inference_pool import run_inference
+from app.utils.image_io import check_image_size
+
+
+class EmbeddingBatcher:
+    """
+    Collects items into batches of up to max_batch_size, waiting at most
+    max_wait_ms after the first item, and runs fn(batch) in the inference
+    pool. At most `concurrency` batches are in flight; while all slots are
+    busy new items queue up, so batches grow with load.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch_size: int,
+                 max_wait_ms: float, concurrency: int = 1):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = concurrency
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batch_sizes = Counter()
+        self._batches = 0
+        self._items = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.monotonic()))
+        return await future
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            asyncio.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            # callers that gave up (client disconnect) don't need inference
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                return
+            self._record(batch)
+            try:
+                results = await run_inference(self.fn, [item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _record(self, batch):
+        now = time.monotonic()
+        waits = [now - enqueued for _, _, enqueued in batch]
+        # power-of-two buckets: 1, 2, 4, 8, ...
+        self._batch_sizes[1 << (len(batch) - 1).bit_length()] += 1
+        self._batches += 1
+        self._items += len(batch)
+        self._wait_total += sum(waits)
+        self._wait_max = max(self._wait_max, max(waits))
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+            "batch_size_histogram": {f"le_{k}": v for k, v in sorted(self._batch_sizes.items())},
+            "avg_wait_ms": 1000.0 * self._wait_total / self._items if self._items else 0.0,
+            "max_wait_ms": 1000.0 * self._wait_max
+        }
+
+
+# (encoded probe image, detector policy) -> embedding, shared by search and verify
+probe_embedder = EmbeddingBatcher(
+    embed_probes,
+    max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+    max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS,
+    concurrency=max(1, settings.INFERENCE_WORKERS)
+)
+
+
+async def embed_probe(data: bytes, detector: str) -> Optional[List[float]]:
+    """
+    Embedding for an encoded probe image: from the inference cache, else
+    run through the micro-batcher, which decodes it in the inference
+    worker. None if the image can't be decoded, [] if no embedding could
+    be computed. Raises ImageTooLarge.
+    """
+    key = inference_cache.key("probe", data, EMBED_MODEL_NAME, detector)
+    emb = await inference_cache.get(key)
+    if emb is not None:
+        return emb
+    # header only: one oversized probe must not fail the whole batch in the worker
+    check_image_size(data)
+    emb = await probe_embedder.submit((bytes(data), detector))
+    if emb:
+        await inference_cache.set(key, emb)
+    return emb
@@ -0,0 +1,58 @@
+# backend/app/services/face_attributes.py
+from typing import List, Optional
+import numpy as np
+from pymongo import UpdateOne
+from app.db.mongo import images_collection, embeddings_collection, settings_collection
+from app.services.face_detection import analyze_face_batch, ATTRIBUTE_MODES
+from app.services.faiss_index import tenant_indexes, filter_attributes, record_index_change, DEFAULT_NAMESPACE
+from app.services.inference_pool import run_inference
+from bson import ObjectId
+
+DEFAULT_ATTRIBUTE_MODE = "off"
+
+
+async def user_attribute_mode(user_id: str, requested: Optional[str] = None) -> str:
+    """The per-request mode if given, else the user's setting (off unless they opted in)."""
+    if requested in ATTRIBUTE_MODES:
+        return requested
+    s = await settings_collection.find_one({"user_id": user_id}, {"attribute_analysis": 1})
+    mode = (s or {}).get("attribute_analysis")
+    return mode if mode in ATTRIBUTE_MODES else DEFAULT_ATTRIBUTE_MODE
+
+
+async def patch_face_attributes(user_id: str, image_id: str, face_ids: List[str],
+                                crops: List[np.ndarray]):
+    """
+    Deferred attribute analysis: run the age/gender/emotion models on the
+    crops kept from upload, then patch the image doc, the embedding docs
+    and the search index filters. face_ids/crops are in image doc order.
+    """
+    try:
+        attributes = await run_inference(analyze_face_batch, crops)
+    except Exception as e:
+        print(f"Deferred attribute analysis failed for image {image_id}: {e}")
+        await images_collection.update_one({"_id": ObjectId(image_id)}, {"$set": {"attributes_status": "failed"}})
+        return
+
+    update = {"attributes_status": "done"}
+    for i, attrs in enumerate(attributes):
+        for field, value in attrs.items():
+            update[f"faces.{i}.{field}"] = value
+    await images_collection.update_one({"_id": ObjectId(image_id)}, {"$set": update})
+
+    await embeddings_collection.bulk_write(
+        [UpdateOne({"face_id": face_id}, {"$set": attrs}) for face_id, attrs in zip(face_ids, attributes)],
+        ordered=False
+    )
+
+    # re-read so a label or namespace set by an enroll in the meantime is kept
+    by_namespace = {}
+    async for doc in embeddings_collection.find(
+        {"face_id": {"$in": face_ids}, "user_id": user_id},
+        {"_id": 0, "face_id": 1, "namespace": 1, "label": 1, "age": 1, "gender": 1, "emotion": 1}
+    ):
+        by_namespace.setdefault(doc.get("namespace") or DEFAULT_NAMESPACE, []).append(doc)
+    for namespace, docs in by_namespace.items():
+        await record_index_change(user_id, namespace, [d["face_id"] for d in docs])
+        index = await tenant_indexes.get(user_id, namespace)
+        index.update_attributes([d["face_id"] for d in docs], [filter_attributes(d) for d in docs])
@@ -0,0 +1,77 @@
+# backend/app/services/face_crops.py
+import asyncio
+from typing import List, Optional
+from app.db.mongo import images_collection, settings_collection
+from app.services.face_detection import render_face_crop, CROP_MODES
+from app.services.face_metadata import invalidate_face_metadata
+from app.services.storage_service import storage_service
+from bson import ObjectId
+
+# crops are cut on first request, so tenants that never view them don't pay for them
+DEFAULT_CROP_MODE = "lazy"
+
+
+async def user_crop_mode(user_id: str, requested: Optional[str] = None) -> str:
+    """The per-request crop mode if given, else the user's setting."""
+    if requested in CROP_MODES:
+        return requested
+    s = await settings_collection.find_one({"user_id": user_id}, {"crop_storage": 1})
+    mode = (s or {}).get("crop_storage")
+    return mode if mode in CROP_MODES else DEFAULT_CROP_MODE
+
+
+async def persist_crops(faces: List[dict]):
+    """
+    Store the JPEG crops detection attached to faces ("crop_jpeg"), all
+    uploads in flight at once, and set each face's crop_s3 key. Keys are
+    content hashes, so a crop seen before is not stored twice.
+    """
+    jpegs = [f.pop("crop_jpeg", None) for f in faces]
+    keys = [storage_service.crop_key(jpeg) if jpeg else None for jpeg in jpegs]
+    objects = {key: jpeg for key, jpeg in zip(keys, jpegs) if key}
+    if not objects:
+        return
+    try:
+        await storage_service.put_many(list(objects.items()))
+    except Exception as e:
+        # crops are optional; a failed upload leaves them to be cut lazily
+        print(f"Crop upload failed: {e}")
+        return
+    for face, key in zip(faces, keys):
+        face["crop_s3"] = key
+
+
+async def get_face_crop(user_id: str, image_id: str, face_id: str) -> Optional[bytes]:
+    """
+    JPEG crop of one of the user's faces; None if there is no such face.
+    Crops not stored yet are cut from the original image and, unless the
+    user's crop mode is off, stored for next time.
+    """
+    if not ObjectId.is_valid(image_id):
+        return None
+    doc = await images_collection.find_one(
+        {"_id": ObjectId(image_id), "user_id": user_id},
+        {"s3_key": 1, "faces": 1}
+    )
+    face = next((f for f in (doc or {}).get("faces", []) if f.get("face_id") == face_id), None)
+    if face is None:
+        return None
+    if face.get("crop_s3"):
+        try:
+            return await storage_service.download_file(face["crop_s3"])
+        except Exception as e:
+            # stored crop missing: cut it again below
+            print(f"Stored crop {face['crop_s3']} unreadable: {e}")
+
+    original = await storage_service.download_file(doc["s3_key"])
+    jpeg = await asyncio.to_thread(render_face_crop, original, face.get("bbox"), face.get("landmarks"))
+    if jpeg is None or await user_crop_mode(user_id) == "off":
+        return jpeg
+
+    key = await storage_service.put_file(storage_service.crop_key(jpeg), jpeg)
+    await images_collection.update_one(
+        {"_id": doc["_id"], "faces.face_id": face_id},
+        {"$set": {"faces.$.crop_s3": key}}
+    )
+    invalidate_face_metadata(face_id)
+    return jpeg
@@ -1,84 +1,372 @@
 # backend/app/services/face_detection.py (replace/extend)
 from deepface import DeepFace
+from deepface.modules import preprocessing
+from deepface.extendedmodels import Emotion, Gender
 import cv2
 import numpy as np
-from typing import List, Dict
-from app.services.image_storage import upload_to_s3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+from app.core.config import settings
+from app.services.detector_stats import detector_stats
+from app.utils.image_io import ImageInput, decode_image_scaled, downscale, load_image
 import io
 
 DEEPFACE_MODEL = None
-EMBED_MODEL_NAME = "ArcFace"  # or 'Facenet' depending on accuracy vs speed
+EMBED_MODEL_NAME = settings.EMBED_MODEL_NAME  # e.g. 'Facenet' depending on accuracy vs speed
+DETECTOR_BACKEND = "mtcnn"
+FAST_DETECTOR_BACKEND = "opencv"
+# Detector policies: backends tried in order, and whether low-confidence or
+# small faces (not only "no face") send the image on to the next backend
+DETECTOR_CASCADES = {
+    "fast": ((FAST_DETECTOR_BACKEND, DETECTOR_BACKEND), False),
+    "balanced": ((FAST_DETECTOR_BACKEND, DETECTOR_BACKEND), True),
+    "accurate": ((DETECTOR_BACKEND,), False),
+}
+ATTRIBUTE_MODELS = ("Age", "Gender", "Emotion")
+ATTRIBUTE_INPUT_SIZE = (224, 224)
+# off: skip age/gender/emotion; sync: compute during upload;
+# deferred: return crops so the caller can compute them after responding
+ATTRIBUTE_MODES = ("off", "sync", "deferred")
+ATTRIBUTE_MODE_PATTERN = r"^(off|sync|deferred)$"
+NO_ATTRIBUTES = {"age": None, "gender": None, "emotion": None}
+EMOTION_INPUT_SIZE = (48, 48)
+# Face crops: eager (stored at upload), lazy (stored on first request) or off (never stored)
+CROP_MODES = ("eager", "lazy", "off")
+CROP_MODE_PATTERN = r"^(eager|lazy|off)$"
+CROP_JPEG_QUALITY = 90
+
+_models_ready = threading.Event()
+_load_lock = threading.Lock()
+_encode_pool = None
 
 def _load_model():
+    """Build every model once; DeepFace keeps them cached for later calls."""
     global DEEPFACE_MODEL
     if DEEPFACE_MODEL is None:
-        # DeepFace will load models internally on first call to represent/extract
-        DEEPFACE_MODEL = True
+        with _load_lock:
+            if DEEPFACE_MODEL is None:
+                for name in {settings.FACE_DETECTION_MODEL, *ATTRIBUTE_MODELS}:
+                    DeepFace.build_model(name)
+                DEEPFACE_MODEL = DeepFace.build_model(EMBED_MODEL_NAME)
     return DEEPFACE_MODEL
 
-def detect_faces_from_image_bytes(image_bytes: bytes) -> List[Dict]:
+def warmup_models():
+    """
+    Load the detectors, embedding and attribute models and push a dummy
+    image through each, so the first real request doesn't pay for model
+    loading or graph tracing. Marks the process ready when done.
+    """
+    started = time.monotonic()
     _load_model()
-    arr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if img is None:
-        return []
+    dummy = np.full((224, 224, 3), 128, dtype=np.uint8)
+    for backend in {DETECTOR_BACKEND, FAST_DETECTOR_BACKEND, settings.FACE_DETECTION_BACKEND}:
+        DeepFace.extract_faces(img_path=dummy, detector_backend=backend, enforce_detection=False)
+    embed_face_batch([dummy])
+    embed_face_batch([dummy], settings.FACE_DETECTION_MODEL)
+    analyze_face_batch([dummy])
+    DeepFace.represent(img_path=dummy, model_name=settings.FACE_DETECTION_MODEL,
+                       detector_backend="skip", enforce_detection=False)
+    DeepFace.analyze(img_path=dummy, actions=['age', 'gender', 'emotion'],
+                     detector_backend="skip", enforce_detection=False, silent=True)
+    mark_models_ready()
+    print(f"Model warmup finished in {time.monotonic() - started:.1f}s")
+
+def mark_models_ready():
+    _models_ready.set()
+
+def models_ready() -> bool:
+    return _models_ready.is_set()
+
+def new_face_id() -> str:
+    return f"face_{uuid.uuid4().hex}"
+
+def _rescale_area(area: Dict, factor: float) -> Dict:
+    out = {k: int(round(area.get(k, 0) * factor)) for k in ("x", "y", "w", "h")}
+    for eye in ("left_eye", "right_eye"):
+        if area.get(eye) is not None:
+            out[eye] = tuple(int(round(c * factor)) for c in area[eye])
+    return out
+
 
-    # use DeepFace.detectFace? We'll use DeepFace.extract_faces for metadata
-    # DeepFace.extract_faces accepts image path or numpy array for recent versions
+def _aligned_crop(img: np.ndarray, area: Dict) -> np.ndarray:
+    """Eye-levelled face crop taken from img; BGR float in [0, 1] like extract_faces."""
+    x, y, w, h = (area.get(k, 0) for k in ("x", "y", "w", "h"))
+    if w <= 0 or h <= 0:
+        return img.astype(np.float32) / 255.0
+    eyes = [area.get("left_eye"), area.get("right_eye")]
+    if all(eyes):
+        (ax, ay), (bx, by) = sorted(eyes)
+        angle = np.degrees(np.arctan2(by - ay, bx - ax))
+        rot = cv2.getRotationMatrix2D((x + w / 2.0, y + h / 2.0), angle, 1.0)
+        # shift so warpAffine only renders the (w, h) face window
+        rot[0, 2] -= x
+        rot[1, 2] -= y
+        face = cv2.warpAffine(img, rot, (w, h), flags=cv2.INTER_LINEAR)
+    else:
+        face = img[max(y, 0):y + h, max(x, 0):x + w]
+    return face.astype(np.float32) / 255.0
+
+
+def _run_detector(img: np.ndarray, backend: str) -> List[Dict]:
+    started = time.perf_counter()
     try:
-        extracted = DeepFace.extract_faces(img_path=img, detector_backend='mtcnn', enforce_detection=False)
+        # crops are cut and aligned by _aligned_crop, so skip DeepFace's own alignment
+        extracted = DeepFace.extract_faces(img_path=img, detector_backend=backend, enforce_detection=False,
+                                           align=False)
     except Exception:
         extracted = []
+    detector_stats.record(backend, time.perf_counter() - started)
+    return extracted
+
+
+def _found(extracted: List[Dict], img: np.ndarray) -> List[Dict]:
+    """
+    Real detections only: with enforce_detection=False "no face" comes
+    back as the whole image at confidence 0.
+    """
+    height, width = img.shape[:2]
+
+    def is_pseudo_face(area: Dict) -> bool:
+        return (area.get("x", 0), area.get("y", 0), area.get("w"), area.get("h")) == (0, 0, width, height)
+
+    return [
+        e for e in extracted
+        if e.get("confidence") and not is_pseudo_face(e.get("facial_area") or {})
+    ]
+
 
+def _needs_fallback(found: List[Dict], check_quality: bool) -> bool:
+    if not found:
+        return True
+    if not check_quality:
+        return False
+    return any(
+        e["confidence"] < settings.CASCADE_MIN_CONFIDENCE
+        or min(e["facial_area"].get("w", 0), e["facial_area"].get("h", 0)) < settings.CASCADE_MIN_FACE_SIZE
+        for e in found
+    )
+
+
+def _cascade_detect(img: np.ndarray, detector: str) -> List[Dict]:
+    """
+    Run a detector policy (DETECTOR_CASCADES) or a single named backend
+    and return the faces it found, never the whole-image pseudo-face.
+    The next backend only runs when the current one isn't good enough; a
+    fallback that finds nothing doesn't discard what an earlier one found.
+    """
+    backends, check_quality = DETECTOR_CASCADES.get(detector, ((detector,), False))
     faces = []
+    for i, backend in enumerate(backends):
+        found = _found(_run_detector(img, backend), img)
+        if found:
+            faces = found
+        if i == len(backends) - 1 or not _needs_fallback(found, check_quality):
+            break
+        detector_stats.record_fallback(backend)
+    return faces
+
+
+def _detect_faces(img: np.ndarray, detector: str) -> List[Dict]:
+    """
+    Run the detector (policy or backend) on a copy downscaled to
+    DETECTION_MAX_SIDE, map the facial areas back to img coordinates and
+    take the aligned crops from img itself, so embeddings keep full
+    resolution. Every crop goes through _aligned_crop, scaled or not, so
+    the models always see one alignment. Entries have facial_area,
+    confidence and face (aligned BGR crop in [0, 1]).
+    """
+    small, scale = downscale(img, settings.DETECTION_MAX_SIDE)
+    extracted = _cascade_detect(small, detector)
+
+    detected = []
     for e in extracted:
-        face_img = e.get("face")  # numpy array of the cropped face by DeepFace
-        facial_area = e.get("facial_area", {})
-        bbox = [int(facial_area.get("x",0)), int(facial_area.get("y",0)),
-                int(facial_area.get("w",0)), int(facial_area.get("h",0))] if isinstance(facial_area, dict) else [0,0,0,0]
+        area = e.get("facial_area") if isinstance(e.get("facial_area"), dict) else {}
+        if scale != 1.0:
+            area = _rescale_area(area, 1.0 / scale)
+        detected.append({"facial_area": area, "confidence": e.get("confidence"), "face": _aligned_crop(img, area)})
+    return detected
 
-        # compute embedding
-        try:
-            emb = DeepFace.represent(img_path=face_img, model_name=EMBED_MODEL_NAME, enforce_detection=False)
-            if isinstance(emb, dict) and "embedding" in emb:
-                embedding = emb["embedding"]
-            else:
-                embedding = emb
-        except Exception:
-            embedding = None
 
-        # compute attributes (age, gender, emotion) using DeepFace.analyze
-        try:
-            attrs = DeepFace.analyze(img_path=face_img, actions=['age','gender','emotion'], enforce_detection=False)
-            age = int(attrs.get("age")) if attrs.get("age") else None
-            gender = attrs.get("gender")
-            dominant_emotion = attrs.get("dominant_emotion")
-        except Exception:
-            age = None; gender = None; dominant_emotion = None
+def analyze_faces(img: np.ndarray, model_name: str = EMBED_MODEL_NAME, detector: str = "accurate",
+                  with_crops: bool = False, with_attributes: bool = True,
+                  source_scale: float = 1.0) -> List[Dict]:
+    """
+    Detect and align once, then run the embedding and attribute models on
+    the same crops, one batch each. detector is a DETECTOR_CASCADES policy
+    or a single backend. img is a decoded BGR array; if it was
+    decoded at reduced scale, source_scale maps bboxes back to the original.
+    with_crops adds the aligned BGR crop (float, [0, 1]) as "crop";
+    without with_attributes age/gender/emotion are left as None.
+    """
+    _load_model()
+    extracted = _detect_faces(img, detector)
+    crops = [e["face"] for e in extracted]
 
-        # store crop to s3 (optional)
+    # one forward pass per model for all faces in the image
+    try:
+        embeddings = embed_face_batch(crops, model_name)
+    except Exception:
+        embeddings = [None] * len(crops)
+    attributes = [NO_ATTRIBUTES] * len(crops)
+    if with_attributes:
         try:
-            _, buf = cv2.imencode('.jpg', face_img)
-            crop_key = upload_to_s3(buf.tobytes(), f"crop_{np.random.randint(1e9)}.jpg")
+            attributes = analyze_face_batch(crops)
         except Exception:
-            crop_key = None
+            pass
 
-        face_record = {
-            "face_id": f"face_{np.random.randint(1e12)}",
+    faces = []
+    for e, crop, embedding, attrs in zip(extracted, crops, embeddings, attributes):
+        facial_area = e["facial_area"] if source_scale == 1.0 else _rescale_area(e["facial_area"], 1.0 / source_scale)
+        bbox = [int(facial_area.get("x",0)), int(facial_area.get("y",0)),
+                int(facial_area.get("w",0)), int(facial_area.get("h",0))]
+        eyes = {k: list(map(int, facial_area[k])) for k in ("left_eye", "right_eye") if facial_area.get(k) is not None}
+        face = {
+            "face_id": new_face_id(),
             "bbox": bbox,
-            "landmarks": e.get("keypoints") or None,
+            "landmarks": eyes or None,
             "confidence": float(e.get("confidence", 1.0) or 1.0),
             "embedding": embedding,
-            "crop_s3": crop_key,
-            "age": age,
-            "gender": gender,
-            "emotion": dominant_emotion,
-            "quality": None
+            "age": attrs["age"],
+            "gender": attrs["gender"],
+            "emotion": attrs["emotion"]
         }
-        faces.append(face_record)
+        if with_crops:
+            face["crop"] = crop
+        faces.append(face)
+    return faces
+
+
+def encode_crops(crops: List[np.ndarray]) -> List[Optional[bytes]]:
+    """JPEG-encode uint8 BGR crops, several at once (cv2 releases the GIL); None where encoding failed."""
+    def encode(crop):
+        try:
+            ok, buf = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, CROP_JPEG_QUALITY])
+        except cv2.error:
+            # empty crop (face box outside the image)
+            return None
+        return buf.tobytes() if ok else None
+
+    if len(crops) <= 1:
+        return [encode(c) for c in crops]
+    global _encode_pool
+    if _encode_pool is None:
+        _encode_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="crop-encode")
+    return list(_encode_pool.map(encode, crops))
+
+
+def detect_faces_from_image_bytes(image_bytes: bytes, attributes: str = "sync", detector: str = "accurate",
+                                  crops: str = "lazy") -> List[Dict]:
+    """
+    Faces with embeddings and, depending on the attribute mode, age/gender/
+    emotion. In "deferred" mode each face keeps its aligned crop (uint8 BGR)
+    under "crop" for a later analyze_face_batch call. With crops="eager"
+    each face also carries its JPEG-encoded crop as "crop_jpeg" for the
+    caller to store; nothing is uploaded here.
+    """
+    img, scale = decode_image_scaled(image_bytes)
+    if img is None:
+        return []
+
+    faces = analyze_faces(img, detector=detector, with_crops=True,
+                          with_attributes=attributes == "sync", source_scale=scale)
+    face_crops = [(face.pop("crop") * 255).astype(np.uint8) for face in faces]
+    encoded = encode_crops(face_crops) if crops == "eager" else [None] * len(faces)
+    for face, crop, jpeg in zip(faces, face_crops, encoded):
+        if attributes == "deferred":
+            face["crop"] = crop
+        if jpeg is not None:
+            face["crop_jpeg"] = jpeg
+        face.update({"crop_s3": None, "quality": None})
 
     return faces
 
+
+def render_face_crop(image_bytes: bytes, bbox: List[int], landmarks: Optional[Dict] = None) -> Optional[bytes]:
+    """
+    JPEG crop of a stored face, re-cut from the original image by its bbox
+    and eye landmarks (original coordinates). Used for lazily stored crops.
+    """
+    img, scale = decode_image_scaled(image_bytes)
+    if img is None or not bbox:
+        return None
+    area = dict(zip(("x", "y", "w", "h"), bbox))
+    area.update(landmarks or {})
+    if scale != 1.0:
+        area = _rescale_area(area, scale)
+    crop = (_aligned_crop(img, area) * 255).astype(np.uint8)
+    return encode_crops([crop])[0]
+
+def _probe_face(img_array, detector: str = "fast") -> np.ndarray:
+    """Detect and align the main face of a probe image; BGR crop."""
+    extracted = _detect_faces(img_array, detector)
+    if not extracted:
+        return img_array
+    return extracted[0]["face"]
+
+
+def embed_face_batch(faces: List[np.ndarray], model_name: str = EMBED_MODEL_NAME) -> List[List[float]]:
+    """Embed a stack of aligned BGR face crops with one forward pass."""
+    if not faces:
+        return []
+    model = DeepFace.build_model(model_name)
+    target_size = (model.input_shape[1], model.input_shape[0])
+    batch = np.concatenate([preprocessing.resize_image(img=f, target_size=target_size) for f in faces])
+    batch = preprocessing.normalize_input(img=batch, normalization="base")
+    return model.model(batch, training=False).numpy().tolist()
+
+
+def analyze_face_batch(faces: List[np.ndarray]) -> List[Dict]:
+    """
+    Age, gender and dominant emotion for a stack of aligned BGR face crops.
+    Same preprocessing as DeepFace.analyze, but each model runs once on the
+    whole (n, H, W, 3) batch instead of once per face.
+    """
+    if not faces:
+        return []
+    batch = np.concatenate([preprocessing.resize_image(img=f, target_size=ATTRIBUTE_INPUT_SIZE) for f in faces])
+    age_probs = DeepFace.build_model("Age").model(batch, training=False).numpy()
+    gender_probs = DeepFace.build_model("Gender").model(batch, training=False).numpy()
+    # the emotion model takes 48x48 grayscale
+    gray = np.stack([cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), EMOTION_INPUT_SIZE) for img in batch])
+    emotion_probs = DeepFace.build_model("Emotion").model(gray[..., np.newaxis], training=False).numpy()
+
+    # apparent age is the expectation over the 0..100 age classes
+    ages = age_probs @ np.arange(age_probs.shape[1])
+    return [
+        {
+            "age": int(age),
+            "gender": Gender.labels[int(np.argmax(g))],
+            "emotion": Emotion.labels[int(np.argmax(em))]
+        }
+        for age, g, em in zip(ages, gender_probs, emotion_probs)
+    ]
+
+
+def embed_probes(probes: List[Tuple[ImageInput, str]]) -> List[Optional[List[float]]]:
+    """
+    (probe image or its encoded bytes, detector policy) pairs -> embeddings,
+    one model call for all probes. Bytes are decoded here, in the worker;
+    None for those that don't decode.
+    """
+    _load_model()
+    imgs = [load_image(image)[0] for image, _ in probes]
+    valid = [(img, detector) for img, (_, detector) in zip(imgs, probes) if img is not None]
+    try:
+        embs = embed_face_batch([_probe_face(img, detector) for img, detector in valid])
+    except Exception:
+        embs = [[] for _ in valid]
+    it = iter(embs)
+    return [next(it) if img is not None else None for img in imgs]
+
+
+def compute_embeddings_from_images(images: List[ImageInput], detector: str = "fast") -> List[Optional[List[float]]]:
+    """Batch version of compute_embedding_from_image: one model call for all probes."""
+    return embed_probes([(image, detector) for image in images])
+
+
 def compute_embedding_from_image(img_array) -> List[float]:
     _load_model()
     try:
@@ -0,0 +1,60 @@
+# backend/app/services/face_metadata.py
+from typing import Dict, Iterable
+from bson import ObjectId
+from app.core.config import settings
+from app.db.mongo import embeddings_collection, images_collection
+from app.utils.cache import LRUCache
+
+# face_id -> {"image_id", "label", "s3_crop"}; invalidated on enroll/delete
+face_metadata_cache = LRUCache(
+    maxsize=settings.FACE_METADATA_CACHE_SIZE,
+    ttl=settings.FACE_METADATA_CACHE_TTL_SECONDS
+)
+
+
+async def get_face_metadata(face_ids: Iterable[str]) -> Dict[str, dict]:
+    """
+    Metadata for search hits: served from the cache, with misses loaded by
+    one $in query per collection instead of two find_one calls per face.
+    """
+    found = {}
+    missing = []
+    for face_id in face_ids:
+        meta = face_metadata_cache.get(face_id)
+        if meta is None:
+            missing.append(face_id)
+        else:
+            found[face_id] = meta
+    if not missing:
+        return found
+
+    docs = await embeddings_collection.find(
+        {"face_id": {"$in": missing}},
+        {"_id": 0, "face_id": 1, "image_id": 1, "label": 1}
+    ).to_list(length=None)
+
+    image_ids = {str(d["image_id"]) for d in docs if d.get("image_id")}
+    crops = {}
+    if image_ids:
+        img_docs = await images_collection.find(
+            {"_id": {"$in": [ObjectId(i) for i in image_ids if ObjectId.is_valid(i)]}},
+            {"faces.face_id": 1, "faces.crop_s3": 1}
+        ).to_list(length=None)
+        for img_doc in img_docs:
+            for face in img_doc.get("faces", []):
+                crops[face.get("face_id")] = face.get("crop_s3")
+
+    for d in docs:
+        meta = {
+            "image_id": str(d["image_id"]) if d.get("image_id") else None,
+            "label": d.get("label"),
+            "s3_crop": crops.get(d["face_id"])
+        }
+        face_metadata_cache.set(d["face_id"], meta)
+        found[d["face_id"]] = meta
+    return found
+
+
+def invalidate_face_metadata(*face_ids: str):
+    for face_id in face_ids:
+        face_metadata_cache.pop(face_id)
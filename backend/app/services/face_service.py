@@ -2,50 +2,67 @@ import os
 from typing import List, Optional, Dict, Any
 from deepface import DeepFace
 from app.core.config import settings
+from app.services.face_detection import analyze_faces, new_face_id
+from app.services.inference_cache import inference_cache
+from app.services.inference_pool import run_inference
+from app.utils.image_io import ImageInput, load_image
+
+# Run in the inference workers: images travel there as encoded bytes and are decoded once, in memory
+
+def _analyze(image: ImageInput, model_name: str, detector: str, with_attributes: bool) -> List[dict]:
+    img, scale = load_image(image)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return analyze_faces(img, model_name, detector, with_attributes=with_attributes, source_scale=scale)
+
+def _represent(image: ImageInput, **kwargs):
+    return DeepFace.represent(img_path=load_image(image)[0], **kwargs)
+
+def _verify(image1: ImageInput, image2: ImageInput, **kwargs):
+    return DeepFace.verify(img1_path=load_image(image1)[0], img2_path=load_image(image2)[0], **kwargs)
 
 class FaceService:
     def __init__(self):
         self.model_name = settings.FACE_DETECTION_MODEL
         self.detector_backend = settings.FACE_DETECTION_BACKEND
     
-    async def detect_faces(self, image_path: str) -> List[dict]:
+    async def analyze_image(self, image: ImageInput, with_attributes: bool = True) -> List[dict]:
+        """
+        Detection, attributes and embedding from one detector pass. Each face
+        carries its own "embedding" (None if the model failed on it).
+        Attribute analysis is the expensive part; skip it when not needed.
+        Results for encoded bytes are cached by content.
+        """
+        key = None
+        if isinstance(image, (bytes, bytearray)):
+            key = inference_cache.key("analyze", image, self.model_name, settings.DETECTOR_POLICY_UPLOAD, with_attributes)
+            faces = await inference_cache.get(key)
+            if faces is not None:
+                # same pixels, new faces: face_id is unique per stored face
+                for face in faces:
+                    face["face_id"] = new_face_id()
+                return faces
         try:
-            objs = DeepFace.analyze(
-                img_path=image_path,
-                actions=['age', 'gender', 'emotion'],
-                detector_backend=self.detector_backend,
-                enforce_detection=False,
-                silent=True
-            )
-            
-            faces_metadata = []
-            for obj in objs:
-                face_data = {
-                    "face_id": str(obj.get("face_id", "default_id")),
-                    "bbox": [
-                        obj.get("region", {}).get("x", 0),
-                        obj.get("region", {}).get("y", 0),
-                        obj.get("region", {}).get("w", 0),
-                        obj.get("region", {}).get("h", 0)
-                    ],
-                    "confidence": obj.get("face_confidence", 0.99),
-                    "age": obj.get("age"),
-                    "gender": obj.get("dominant_gender"),
-                    "emotion": obj.get("dominant_emotion"),
-                    "quality": self._calculate_face_quality(obj)
-                }
-                faces_metadata.append(face_data)
-            
-            return faces_metadata
+            faces = await run_inference(_analyze, image, self.model_name, settings.DETECTOR_POLICY_UPLOAD, with_attributes)
+            for face in faces:
+                face["quality"] = self._calculate_face_quality(face)
+            if key:
+                await inference_cache.set(key, faces)
+            return faces
             
         except Exception as e:
             print(f"Face detection error: {e}")
             return []
     
-    async def extract_embedding(self, image_path: str) -> Optional[List[float]]:
+    async def detect_faces(self, image: ImageInput) -> List[dict]:
+        faces = await self.analyze_image(image)
+        return [{k: v for k, v in face.items() if k != "embedding"} for face in faces]
+    
+    async def extract_embedding(self, image: ImageInput) -> Optional[List[float]]:
         try:
-            embedding_objs = DeepFace.represent(
-                img_path=image_path,
+            embedding_objs = await run_inference(
+                _represent,
+                image,
                 model_name=self.model_name,
                 detector_backend=self.detector_backend,
                 enforce_detection=False
@@ -59,11 +76,12 @@ class FaceService:
             print(f"Embedding extraction error: {e}")
             return None
     
-    async def compare_faces(self, image1_path: str, image2_path: str) -> dict:
+    async def compare_faces(self, image1: ImageInput, image2: ImageInput) -> dict:
         try:
-            result = DeepFace.verify(
-                img1_path=image1_path,
-                img2_path=image2_path,
+            result = await run_inference(
+                _verify,
+                image1,
+                image2,
                 model_name=self.model_name,
                 detector_backend=self.detector_backend,
                 enforce_detection=False,
@@ -91,7 +109,7 @@ class FaceService:
     
     def _calculate_face_quality(self, face_data: dict) -> float:
         quality_score = 0.5
-        confidence = face_data.get("face_confidence", 0)
+        confidence = face_data.get("confidence", 0)
         quality_score += confidence * 0.3
         
         if face_data.get("age") and face_data.get("gender"):
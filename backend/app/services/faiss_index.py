@@ -1,80 +1,996 @@
 # backend/app/services/faiss_index.py
+import asyncio
 import faiss
 import numpy as np
 import os
-import pickle
-from typing import List, Tuple
-from app.db.mongo import embeddings_collection
+import re
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Sequence
+from pymongo import ReturnDocument
+from app.db.mongo import embeddings_collection, counters_collection
+from app.utils.embedding_codec import decode_embedding
 
 INDEX_DIR = os.environ.get("FAISS_INDEX_DIR", "/tmp/faiss")
-INDEX_PATH = os.path.join(INDEX_DIR, "face_index.faiss")
-META_PATH = os.path.join(INDEX_DIR, "face_index_meta.pkl")
+INDEX_FILE = "face_index.faiss"
+# id map: sorted int64 ids + fixed-width face_id bytes, both np.load(mmap_mode='r')-able
+IDS_FILE = "face_index_ids.npy"
+KEYS_FILE = "face_index_keys.npy"
+ATTRS_FILE = "face_index_attrs.npz"
+# who the index belongs to, checked on load: tenant directories are named by hash
+OWNER_FILE = "owner"
+# change-log sequence number the persisted index was built at
+VERSION_FILE = "version"
+# mmap persisted IVF indexes so uvicorn workers on a host share pages
+# (faiss maps only IVF inverted lists; flat and HNSW are always read into RAM)
+MMAP_INDEX = os.environ.get("FAISS_MMAP", "1") == "1"
+
+# Index type: auto | flat | ivf_flat | ivf_pq | hnsw
+INDEX_MODE = os.environ.get("FAISS_INDEX_MODE", "auto")
+INDEX_MODES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# auto policy: exact search for small galleries, IVF up to a few million, IVF-PQ beyond
+FLAT_MAX_VECTORS = int(os.environ.get("FAISS_FLAT_MAX_VECTORS", "100000"))
+IVF_FLAT_MAX_VECTORS = int(os.environ.get("FAISS_IVF_FLAT_MAX_VECTORS", "2000000"))
+# IVF/PQ need enough points to train k-means; below this we fall back to flat
+IVF_MIN_VECTORS = int(os.environ.get("FAISS_IVF_MIN_VECTORS", "10000"))
+TRAIN_SAMPLE_SIZE = int(os.environ.get("FAISS_TRAIN_SAMPLE_SIZE", "200000"))
+PQ_M = int(os.environ.get("FAISS_PQ_M", "64"))  # sub-quantizers, must divide dim
+HNSW_M = int(os.environ.get("FAISS_HNSW_M", "32"))
+DEFAULT_NPROBE = int(os.environ.get("FAISS_NPROBE", "16"))
+DEFAULT_EF_SEARCH = int(os.environ.get("FAISS_EF_SEARCH", "64"))
+# Streaming rebuilds: cursor batch size and background schedule
+BUILD_BATCH_SIZE = int(os.environ.get("FAISS_BUILD_BATCH_SIZE", "5000"))
+REBUILD_INTERVAL_SECONDS = int(os.environ.get("FAISS_REBUILD_INTERVAL_SECONDS", "3600"))
+# Per-tenant indexes: one per (user_id, namespace), LRU-evicted past this budget
+TENANT_MEMORY_BUDGET_MB = int(os.environ.get("FAISS_TENANT_MEMORY_BUDGET_MB", "4096"))
+# Cross-worker sync: every embedding write bumps a per-tenant counter and logs
+# the face_ids it touched; loaded indexes replay the log, or rebuild past it
+SYNC_INTERVAL_SECONDS = float(os.environ.get("FAISS_SYNC_INTERVAL_SECONDS", "2"))
+CHANGE_LOG_SIZE = int(os.environ.get("FAISS_CHANGE_LOG_SIZE", "200"))
+CHANGE_MAX_FACES = int(os.environ.get("FAISS_CHANGE_MAX_FACES", "500"))  # bigger changes force a rebuild
+DEFAULT_NAMESPACE = "default"
+NAMESPACE_PATTERN = r"^[A-Za-z0-9_.-]{1,64}$"
+
+
+def face_id_to_int64(face_id: str) -> int:
+    """Stable non-negative int64 id for a face_id string (FAISS ids are int64)."""
+    digest = hashlib.blake2b(face_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFFFFFFFFFFFFFF
+
+
+def _as_matrix(vectors, dim: int) -> np.ndarray:
+    # copy: normalize_L2 works in place and must not touch the caller's vectors
+    mat = np.ascontiguousarray(np.array(vectors, dtype='float32').reshape(-1, dim))
+    faiss.normalize_L2(mat)
+    return mat
+
+
+def _save_array(path: str, arr: np.ndarray):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    # rename, never rewrite in place: other workers may have the old file mapped
+    os.replace(tmp, path)
+
+
+class IdTable:
+    """
+    int64 FAISS id -> face_id. The bulk is two sorted numpy arrays that can
+    be memory-mapped; changes since the last build live in small overlays.
+    """
+    def __init__(self, ids: Optional[np.ndarray] = None, keys: Optional[np.ndarray] = None):
+        self.ids = ids if ids is not None else np.empty(0, dtype='int64')
+        self.keys = keys if keys is not None else np.empty(0, dtype='S1')
+        self._added = {}
+        self._removed = set()
+
+    @classmethod
+    def from_pairs(cls, ids: np.ndarray, face_ids: List[str]) -> "IdTable":
+        if not face_ids:
+            return cls()
+        order = np.argsort(ids, kind='stable')
+        keys = np.array([f.encode("utf-8") for f in face_ids], dtype='S')
+        return cls(ids[order], keys[order])
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> Optional["IdTable"]:
+        ids_path = os.path.join(index_dir, IDS_FILE)
+        keys_path = os.path.join(index_dir, KEYS_FILE)
+        if not (os.path.exists(ids_path) and os.path.exists(keys_path)):
+            return None
+        mode = 'r' if mmap else None
+        return cls(np.load(ids_path, mmap_mode=mode), np.load(keys_path, mmap_mode=mode))
+
+    def save(self, index_dir: str):
+        _save_array(os.path.join(index_dir, IDS_FILE), np.asarray(self.ids))
+        _save_array(os.path.join(index_dir, KEYS_FILE), np.asarray(self.keys))
+
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.keys.nbytes + 100 * len(self._added)
+
+    def get(self, i: int, default=None) -> Optional[str]:
+        if i in self._added:
+            return self._added[i]
+        if i in self._removed:
+            return default
+        pos = int(np.searchsorted(self.ids, i))
+        if pos < len(self.ids) and self.ids[pos] == i:
+            return self.keys[pos].decode("utf-8")
+        return default
+
+    def __contains__(self, i: int) -> bool:
+        return self.get(i) is not None
+
+    def used(self, i: int) -> bool:
+        """Whether i was ever assigned here, even if removed since."""
+        return i in self._removed or i in self
+
+    def update(self, pairs):
+        for i, face_id in pairs:
+            self._added[i] = face_id
+            self._removed.discard(i)
+
+    def pop(self, i: int, default=None) -> Optional[str]:
+        face_id = self.get(i)
+        if face_id is None:
+            return default
+        self._added.pop(i, None)
+        self._removed.add(i)
+        return face_id
+
+
+FILTER_FIELDS = ("label", "age", "gender", "emotion")
+
+
+def filter_attributes(face: dict) -> dict:
+    """The subset of a face/embedding doc that filtered search can use."""
+    return {k: face.get(k) for k in FILTER_FIELDS}
+
+
+class AttributeTable:
+    """
+    Compact per-face filter columns keyed by FAISS id. Strings (label,
+    gender, emotion) are dictionary-encoded; -1 means unknown. select()
+    turns a filter into the id subset handed to FAISS as an IDSelector.
+    """
+    STRING_COLUMNS = ("label", "gender", "emotion")
+
+    def __init__(self, capacity: int = 0):
+        self.ids = np.empty(capacity, dtype='int64')
+        self.age = np.empty(capacity, dtype='int16')
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.codes = {c: np.empty(capacity, dtype='int32') for c in self.STRING_COLUMNS}
+        self.vocab = {c: {} for c in self.STRING_COLUMNS}
+        self._rows = {}
+        self._size = 0
+
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * len(self.ids), 1024)
+        self.ids = np.resize(self.ids, capacity)
+        self.age = np.resize(self.age, capacity)
+        self.alive = np.concatenate([self.alive[:self._size], np.zeros(capacity - self._size, dtype=bool)])
+        self.codes = {c: np.resize(col, capacity) for c, col in self.codes.items()}
+
+    def _encode(self, column: str, value) -> int:
+        if not isinstance(value, str):
+            return -1
+        return self.vocab[column].setdefault(value, len(self.vocab[column]))
+
+    def set(self, ids: np.ndarray, attributes: Sequence[Optional[dict]]):
+        if self._size + len(ids) > len(self.ids):
+            self._grow(self._size + len(ids))
+        for i, attrs in zip(ids.tolist(), attributes):
+            attrs = attrs or {}
+            row = self._rows.get(i)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._rows[i] = row
+                self.ids[row] = i
+            age = attrs.get("age")
+            self.age[row] = int(age) if isinstance(age, (int, float)) else -1
+            for c in self.STRING_COLUMNS:
+                self.codes[c][row] = self._encode(c, attrs.get(c))
+            self.alive[row] = True
+
+    def remove(self, ids: np.ndarray):
+        for i in ids.tolist():
+            row = self._rows.get(i)
+            if row is not None:
+                self.alive[row] = False
+
+    def select(self, label: Optional[str] = None, gender: Optional[str] = None,
+               emotion: Optional[str] = None, min_age: Optional[int] = None,
+               max_age: Optional[int] = None, enrolled: Optional[bool] = None) -> np.ndarray:
+        """FAISS ids of live faces matching every given filter."""
+        n = self._size
+        mask = self.alive[:n].copy()
+        for column, value in (("label", label), ("gender", gender), ("emotion", emotion)):
+            if value is not None:
+                code = self.vocab[column].get(value)
+                if code is None:
+                    return np.empty(0, dtype='int64')
+                mask &= self.codes[column][:n] == code
+        if enrolled is not None:
+            mask &= (self.codes["label"][:n] >= 0) == enrolled
+        if min_age is not None:
+            mask &= self.age[:n] >= min_age
+        if max_age is not None:
+            mask &= (self.age[:n] >= 0) & (self.age[:n] <= max_age)
+        return self.ids[:n][mask]
+
+    def nbytes(self) -> int:
+        return self._size * (8 + 2 + 1 + 4 * len(self.STRING_COLUMNS) + 100)
+
+    def save(self, index_dir: str):
+        n = self._size
+        live = self.alive[:n]
+        arrays = {"ids": self.ids[:n][live], "age": self.age[:n][live]}
+        for c in self.STRING_COLUMNS:
+            arrays[c] = self.codes[c][:n][live]
+            vocab = sorted(self.vocab[c], key=self.vocab[c].get)
+            arrays[f"{c}_vocab"] = np.array(vocab, dtype=str)
+        path = os.path.join(index_dir, ATTRS_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "AttributeTable":
+        path = os.path.join(index_dir, ATTRS_FILE)
+        table = cls()
+        if not os.path.exists(path):
+            return table
+        with np.load(path) as data:
+            n = len(data["ids"])
+            table.ids = data["ids"].copy()
+            table.age = data["age"].copy()
+            table.alive = np.ones(n, dtype=bool)
+            for c in cls.STRING_COLUMNS:
+                table.codes[c] = data[c].copy()
+                table.vocab[c] = {v: k for k, v in enumerate(data[f"{c}_vocab"].tolist())}
+        table._rows = {i: row for row, i in enumerate(table.ids.tolist())}
+        table._size = n
+        return table
+
+
+def choose_index_mode(n_vectors: int) -> str:
+    """Pick an index type from the gallery size."""
+    if n_vectors < FLAT_MAX_VECTORS:
+        return "flat"
+    if n_vectors < IVF_FLAT_MAX_VECTORS:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def resolve_index_mode(n_vectors: int, mode: Optional[str] = None) -> str:
+    mode = mode or INDEX_MODE
+    if mode == "auto":
+        mode = choose_index_mode(n_vectors)
+    if mode not in INDEX_MODES:
+        raise ValueError(f"Unknown FAISS index mode: {mode}")
+    if mode.startswith("ivf") and n_vectors < IVF_MIN_VECTORS:
+        return "flat"
+    return mode
+
+
+def make_index(mode: str, dim: int, n_vectors: int = 0):
+    """
+    Index factory. Every mode is wrapped in IDMap2 so ids stay our stable
+    int64 face ids and vectors can be reconstructed.
+    """
+    # ~4*sqrt(n) inverted lists, keeping >= 39 training points per centroid
+    nlist = max(1, min(int(4 * np.sqrt(max(n_vectors, 1))), n_vectors // 39))
+    if mode == "flat":
+        desc = "IDMap2,Flat"
+    elif mode == "ivf_flat":
+        desc = f"IDMap2,IVF{nlist},Flat"
+    elif mode == "ivf_pq":
+        desc = f"IDMap2,IVF{nlist},PQ{PQ_M}"
+    elif mode == "hnsw":
+        desc = f"IDMap2,HNSW{HNSW_M}"
+    else:
+        raise ValueError(f"Unknown FAISS index mode: {mode}")
+    # dot-product (cosine since vectors are normalized)
+    return faiss.index_factory(dim, desc, faiss.METRIC_INNER_PRODUCT)
+
+
+def index_mode_of(index) -> str:
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def is_mmapped(mode: str) -> bool:
+    """Whether a persisted index of this mode is served memory-mapped."""
+    return MMAP_INDEX and mode in ("ivf_flat", "ivf_pq")
+
+
+def search_params(mode: str, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                  positions: Optional[np.ndarray] = None, ntotal: int = 0):
+    """
+    SearchParameters for the inner (unwrapped) index of the given mode.
+    positions restricts the search to those inner positions.
+    """
+    if mode in ("ivf_flat", "ivf_pq"):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = int(nprobe or DEFAULT_NPROBE)
+    elif mode == "hnsw":
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(ef_search or DEFAULT_EF_SEARCH)
+    elif positions is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None, None
+    keep = None
+    if positions is not None:
+        mask = np.zeros(ntotal, dtype=bool)
+        mask[positions] = True
+        bitmap = np.packbits(mask, bitorder='little')
+        sel = faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap))
+        params.sel = sel
+        # params doesn't own the selector, nor the selector its bitmap:
+        # the caller holds both until the search is done
+        keep = (bitmap, sel)
+    return params, keep
+
+
+def _external_ids(index) -> np.ndarray:
+    """An IDMap's inner position -> id table, viewed without copying."""
+    n = index.id_map.size()
+    if not n:
+        return np.empty(0, dtype='int64')
+    return faiss.rev_swig_ptr(index.id_map.data(), n)
+
+
+def _to_external(ext: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    ids = np.full(positions.shape, -1, dtype='int64')
+    found = positions >= 0
+    ids[found] = ext[positions[found]]
+    return ids
+
+
+def train_index(index, mat: np.ndarray):
+    """Train IVF/PQ quantizers on a random sample of the gallery."""
+    if index.is_trained:
+        return
+    n = len(mat)
+    if n > TRAIN_SAMPLE_SIZE:
+        rows = np.sort(np.random.default_rng().choice(n, size=TRAIN_SAMPLE_SIZE, replace=False))
+        mat = mat[rows]
+    index.train(mat)
+
+
+def version_key(owner: Optional[str]) -> str:
+    """counters_collection _id holding an index's change sequence and log."""
+    return f"index:{owner}" if owner else "index"
+
+
+async def record_index_change(user_id: str, namespace: str, face_ids: Sequence[str]) -> int:
+    """
+    Record that the embedding docs of face_ids changed for a tenant index
+    (inserted, deleted, relabelled, moved). Call it after the MongoDB write;
+    every worker's copy of the index replays the change. Returns its number.
+    """
+    face_ids = list(face_ids)
+    entry = face_ids if len(face_ids) <= CHANGE_MAX_FACES else None
+    # one atomic update: the sequence and the log entry can't drift apart
+    counter = await counters_collection.find_one_and_update(
+        {"_id": version_key(f"{user_id}/{namespace}")},
+        {"$inc": {"seq": 1}, "$push": {"changes": {"$each": [entry], "$slice": -CHANGE_LOG_SIZE}}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
 
-# Use a simple Flat index for MVP (replace with IVF/PQ for scale)
 class FaissIndexManager:
-    def __init__(self, dim: int = 512):
+    def __init__(self, dim: int = 512, index_dir: str = INDEX_DIR, query: Optional[dict] = None,
+                 owner: Optional[str] = None):
         self.dim = dim
-        os.makedirs(INDEX_DIR, exist_ok=True)
+        self.index_dir = index_dir
+        self.index_path = os.path.join(index_dir, INDEX_FILE)
+        self.query = query or {}  # which embeddings_collection docs belong to this index
+        self.owner = owner  # persisted files written for anyone else are ignored
+        os.makedirs(index_dir, exist_ok=True)
         self.index = None
-        self.id_map = []  # maps row -> document id (face_id)
+        self.mode = None
+        self.id_map = IdTable()  # maps int64 FAISS id -> document id (face_id)
+        self.attributes = AttributeTable()  # label/age/gender/emotion for filtered search
+        # in-RAM flat index taking writes while the main (IVF) index is mmapped read-only
+        self._delta = None
+        self._tombstones = 0  # removed but still in an index that can't delete (IVF, HNSW)
+        # face_id -> FAISS id for faces re-added since the build; a re-added
+        # face gets a fresh id so its old vector can't map back to it
+        self._reassigned = {}
+        self._lock = threading.Lock()
+        # add/remove calls made while a rebuild runs, replayed before the swap
+        self._pending = None
+        self._build_lock = asyncio.Lock()
+        self.version = -1  # last change-log entry reflected in the index; -1 unknown
+        self._synced_at = 0.0
+
+    def _selected(self, filters: Optional[dict]) -> Optional[np.ndarray]:
+        """
+        FAISS ids matching a filter, pushed down into the FAISS scan so
+        filtered queries keep full top-k recall. None means no filter; an
+        empty array means nothing can match.
+        """
+        if not filters:
+            return None
+        return self.attributes.select(**filters)
 
-    def build_index_from_db(self):
+    def _search_index(self, index, mode: str, v: np.ndarray, k: int,
+                      nprobe=None, ef_search=None, selected=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (scores, FAISS ids) from one IDMap-wrapped index. The search
+        runs on the inner index and maps positions back through the IDMap:
+        faiss rejects SearchParameters passed through an IDMap.
+        """
+        ext = _external_ids(index)
+        positions = None
+        if selected is not None:
+            positions = np.flatnonzero(np.isin(ext, selected))
+            if not len(positions):
+                return np.empty((len(v), 0), dtype='float32'), np.empty((len(v), 0), dtype='int64')
+        params, _keep = search_params(mode, nprobe, ef_search, positions, len(ext))
+        scores, found = faiss.downcast_index(index.index).search(v, k, params=params)
+        return scores, _to_external(ext, found)
+
+    def _range_index(self, index, mode: str, v: np.ndarray, min_score: float, max_results: int,
+                     nprobe=None, ef_search=None, selected=None) -> Tuple[np.ndarray, np.ndarray]:
+        """(scores, FAISS ids) above min_score for one probe from one IDMap-wrapped index."""
+        ext = _external_ids(index)
+        positions = None
+        if selected is not None:
+            positions = np.flatnonzero(np.isin(ext, selected))
+            if not len(positions):
+                return np.empty(0, dtype='float32'), np.empty(0, dtype='int64')
+        params, _keep = search_params(mode, nprobe, ef_search, positions, len(ext))
+        inner = faiss.downcast_index(index.index)
+        try:
+            _, scores, found = inner.range_search(v, float(min_score), params=params)
+        except RuntimeError:
+            # index type without range_search: top-k then cut at the radius
+            scores, found = inner.search(v, max_results + self._tombstones, params=params)
+            scores, found = scores[0], found[0]
+        return scores, _to_external(ext, found)
+
+    async def _read_embeddings(self) -> Tuple[np.ndarray, List[str], List[dict]]:
+        """
+        Stream embeddings from MongoDB in cursor batches straight into a
+        preallocated float32 matrix. Returns the matrix, face_ids and each
+        face's filter attributes.
+        """
+        capacity = await self._stored_count()
+        mat = np.empty((max(capacity, 1), self.dim), dtype='float32')
+        face_ids = []
+        attributes = []
+        cursor = embeddings_collection.find(
+            self.query,
+            {"_id": 0, "face_id": 1, "vector": 1, **{k: 1 for k in FILTER_FIELDS}},
+            batch_size=BUILD_BATCH_SIZE
+        )
+        async for d in cursor:
+            # packed binary decodes with np.frombuffer, no per-element Python floats
+            vec = decode_embedding(d.get("vector"))
+            if vec is None or vec.shape[0] != self.dim:
+                continue
+            n = len(face_ids)
+            if n == len(mat):
+                # collection grew since the count
+                grown = np.empty((n + n // 4 + 1, self.dim), dtype='float32')
+                grown[:n] = mat
+                mat = grown
+            mat[n] = vec
+            face_ids.append(d["face_id"])
+            attributes.append(filter_attributes(d))
+        return mat[:len(face_ids)], face_ids, attributes
+
+    def _build_index(self, mat: np.ndarray, face_ids: List[str], attributes: List[dict], version: int):
+        mode = resolve_index_mode(len(face_ids))
+        index = make_index(mode, self.dim, len(face_ids))
+        ids = np.empty(0, dtype='int64')
+        if face_ids:
+            # Normalize for cosine
+            faiss.normalize_L2(mat)
+            train_index(index, mat)
+            ids = np.array([face_id_to_int64(fid) for fid in face_ids], dtype='int64')
+            index.add_with_ids(mat, ids)
+        id_map = IdTable.from_pairs(ids, face_ids)
+        attrs = AttributeTable(len(ids))
+        attrs.set(ids, attributes)
+        # persist to disk before it goes live, while nothing else touches it
+        if self.owner is not None:
+            with open(os.path.join(self.index_dir, OWNER_FILE), "w", encoding="utf-8") as f:
+                f.write(self.owner)
+        with open(os.path.join(self.index_dir, VERSION_FILE), "w", encoding="utf-8") as f:
+            f.write(str(version))
+        id_map.save(self.index_dir)
+        attrs.save(self.index_dir)
+        tmp = self.index_path + ".tmp"
+        faiss.write_index(index, tmp)
+        os.replace(tmp, self.index_path)
+        if is_mmapped(mode):
+            # drop the private copy and share the mapped pages like other workers
+            del index
+            return self._read_persisted()
+        # flat and HNSW stay as built and take writes in place
+        return index, mode, id_map, attrs, None
+
+    def _persisted_owner(self) -> Optional[str]:
+        path = os.path.join(self.index_dir, OWNER_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def _persisted_version(self) -> int:
+        path = os.path.join(self.index_dir, VERSION_FILE)
+        if not os.path.exists(path):
+            return -1
+        with open(path, encoding="utf-8") as f:
+            return int(f.read() or -1)
+
+    def _read_persisted(self):
+        if self.owner is not None and self._persisted_owner() != self.owner:
+            return None
+        id_map = IdTable.load(self.index_dir, mmap=MMAP_INDEX)
+        if id_map is None or not os.path.exists(self.index_path):
+            return None
+        # the flags only change how IVF lists are read; other types load into RAM
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if MMAP_INDEX else 0
+        index = faiss.read_index(self.index_path, flags)
+        mode = index_mode_of(index)
+        delta = make_index("flat", self.dim) if is_mmapped(mode) else None
+        return index, mode, id_map, AttributeTable.load(self.index_dir), delta
+
+    def drop_persisted(self):
+        """Delete the on-disk index so the next load rebuilds from MongoDB."""
+        for name in (INDEX_FILE, IDS_FILE, KEYS_FILE, ATTRS_FILE, OWNER_FILE, VERSION_FILE):
+            path = os.path.join(self.index_dir, name)
+            if os.path.exists(path):
+                # unlink is safe even if another worker has it mapped
+                os.remove(path)
+
+    async def build_index_from_db(self):
         """
         Load all embeddings from MongoDB and build a FAISS index.
-        This should run in a background job on startup and periodically.
+        Searches keep using the current index until the new one is
+        swapped in; add/remove calls made meanwhile are replayed onto it.
+        """
+        async with self._build_lock:
+            await self._rebuild()
+
+    async def _rebuild(self):
+        with self._lock:
+            self._pending = []
+        try:
+            # read first: a change logged while we read the docs gets replayed again
+            version = await self._stored_version()
+            mat, face_ids, attributes = await self._read_embeddings()
+            built = await asyncio.to_thread(self._build_index, mat, face_ids, attributes, version)
+            del mat
+            with self._lock:
+                self.index, self.mode, self.id_map, self.attributes, self._delta = built
+                self._tombstones = 0
+                self._reassigned = {}
+                self.version = version
+                self._synced_at = time.monotonic()
+                for op in self._pending:
+                    if op[0] == "add":
+                        self._apply_add(*op[1:])
+                    elif op[0] == "remove":
+                        self._apply_remove(*op[1:])
+                    else:
+                        self._apply_attributes(*op[1:])
+        finally:
+            with self._lock:
+                self._pending = None
+
+    async def _stored_count(self) -> int:
+        # only a capacity hint for the build; docs with unusable vectors are skipped
+        if self.query:
+            return await embeddings_collection.count_documents(self.query)
+        return await embeddings_collection.estimated_document_count()
+
+    async def _stored_version(self) -> int:
+        counter = await counters_collection.find_one({"_id": version_key(self.owner)}, {"seq": 1})
+        return counter["seq"] if counter else 0
+
+    async def _catch_up(self):
+        """
+        Bring the index up to the change log: re-read the faces changed
+        since self.version, or rebuild if the log no longer reaches back
+        that far (or holds an entry too large to log).
         """
-        # Gather embeddings
-        docs = list(embeddings_collection.find({}, {"face_id": 1, "vector": 1}))
-        if not docs:
-            self.index = faiss.IndexFlatIP(self.dim)  # dot-product (cosine if normalized)
-            self.id_map = []
+        counter = await counters_collection.find_one({"_id": version_key(self.owner)}) or {}
+        seq = counter.get("seq", 0)
+        changes = counter.get("changes", [])
+        if seq == self.version:
+            self._synced_at = time.monotonic()
             return
+        # changes[i] is entry number seq - len(changes) + 1 + i
+        missed = changes[self.version - seq:] if seq - len(changes) <= self.version < seq else [None]
+        if any(entry is None for entry in missed):
+            await self._rebuild()
+            return
+        await self._refresh(list(dict.fromkeys(fid for entry in missed for fid in entry)))
+        self.version = seq
+        self._synced_at = time.monotonic()
+
+    async def _refresh(self, face_ids: List[str]):
+        """Make the index agree with MongoDB for face_ids (added, gone or changed)."""
+        docs = {}
+        async for d in embeddings_collection.find(
+            {**self.query, "face_id": {"$in": face_ids}},
+            {"_id": 0, "face_id": 1, "vector": 1, **{k: 1 for k in FILTER_FIELDS}}
+        ):
+            vec = decode_embedding(d.get("vector"))
+            if vec is not None and vec.shape[0] == self.dim:
+                docs[d["face_id"]] = (vec, filter_attributes(d))
+        with self._lock:
+            indexed = {fid for fid in face_ids if self._current_id(fid) is not None}
+        # a face's vector never changes, so faces already indexed only need their attributes
+        self.remove([fid for fid in face_ids if fid not in docs])
+        new = [fid for fid in docs if fid not in indexed]
+        self.add(new, [docs[fid][0] for fid in new], [docs[fid][1] for fid in new])
+        kept = [fid for fid in docs if fid in indexed]
+        self.update_attributes(kept, [docs[fid][1] for fid in kept])
+
+    async def ensure_loaded(self):
+        """
+        Load the persisted index, or build it from MongoDB if there is none,
+        then replay the changes logged since it was written.
+        """
+        if self.index is not None:
+            return
+        async with self._build_lock:
+            # a concurrent caller may have loaded it while we waited
+            if self.index is not None:
+                return
+            if self.load_index():
+                await self._catch_up()
+            else:
+                await self._rebuild()
 
-        vectors = []
-        ids = []
-        for d in docs:
-            vec = d.get("vector")
-            if vec and len(vec) == self.dim:
-                vectors.append(np.array(vec, dtype='float32'))
-                ids.append(d["face_id"])
-
-        if not vectors:
-            self.index = faiss.IndexFlatIP(self.dim)
-            self.id_map = []
+    async def sync(self, max_age: float = SYNC_INTERVAL_SECONDS):
+        """
+        ensure_loaded, then pick up changes other workers logged, checking
+        MongoDB at most once per max_age seconds.
+        """
+        await self.ensure_loaded()
+        if time.monotonic() - self._synced_at < max_age:
             return
+        async with self._build_lock:
+            await self._catch_up()
 
-        mat = np.vstack(vectors)
-        # Normalize for cosine (optional)
-        faiss.normalize_L2(mat)
-        index = faiss.IndexFlatIP(self.dim)
-        index.add(mat)
-        self.index = index
-        self.id_map = ids
-        # persist to disk
-        faiss.write_index(self.index, INDEX_PATH)
-        with open(META_PATH, "wb") as f:
-            pickle.dump(self.id_map, f)
-
-    def load_index(self):
-        if os.path.exists(INDEX_PATH) and os.path.exists(META_PATH):
-            self.index = faiss.read_index(INDEX_PATH)
-            with open(META_PATH, "rb") as f:
-                self.id_map = pickle.load(f)
-        else:
-            self.build_index_from_db()
-
-    def search(self, vector: List[float], top_k: int = 5) -> List[Tuple[str, float]]:
-        if self.index is None:
-            self.load_index()
-        v = np.array(vector, dtype='float32').reshape(1, -1)
-        faiss.normalize_L2(v)
-        scores, idxs = self.index.search(v, top_k)
-        results = []
-        for score, idx in zip(scores[0], idxs[0]):
-            if idx < 0 or idx >= len(self.id_map):
+    async def run_periodic_rebuild(self, interval_seconds: int = REBUILD_INTERVAL_SECONDS):
+        """Background task: rebuild now, then every interval_seconds."""
+        while True:
+            try:
+                await self.build_index_from_db()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"FAISS index build error: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    def load_index(self) -> bool:
+        """
+        Load the persisted index (IVF lists memory-mapped when FAISS_MMAP=1);
+        returns False if there is none yet.
+        """
+        persisted = self._read_persisted()
+        if persisted is None:
+            return False
+        with self._lock:
+            self.index, self.mode, self.id_map, self.attributes, self._delta = persisted
+            self._tombstones = 0
+            self._reassigned = {}
+            self.version = self._persisted_version()
+        return True
+
+    def memory_bytes(self) -> int:
+        """Rough resident size of the index, delta and id map."""
+        with self._lock:
+            index, delta, id_map = self.index, self._delta, self.id_map
+        if index is None:
+            return 0
+        inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+        per_vector = getattr(inner, "code_size", self.dim * 4) + 8
+        if isinstance(inner, faiss.IndexHNSW):
+            per_vector = self.dim * 4 + HNSW_M * 2 * 4 + 8
+        total = index.ntotal * per_vector + id_map.nbytes() + self.attributes.nbytes()
+        if delta is not None:
+            total += delta.ntotal * (self.dim * 4 + 8)
+        return total
+
+    def unload(self):
+        """Release the index; the next load replays the change log onto the files."""
+        with self._lock:
+            self.index, self.mode, self.id_map, self._delta = None, None, IdTable(), None
+            self.attributes = AttributeTable()
+            self._tombstones = 0
+            self._reassigned = {}
+            self.version = -1
+
+    def _ensure_index(self):
+        if self.index is not None:
+            return
+        if not self.load_index():
+            with self._lock:
+                if self.index is None:
+                    # empty until the background build swaps in the real one
+                    self.index = make_index("flat", self.dim)
+                    self.mode = "flat"
+
+    def _current_id(self, face_id: str) -> Optional[int]:
+        """FAISS id the face is live under, None if it isn't indexed."""
+        i = self._reassigned.get(face_id, face_id_to_int64(face_id))
+        return i if self.id_map.get(i) == face_id else None
+
+    def _new_id(self, face_id: str) -> int:
+        i = face_id_to_int64(face_id)
+        n = 0
+        # never reuse an id: a tombstoned vector may still carry it
+        while self.id_map.used(i):
+            n += 1
+            i = face_id_to_int64(f"{face_id}#{n}")
+        return i
+
+    def _can_delete(self) -> bool:
+        # IDMap2 remove_ids renumbers positions the way only a flat index does
+        # (IVF ends up inconsistent and aborts, HNSW can't delete)
+        return self.mode == "flat"
+
+    def _apply_add(self, face_ids: Sequence[str], mat: np.ndarray,
+                   attributes: Sequence[Optional[dict]]):
+        # re-adding a face replaces its previous vector
+        self._apply_remove(face_ids)
+        ids = np.array([self._new_id(fid) for fid in face_ids], dtype='int64')
+        target = self._delta if self._delta is not None else self.index
+        target.add_with_ids(mat, ids)
+        self.id_map.update(zip(ids.tolist(), face_ids))
+        for face_id, i in zip(face_ids, ids.tolist()):
+            if i == face_id_to_int64(face_id):
+                self._reassigned.pop(face_id, None)
+            else:
+                self._reassigned[face_id] = i
+        self.attributes.set(ids, attributes)
+
+    def _apply_remove(self, face_ids: Sequence[str]) -> int:
+        live = [i for i in (self._current_id(fid) for fid in face_ids) if i is not None]
+        if not live:
+            return 0
+        ids = np.array(live, dtype='int64')
+        deleted = 0
+        if self._delta is not None:
+            deleted = int(self._delta.remove_ids(ids))
+        if deleted < len(ids) and self._can_delete():
+            deleted += int(self.index.remove_ids(ids))
+        # the rest stay in the index: dropping their ids from id_map makes
+        # search skip them, and the vectors go away at the next rebuild
+        self._tombstones += len(ids) - deleted
+        for i in live:
+            self.id_map.pop(i, None)
+        for face_id in face_ids:
+            self._reassigned.pop(face_id, None)
+        self.attributes.remove(ids)
+        return len(ids)
+
+    def _apply_attributes(self, face_ids: Sequence[str], attributes: Sequence[Optional[dict]]):
+        known = [(i, attrs) for i, attrs in zip(map(self._current_id, face_ids), attributes) if i is not None]
+        if known:
+            self.attributes.set(np.array([i for i, _ in known], dtype='int64'), [a for _, a in known])
+
+    def add(self, face_ids: Sequence[str], vectors,
+            attributes: Optional[Sequence[Optional[dict]]] = None) -> int:
+        """
+        Add (or replace) faces in the live index without a rebuild.
+        attributes are per-face dicts (label, age, gender, emotion) used by
+        filtered search. Returns the number of vectors added.
+        """
+        if not face_ids:
+            return 0
+        self._ensure_index()
+        mat = _as_matrix(vectors, self.dim)
+        if len(mat) != len(face_ids):
+            raise ValueError("face_ids and vectors must have the same length")
+        face_ids = list(face_ids)
+        attributes = list(attributes) if attributes is not None else [None] * len(face_ids)
+        with self._lock:
+            self._apply_add(face_ids, mat, attributes)
+            if self._pending is not None:
+                self._pending.append(("add", face_ids, mat, attributes))
+        return len(face_ids)
+
+    def remove(self, face_ids: Sequence[str]) -> int:
+        """Remove faces from the live index. Returns the number removed."""
+        if not face_ids:
+            return 0
+        self._ensure_index()
+        face_ids = list(face_ids)
+        with self._lock:
+            removed = self._apply_remove(face_ids)
+            if self._pending is not None:
+                self._pending.append(("remove", face_ids))
+        return removed
+
+    def update_attributes(self, face_ids: Sequence[str], attributes: Sequence[Optional[dict]]):
+        """Replace the filter attributes of faces already in the index; vectors are untouched."""
+        if not face_ids:
+            return
+        self._ensure_index()
+        face_ids = list(face_ids)
+        attributes = list(attributes)
+        with self._lock:
+            self._apply_attributes(face_ids, attributes)
+            if self._pending is not None:
+                self._pending.append(("attributes", face_ids, attributes))
+
+    def search(self, vector: List[float], top_k: int = 5,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               filters: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """
+        nprobe (IVF) and ef_search (HNSW) trade recall for latency per call;
+        they are ignored by index types that don't use them. filters are
+        AttributeTable.select() keyword arguments.
+        """
+        return self.search_batch([vector], top_k=top_k, nprobe=nprobe, ef_search=ef_search, filters=filters)[0]
+
+    def range_search(self, vector: List[float], min_score: float, max_results: int = 100,
+                     nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                     filters: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """Every face scoring above min_score (cosine), best first, capped at max_results."""
+        self._ensure_index()
+        v = _as_matrix([vector], self.dim)
+        with self._lock:
+            selected = self._selected(filters)
+            if selected is not None and not len(selected):
+                return []
+            scores, idxs = self._range_index(self.index, self.mode, v, min_score, max_results,
+                                             nprobe, ef_search, selected)
+            if self._delta is not None and self._delta.ntotal:
+                d_scores, d_idxs = self._range_index(self._delta, "flat", v, min_score, max_results,
+                                                     selected=selected)
+                scores = np.concatenate([scores, d_scores])
+                idxs = np.concatenate([idxs, d_idxs])
+            id_map = self.id_map
+        best = {}
+        for score, idx in zip(scores, idxs):
+            face_id = id_map.get(int(idx)) if idx >= 0 else None
+            if face_id is None or score <= min_score:
                 continue
-            results.append((self.id_map[idx], float(score)))
-        return results
+            best[face_id] = max(float(score), best.get(face_id, float(score)))
+        return sorted(best.items(), key=lambda item: item[1], reverse=True)[:max_results]
+
+    def best_match(self, vector: List[float], min_score: float,
+                   nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                   filters: Optional[dict] = None) -> Optional[Tuple[str, float]]:
+        """Watchlist check: the single nearest face if it clears min_score, else None."""
+        results = self.search(vector, top_k=1, nprobe=nprobe, ef_search=ef_search, filters=filters)
+        if results and results[0][1] > min_score:
+            return results[0]
+        return None
+
+    def search_batch(self, vectors, top_k: int = 5,
+                     nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                     filters: Optional[dict] = None) -> List[List[Tuple[str, float]]]:
+        """Search many probes with a single FAISS call on an (n, dim) matrix."""
+        self._ensure_index()
+        v = _as_matrix(vectors, self.dim)
+        if not len(v):
+            return []
+        with self._lock:
+            selected = self._selected(filters)
+            if selected is not None and not len(selected):
+                return [[] for _ in range(len(v))]
+            # over-fetch past tombstoned vectors, then trim back to top_k
+            k = top_k + min(self._tombstones, top_k)
+            scores, idxs = self._search_index(self.index, self.mode, v, k, nprobe, ef_search, selected)
+            if self._delta is not None and self._delta.ntotal:
+                d_scores, d_idxs = self._search_index(self._delta, "flat", v, k, selected=selected)
+                scores = np.hstack([scores, d_scores])
+                idxs = np.hstack([idxs, d_idxs])
+                order = np.argsort(-scores, axis=1)
+                scores = np.take_along_axis(scores, order, axis=1)
+                idxs = np.take_along_axis(idxs, order, axis=1)
+            id_map = self.id_map
+        batch = []
+        for row_scores, row_idxs in zip(scores, idxs):
+            results = []
+            seen = set()
+            for score, idx in zip(row_scores, row_idxs):
+                face_id = id_map.get(int(idx)) if idx >= 0 else None
+                if face_id is None or face_id in seen:
+                    continue
+                seen.add(face_id)
+                results.append((face_id, float(score)))
+            batch.append(results[:top_k])
+        return batch
+
+
+def tenant_dir_name(user_id: str) -> str:
+    """Directory name for a user's indexes: a hash, so distinct ids never share one."""
+    return hashlib.sha256(str(user_id).encode("utf-8")).hexdigest()[:32]
+
+
+class TenantIndexRegistry:
+    """
+    One FaissIndexManager per (user_id, namespace), loaded lazily on first
+    use and evicted least-recently-used once the memory budget is exceeded,
+    so a search costs O(tenant gallery) and idle tenants hold no RAM.
+    """
+    def __init__(self, dim: int = 512, memory_budget_bytes: int = TENANT_MEMORY_BUDGET_MB * 1024 * 1024):
+        self.dim = dim
+        self.memory_budget_bytes = memory_budget_bytes
+        self._managers: "OrderedDict[Tuple[str, str], FaissIndexManager]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _manager_for(self, user_id: str, namespace: str) -> FaissIndexManager:
+        key = (str(user_id), namespace)
+        with self._lock:
+            manager = self._managers.get(key)
+            if manager is None:
+                if not re.match(NAMESPACE_PATTERN, namespace):
+                    raise ValueError(f"Invalid namespace: {namespace}")
+                ns_filter = {"$in": [None, DEFAULT_NAMESPACE]} if namespace == DEFAULT_NAMESPACE else namespace
+                manager = FaissIndexManager(
+                    dim=self.dim,
+                    index_dir=os.path.join(INDEX_DIR, "tenants", tenant_dir_name(user_id), namespace),
+                    query={"user_id": str(user_id), "namespace": ns_filter},
+                    owner=f"{user_id}/{namespace}"
+                )
+                self._managers[key] = manager
+            self._managers.move_to_end(key)
+            return manager
+
+    async def get(self, user_id: str, namespace: str = DEFAULT_NAMESPACE) -> FaissIndexManager:
+        manager = self._manager_for(user_id, namespace)
+        await manager.sync()
+        self._evict(keep=(str(user_id), namespace))
+        return manager
+
+    def loaded(self) -> Dict[Tuple[str, str], FaissIndexManager]:
+        with self._lock:
+            return dict(self._managers)
+
+    def memory_bytes(self) -> int:
+        return sum(m.memory_bytes() for m in self.loaded().values())
+
+    def _evict(self, keep: Tuple[str, str]):
+        with self._lock:
+            managers = list(self._managers.items())
+        total = sum(m.memory_bytes() for _, m in managers)
+        for key, manager in managers:
+            if total <= self.memory_budget_bytes:
+                break
+            if key == keep:
+                continue
+            total -= manager.memory_bytes()
+            manager.unload()
+            with self._lock:
+                self._managers.pop(key, None)
+
+    async def run_periodic_rebuild(self, interval_seconds: int = REBUILD_INTERVAL_SECONDS):
+        """Background task: rebuild every loaded tenant index each interval."""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            for key, manager in self.loaded().items():
+                try:
+                    await manager.build_index_from_db()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"FAISS index build error for {key}: {e}")
 
 # Singleton to use in app
-faiss_manager = FaissIndexManager(dim=int(os.environ.get("EMBED_DIM", "512")))
+tenant_indexes = TenantIndexRegistry(dim=int(os.environ.get("EMBED_DIM", "512")))
@@ -0,0 +1,61 @@
+# backend/app/services/inference_cache.py
+import hashlib
+import json
+from typing import Any, Optional
+from app.core.config import settings
+from app.utils.cache import LRUCache
+
+# bump when preprocessing changes so old entries stop matching
+CACHE_VERSION = 1
+
+
+class InferenceCache:
+    """
+    Content-addressed cache for inference results: keyed by the sha256 of
+    the image bytes plus whatever shaped the result (models, detector
+    policy, options). An in-process LRU answers repeats in microseconds;
+    an optional Redis layer shares results between API replicas and
+    expires them after the TTL. Values must be JSON-serializable; they are
+    stored encoded, so every hit hands back a fresh copy.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, redis_url: Optional[str] = None):
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.redis = None
+        if redis_url:
+            import redis.asyncio as redis
+            self.redis = redis.from_url(redis_url)
+
+    @staticmethod
+    def key(kind: str, data: bytes, *params) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        return ":".join(["infer", f"v{CACHE_VERSION}", kind, *map(str, params), digest])
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = self.local.get(key)
+        if raw is None and self.redis is not None:
+            try:
+                raw = await self.redis.get(key)
+            except Exception as e:
+                # the cache is an optimization; a Redis outage must not fail requests
+                print(f"Inference cache read failed: {e}")
+            if raw is not None:
+                self.local.set(key, raw)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any):
+        raw = json.dumps(value).encode("utf-8")
+        self.local.set(key, raw)
+        if self.redis is not None:
+            try:
+                await self.redis.set(key, raw, ex=self.ttl)
+            except Exception as e:
+                print(f"Inference cache write failed: {e}")
+
+
+inference_cache = InferenceCache(
+    maxsize=settings.INFERENCE_CACHE_SIZE,
+    ttl=settings.INFERENCE_CACHE_TTL_SECONDS,
+    redis_url=settings.INFERENCE_CACHE_REDIS_URL
+)
@@ -0,0 +1,100 @@
+"""
+Worker pool for DeepFace/TensorFlow inference.
+
+Model calls are CPU-bound and synchronous; running them inside an async
+handler blocks the event loop for every other request. Handlers await
+run_inference() instead, which executes the call in a process pool whose
+workers load and warm the models once at startup.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Optional
+from app.core.config import settings
+from app.services.detector_stats import detector_stats
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def intra_op_threads() -> int:
+    """TF threads per worker; by default the cores are split evenly between workers."""
+    if settings.INFERENCE_INTRA_OP_THREADS > 0:
+        return settings.INFERENCE_INTRA_OP_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, settings.INFERENCE_WORKERS))
+
+
+def configure_threads(threads: int):
+    """Cap TensorFlow's thread pools for this process; call before the models load."""
+    # must happen before TensorFlow creates its thread pools
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        # already initialized by an earlier import; env vars above still apply
+        pass
+
+
+def _init_worker(threads: int, stats_array):
+    detector_stats.attach(stats_array)
+    configure_threads(threads)
+
+    from app.services.face_detection import warmup_models
+    warmup_models()
+
+
+def start():
+    """Spawn the worker processes. No-op when INFERENCE_WORKERS is 0."""
+    global _executor
+    if _executor is None and settings.INFERENCE_WORKERS > 0:
+        # TensorFlow is not fork-safe, so workers are spawned fresh
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.INFERENCE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(intra_op_threads(), detector_stats.array)
+        )
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_inference(fn, *args, **kwargs):
+    """
+    Run a model call off the event loop. fn and its arguments must be
+    picklable (module-level functions, numpy arrays, bytes). With
+    INFERENCE_WORKERS=0 the call runs in a thread of this process instead.
+    """
+    executor = start()
+    call = partial(fn, *args, **kwargs)
+    if executor is None:
+        return await asyncio.to_thread(call)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+    except BrokenProcessPool:
+        # a worker died (usually OOM); replace the pool for the next request
+        print("Inference worker pool broke, restarting it")
+        shutdown()
+        raise
+
+
+async def warmup():
+    """Wait until the models are loaded, in the pool workers or in this process."""
+    from app.services.face_detection import warmup_models, mark_models_ready
+    if start() is None:
+        await asyncio.to_thread(warmup_models)
+        return
+    # each worker warms up in its initializer; a trivial call per worker waits for it
+    await asyncio.gather(*(run_inference(os.getpid) for _ in range(settings.INFERENCE_WORKERS)))
+    mark_models_ready()
@@ -0,0 +1,453 @@
+"""
+Upload ingestion: detect faces, persist the image and embedding docs and
+make the faces searchable. Used inline by the upload endpoint, and by the
+Celery workers for jobs queued in async ingestion mode.
+"""
+import asyncio
+import mimetypes
+import os
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from app.core.config import settings
+from app.db.mongo import images_collection, embeddings_collection, jobs_collection, counters_collection
+from app.services.face_detection import detect_faces_from_image_bytes, new_face_id, EMBED_MODEL_NAME
+from app.services.face_crops import persist_crops, DEFAULT_CROP_MODE
+from app.services.faiss_index import tenant_indexes, filter_attributes, record_index_change, DEFAULT_NAMESPACE
+from app.services.inference_cache import inference_cache
+from app.services.inference_pool import run_inference
+from app.services.storage_service import storage_service
+from app.services.webhook import dispatch_event_async
+from app.utils.archive_io import ArchiveEntry
+from app.utils.embedding_codec import encode_embedding, decode_embedding
+from app.utils.image_io import check_image_size
+
+INGESTION_MODES = ("sync", "async")
+INGESTION_MODE_PATTERN = "^(sync|async)$"
+JOB_STATUSES = ("queued", "processing", "done", "failed")
+# a job whose sequence number is taken but not yet written holds the indexer back at most this long
+JOB_SEQ_GAP_TIMEOUT_SECONDS = 60.0
+
+
+async def detect_faces_cached(content: bytes, mode: str, crop_mode: str = DEFAULT_CROP_MODE):
+    """
+    Detection for an upload. In eager crop mode the crops are stored
+    before the result is cached, so a cache hit carries their keys too.
+    """
+    # deferred results carry numpy crops for the background task, so they aren't cached
+    if mode == "deferred":
+        faces = await run_inference(detect_faces_from_image_bytes, content, mode, settings.DETECTOR_POLICY_UPLOAD, crop_mode)
+        await persist_crops(faces)
+        return faces
+
+    key = inference_cache.key("faces", content, EMBED_MODEL_NAME, settings.DETECTOR_POLICY_UPLOAD, mode, crop_mode)
+    faces = await inference_cache.get(key)
+    if faces is None:
+        faces = await run_inference(detect_faces_from_image_bytes, content, mode, settings.DETECTOR_POLICY_UPLOAD, crop_mode)
+        await persist_crops(faces)
+        await inference_cache.set(key, faces)
+    else:
+        # same pixels, new upload: face_id is unique per stored face
+        for f in faces:
+            f["face_id"] = new_face_id()
+    return faces
+
+
+def _image_doc(user_id: str, filename: str, s3_key: str, faces: List[dict], mode: str, deferred: bool) -> dict:
+    # embeddings live only in embeddings_collection
+    return {
+        "user_id": user_id,
+        "filename": filename,
+        "s3_key": s3_key,
+        "faces": [{k: v for k, v in f.items() if k != "embedding"} for f in faces],
+        "attributes_status": "pending" if deferred else ("done" if mode == "sync" else "off")
+    }
+
+
+def _embedding_doc(user_id: str, image_id: str, face: dict) -> dict:
+    return {
+        "face_id": face["face_id"],
+        "image_id": image_id,
+        "user_id": user_id,
+        "namespace": DEFAULT_NAMESPACE,
+        "vector": encode_embedding(face["embedding"], settings.EMBEDDING_STORAGE_DTYPE, EMBED_MODEL_NAME),
+        "label": None,
+        # copied here so index builds can filter without joining images
+        "age": face.get("age"),
+        "gender": face.get("gender"),
+        "emotion": face.get("emotion")
+    }
+
+
+async def _index_faces(user_id: str, faces: List[dict]):
+    # make the new faces searchable right away (no full rebuild)
+    tenant_index = await tenant_indexes.get(user_id)
+    tenant_index.add(
+        [f["face_id"] for f in faces],
+        [f["embedding"] for f in faces],
+        [filter_attributes(f) for f in faces]
+    )
+
+
+async def ingest_image(user_id: str, content: bytes, filename: str, s3_key: str, mode: str,
+                       index: bool = True, crop_mode: str = DEFAULT_CROP_MODE,
+                       image_id: Optional[str] = None) -> Tuple[dict, List[np.ndarray]]:
+    """
+    Detect, embed and persist one stored image. Returns the upload result
+    (image_id, attributes_status, faces) and, in deferred mode, the crops
+    still to be analyzed. With index=False the faces are only written to
+    MongoDB; callers outside the API process leave indexing to it. A given
+    image_id is written (or overwritten, with its faces) under that id, so
+    a retried job replaces its own partial writes instead of duplicating them.
+    """
+    faces = await detect_faces_cached(content, mode, crop_mode)
+    crops = [f.pop("crop") for f in faces] if mode == "deferred" else []
+
+    image_doc = _image_doc(user_id, filename, s3_key, faces, mode, bool(crops))
+    stale = []
+    if image_id is None:
+        res = await images_collection.insert_one(image_doc)
+        image_id = str(res.inserted_id)
+    else:
+        await images_collection.replace_one({"_id": ObjectId(image_id)}, image_doc, upsert=True)
+        stale = [d["face_id"] async for d in embeddings_collection.find({"image_id": image_id}, {"face_id": 1})]
+        if stale:
+            await embeddings_collection.delete_many({"image_id": image_id})
+
+    indexed = [f for f in faces if f.get("embedding")]
+    if indexed:
+        await embeddings_collection.insert_many([_embedding_doc(user_id, image_id, f) for f in indexed])
+    if stale or indexed:
+        await record_index_change(user_id, DEFAULT_NAMESPACE, stale + [f["face_id"] for f in indexed])
+    if indexed and index:
+        await _index_faces(user_id, indexed)
+
+    return {"image_id": image_id, "attributes_status": image_doc["attributes_status"], "faces": faces}, crops
+
+
+class _BulkWriter:
+    """Buffers processed images and writes them as batched inserts and index adds."""
+
+    def __init__(self, user_id: str, mode: str, batch_size: int):
+        self.user_id = user_id
+        self.mode = mode
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = asyncio.Lock()
+
+    async def add(self, result: dict, s3_key: str, faces: List[dict]):
+        self._pending.append((result, s3_key, faces))
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            docs = [_image_doc(self.user_id, r["name"], key, faces, self.mode, False) for r, key, faces in batch]
+            try:
+                await images_collection.insert_many(docs)
+            except Exception as e:
+                print(f"Bulk ingestion write failed: {e}")
+                # an ordered insert stops at the first failure; the docs before it were written
+                written = e.details.get("nInserted", 0) if isinstance(e, BulkWriteError) else 0
+                for result, _, _ in batch[written:]:
+                    result.update(status="error", image_id=None, error=f"Write failed: {e}")
+                batch, docs = batch[:written], docs[:written]
+
+            indexed = []
+            emb_docs = []
+            for (result, _, faces), doc in zip(batch, docs):
+                # insert_many set each doc's _id
+                image_id = str(doc["_id"])
+                result.update(status="ok", image_id=image_id, faces=len(faces))
+                for f in faces:
+                    if f.get("embedding"):
+                        indexed.append(f)
+                        emb_docs.append(_embedding_doc(self.user_id, image_id, f))
+            if not emb_docs:
+                return
+            try:
+                await embeddings_collection.insert_many(emb_docs)
+            except Exception as e:
+                print(f"Bulk ingestion embedding write failed: {e}")
+                for result, _, faces in batch:
+                    if any(f.get("embedding") for f in faces):
+                        # the image is stored, its faces just aren't searchable
+                        result.update(status="partial", error=f"Faces not saved: {e}")
+                return
+            try:
+                await record_index_change(self.user_id, DEFAULT_NAMESPACE, [f["face_id"] for f in indexed])
+                await _index_faces(self.user_id, indexed)
+            except Exception as e:
+                # the embeddings are in MongoDB; the next index load or rebuild picks them up
+                print(f"Bulk ingestion index add failed: {e}")
+
+
+async def ingest_bulk(user_id: str, entries: AsyncIterator[ArchiveEntry], mode: str,
+                      stored: bool = False, crop_mode: str = DEFAULT_CROP_MODE) -> dict:
+    """
+    Ingest a stream of (name, content, error) entries: at most
+    BULK_MAX_IN_FLIGHT images are decoded/detected at once, so memory stays
+    flat however long the stream is, and results are written in batches of
+    BULK_WRITE_BATCH_SIZE. With stored=True the names are storage keys of
+    images already uploaded; otherwise each image is uploaded first.
+    Returns per-item results and throughput.
+    """
+    # crops held for a background task would grow with the archive
+    mode = "sync" if mode == "deferred" else mode
+    started = time.monotonic()
+    slots = asyncio.Semaphore(settings.BULK_MAX_IN_FLIGHT)
+    writer = _BulkWriter(user_id, mode, settings.BULK_WRITE_BATCH_SIZE)
+    results = []
+    tasks = set()
+
+    async def process(result: dict, content: bytes):
+        try:
+            check_image_size(content)
+            # originals go where uploads do, so crops can be cut from them later
+            key = result["name"] if stored else await storage_service.upload_file(
+                content, os.path.splitext(result["name"])[1].lower(), user_id,
+                mimetypes.guess_type(result["name"])[0] or "application/octet-stream"
+            )
+            faces = await detect_faces_cached(content, mode, crop_mode)
+            del content
+            await writer.add(result, key, faces)
+        except Exception as e:
+            result.update(status="error", error=str(e))
+        finally:
+            slots.release()
+
+    truncated = False
+    async for name, content, error in entries:
+        if len(results) >= settings.BULK_MAX_ITEMS:
+            truncated = True
+            break
+        result = {"name": name, "status": "pending"}
+        results.append(result)
+        if content is None:
+            result.update(status="error", error=error)
+            continue
+        await slots.acquire()
+        task = asyncio.create_task(process(result, content))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    await writer.flush()
+
+    seconds = time.monotonic() - started
+    ok = sum(1 for r in results if r["status"] == "ok")
+    partial = sum(1 for r in results if r["status"] == "partial")
+    if ok:
+        await dispatch_event_async("images.bulk_uploaded", {"user_id": user_id, "images": ok})
+    return {
+        "items": len(results),
+        # items past BULK_MAX_ITEMS were not read
+        "truncated": truncated,
+        "ok": ok,
+        # image stored, but its faces could not be saved
+        "partial": partial,
+        "failed": len(results) - ok - partial,
+        "faces": sum(r.get("faces", 0) for r in results if r["status"] == "ok"),
+        "seconds": seconds,
+        "images_per_second": ok / seconds if seconds > 0 else 0.0,
+        "results": results
+    }
+
+
+async def create_upload_job(user_id: str, filename: str, storage_key: str, mode: str,
+                            crop_mode: str = DEFAULT_CROP_MODE) -> str:
+    """Record a queued job for an image already in storage; returns the job id."""
+    res = await jobs_collection.insert_one({
+        "user_id": user_id,
+        "filename": filename,
+        "storage_key": storage_key,
+        "attributes_mode": mode,
+        "crop_mode": crop_mode,
+        "status": "queued",
+        "attempts": 0,
+        "created_at": datetime.utcnow()
+    })
+    return str(res.inserted_id)
+
+
+async def process_upload_job(job_id: str):
+    """
+    Run a queued upload job. Safe to call again for a job that already
+    finished or that a dead worker left half done: the image is written
+    under the job's own id, and ingestion is skipped once it completed.
+    """
+    now = datetime.utcnow()
+    job = await jobs_collection.find_one_and_update(
+        # "processing" too once its lease ran out: the worker running it likely died
+        {"_id": ObjectId(job_id), "$or": [
+            {"status": "queued"},
+            {"status": "processing", "lease_until": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "processing",
+                "started_at": now,
+                "lease_until": now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+                # one image per job, recorded before anything is written
+                "image_id": job_id
+            },
+            "$inc": {"attempts": 1}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    if job is None:
+        return
+
+    # nobody is waiting on the response, so attributes are computed in the job itself
+    mode = "sync" if job["attributes_mode"] == "deferred" else job["attributes_mode"]
+    try:
+        # an earlier attempt that wrote everything only left the completion to do
+        if not job.get("ingested"):
+            content = await storage_service.download_file(job["storage_key"])
+            result, _ = await ingest_image(
+                job["user_id"], content, job["filename"], job["storage_key"], mode,
+                index=False, crop_mode=job.get("crop_mode", DEFAULT_CROP_MODE), image_id=job["image_id"]
+            )
+            job.update(ingested=True, faces=len(result["faces"]), attributes_status=result["attributes_status"])
+            await jobs_collection.update_one({"_id": job["_id"]}, {"$set": {
+                "ingested": True, "faces": job["faces"], "attributes_status": job["attributes_status"]
+            }})
+    except Exception as e:
+        print(f"Upload job {job_id} failed: {e}")
+        await jobs_collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "failed", "error": str(e), "completed_at": datetime.utcnow()}}
+        )
+        await dispatch_event_async("image.upload_failed", {"job_id": job_id, "user_id": job["user_id"], "error": str(e)})
+        return
+
+    await jobs_collection.update_one({"_id": job["_id"]}, {"$set": {
+        "status": "done",
+        "completed_at": datetime.utcnow(),
+        # the API's indexer follows this, not the workers' clocks
+        "seq": await next_job_seq()
+    }})
+    await dispatch_event_async("image.uploaded", {
+        "job_id": job_id, "image_id": job["image_id"], "user_id": job["user_id"], "faces": job["faces"]
+    })
+
+
+async def get_job(user_id: str, job_id: str) -> Optional[dict]:
+    """A user's job as returned by the status endpoint; None if not found."""
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = await jobs_collection.find_one({"_id": ObjectId(job_id), "user_id": user_id})
+    if job is None:
+        return None
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "filename": job.get("filename"),
+        # recorded when processing starts; the image exists once the job is done
+        "image_id": job.get("image_id") if job["status"] == "done" else None,
+        "faces": job.get("faces"),
+        "attributes_status": job.get("attributes_status"),
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "completed_at": job.get("completed_at")
+    }
+
+
+async def next_job_seq() -> int:
+    """Next number in the completed-jobs sequence (a MongoDB counter, so shared by all workers)."""
+    counter = await counters_collection.find_one_and_update(
+        {"_id": "jobs"}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+
+async def current_job_seq() -> int:
+    counter = await counters_collection.find_one({"_id": "jobs"})
+    return counter["seq"] if counter else 0
+
+
+class JobIndexer:
+    """
+    Adds the faces of finished jobs to the tenant indexes loaded in this
+    process, following the jobs' completion sequence numbers. A number is
+    taken just before its job doc is written, so a lower one can show up
+    after a higher one: the watermark only moves over contiguous numbers,
+    and jobs already seen past a gap aren't indexed twice. Tenants not
+    loaded here pick the faces up from MongoDB when they load.
+    """
+
+    def __init__(self, after: int):
+        self.after = after
+        self._seen = set()
+        self._gap_since = None
+
+    async def poll(self):
+        loaded = {user_id for user_id, namespace in tenant_indexes.loaded() if namespace == DEFAULT_NAMESPACE}
+        image_ids = {}
+        async for job in jobs_collection.find(
+            {"seq": {"$gt": self.after}}, {"seq": 1, "user_id": 1, "image_id": 1}
+        ).sort("seq", 1):
+            if job["seq"] in self._seen:
+                continue
+            self._seen.add(job["seq"])
+            if job["user_id"] in loaded and job.get("image_id"):
+                image_ids.setdefault(job["user_id"], []).append(job["image_id"])
+        self._advance()
+
+        for user_id, ids in image_ids.items():
+            docs = await embeddings_collection.find(
+                {"image_id": {"$in": ids}, "user_id": user_id, "namespace": DEFAULT_NAMESPACE},
+                {"_id": 0, "face_id": 1, "vector": 1, "label": 1, "age": 1, "gender": 1, "emotion": 1}
+            ).to_list(length=None)
+            if docs:
+                index = await tenant_indexes.get(user_id)
+                index.add(
+                    [d["face_id"] for d in docs],
+                    [decode_embedding(d["vector"]) for d in docs],
+                    [filter_attributes(d) for d in docs]
+                )
+
+    def _advance(self):
+        while self.after + 1 in self._seen:
+            self.after += 1
+            self._seen.discard(self.after)
+        if not self._seen:
+            self._gap_since = None
+            return
+        now = time.monotonic()
+        if self._gap_since is None:
+            self._gap_since = now
+        elif now - self._gap_since > JOB_SEQ_GAP_TIMEOUT_SECONDS:
+            # the missing job's worker likely died before writing it; a redelivery takes a new number
+            self.after = min(self._seen) - 1
+            self._gap_since = None
+            self._advance()
+
+
+async def run_job_indexer(interval_seconds: float = settings.JOB_INDEX_INTERVAL_SECONDS):
+    """
+    Background task: jobs finish in the Celery workers, whose memory isn't
+    the one serving searches, so the API polls for finished jobs and
+    indexes their faces itself.
+    """
+    indexer = None
+    while True:
+        try:
+            if indexer is None:
+                # jobs finished before this process started are in MongoDB for index loads
+                indexer = JobIndexer(await current_job_seq())
+            else:
+                await indexer.poll()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Job indexer error: {e}")
+        await asyncio.sleep(interval_seconds)
@@ -1,10 +1,138 @@
+import asyncio
+import hashlib
+import io
 import os
 import uuid
-from typing import Optional
+import weakref
+from typing import List, Optional, Tuple
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from app.core.config import settings
 
+# Every boto3 and file call below is blocking; it runs in a worker thread so
+# storage latency never stalls the event loop. boto3 clients are thread-safe.
+
+
+def _write_file(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class LocalUpload:
+    """Streams an upload to a local file; it only appears under its name once committed."""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._part_path = f"{path}.part"
+        self._f = None
+    
+    def _open(self):
+        os.makedirs(os.path.dirname(self._part_path) or ".", exist_ok=True)
+        return open(self._part_path, 'wb')
+    
+    async def write(self, chunk: bytes):
+        if self._f is None:
+            self._f = await asyncio.to_thread(self._open)
+        await asyncio.to_thread(self._f.write, chunk)
+    
+    def _commit(self):
+        if self._f is None:
+            self._f = self._open()
+        self._f.close()
+        os.replace(self._part_path, self.path)
+    
+    async def commit(self) -> str:
+        await asyncio.to_thread(self._commit)
+        return self.path
+    
+    def _abort(self):
+        if self._f is not None:
+            self._f.close()
+        if os.path.exists(self._part_path):
+            os.remove(self._part_path)
+    
+    async def abort(self):
+        await asyncio.to_thread(self._abort)
+
+
+class S3MultipartUpload:
+    """
+    Streams an upload to S3 in parts of part_size bytes. Bodies smaller than
+    one part go up as a single put_object; the multipart upload is only
+    created once the first full part is buffered.
+    """
+    
+    def __init__(self, s3_client, bucket: str, key: str, content_type: str, part_size: int):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+    
+    def _upload_part(self, body: bytes):
+        if self._upload_id is None:
+            self._upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )['UploadId']
+        number = len(self._parts) + 1
+        res = self.s3_client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=body
+        )
+        self._parts.append({'PartNumber': number, 'ETag': res['ETag']})
+    
+    async def write(self, chunk: bytes):
+        self._buffer += chunk
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await asyncio.to_thread(self._upload_part, part)
+    
+    def _commit(self):
+        if self._upload_id is None:
+            self.s3_client.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), ContentType=self.content_type
+            )
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts}
+            )
+    
+    async def commit(self) -> str:
+        try:
+            await asyncio.to_thread(self._commit)
+        except ClientError as e:
+            await self.abort()
+            raise Exception(f"S3 upload failed: {e}")
+        self._buffer = bytearray()
+        return self.key
+    
+    def _abort(self):
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        except ClientError as e:
+            print(f"S3 multipart abort failed for {self.key}: {e}")
+    
+    async def abort(self):
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            await asyncio.to_thread(self._abort)
+            self._upload_id = None
+
+
 class StorageService:
     def __init__(self):
         self.use_s3 = settings.USE_S3
@@ -15,52 +143,125 @@ class StorageService:
                 's3',
                 aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
                 aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                region_name=settings.AWS_REGION
+                region_name=settings.AWS_REGION,
+                # MinIO, or a moto server in tests
+                endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+                config=Config(
+                    # one pooled connection per concurrent transfer thread
+                    max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                    retries={'max_attempts': 5, 'mode': 'adaptive'}
+                )
             )
             self.bucket_name = settings.AWS_S3_BUCKET
+            # objects above the threshold go up as concurrent multipart parts
+            self.transfer_config = TransferConfig(
+                multipart_threshold=settings.S3_MULTIPART_PART_SIZE,
+                multipart_chunksize=settings.S3_MULTIPART_PART_SIZE,
+                max_concurrency=settings.S3_MAX_CONCURRENCY
+            )
         else:
             self.use_s3 = False
         
         if not os.path.exists(self.local_storage_path):
             os.makedirs(self.local_storage_path)
+        
+        # one semaphore per event loop: the API and each Celery worker run their own
+        self._slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
     
-    async def upload_file(self, file_content: bytes, file_extension: str, user_id: str) -> str:
+    def _new_key(self, file_extension: str, user_id: str) -> str:
         file_name = f"{uuid.uuid4()}{file_extension}"
-        
         if self.use_s3:
-            s3_key = f"uploads/{user_id}/{file_name}"
+            return f"uploads/{user_id}/{file_name}"
+        return os.path.join(self.local_storage_path, user_id, file_name)
+    
+    def _put(self, storage_key: str, file_content: bytes, content_type: str):
+        if self.use_s3:
             try:
-                self.s3_client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=s3_key,
-                    Body=file_content,
-                    ContentType='image/jpeg'
+                self.s3_client.upload_fileobj(
+                    io.BytesIO(file_content), self.bucket_name, storage_key,
+                    ExtraArgs={'ContentType': content_type},
+                    Config=self.transfer_config
                 )
-                return s3_key
             except ClientError as e:
                 raise Exception(f"S3 upload failed: {e}")
         else:
-            user_dir = os.path.join(self.local_storage_path, user_id)
-            if not os.path.exists(user_dir):
-                os.makedirs(user_dir)
-            
-            file_path = os.path.join(user_dir, file_name)
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
-            
-            return file_path
+            _write_file(storage_key, file_content)
     
-    async def get_file_url(self, storage_key: str) -> str:
+    async def upload_file(self, file_content: bytes, file_extension: str, user_id: str,
+                          content_type: str = 'image/jpeg') -> str:
+        return await self.put_file(self._new_key(file_extension, user_id), file_content, content_type)
+    
+    def crop_key(self, content: bytes) -> str:
+        """Content-addressed key for a face crop: identical crops share one object."""
+        file_name = f"{hashlib.sha256(content).hexdigest()}.jpg"
+        if self.use_s3:
+            return f"crops/{file_name}"
+        return os.path.join(self.local_storage_path, "crops", file_name)
+    
+    async def put_file(self, storage_key: str, file_content: bytes, content_type: str = 'image/jpeg') -> str:
+        await asyncio.to_thread(self._put, storage_key, file_content, content_type)
+        return storage_key
+    
+    async def put_many(self, objects: List[Tuple[str, bytes]], content_type: str = 'image/jpeg') -> List[str]:
+        """
+        Store (key, content) pairs concurrently, at most S3_MAX_CONCURRENCY
+        at a time across all callers on this event loop. Keys are returned
+        in input order.
+        """
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(settings.S3_MAX_CONCURRENCY)
+        
+        async def put(storage_key: str, content: bytes) -> str:
+            async with slots:
+                return await self.put_file(storage_key, content, content_type)
+        
+        return list(await asyncio.gather(*(put(key, content) for key, content in objects)))
+    
+    def open_upload(self, file_extension: str, user_id: str, content_type: str):
+        """A streaming writer (write/commit/abort) for a new file; commit() returns its storage key."""
+        storage_key = self._new_key(file_extension, user_id)
+        if self.use_s3:
+            return S3MultipartUpload(
+                self.s3_client, self.bucket_name, storage_key, content_type, settings.S3_MULTIPART_PART_SIZE
+            )
+        return LocalUpload(storage_key)
+    
+    def owns_key(self, storage_key: str, user_id: str) -> bool:
+        """Whether storage_key is under user_id's upload prefix (as written by upload_file)."""
+        if self.use_s3:
+            prefix = f"uploads/{user_id}/"
+            return storage_key.startswith(prefix) and ".." not in storage_key
+        user_dir = os.path.abspath(os.path.join(self.local_storage_path, user_id))
+        return os.path.abspath(storage_key).startswith(user_dir + os.sep)
+    
+    def _get(self, storage_key: str) -> bytes:
         if self.use_s3:
             try:
-                url = self.s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': self.bucket_name, 'Key': storage_key},
-                    ExpiresIn=3600
-                )
-                return url
-            except ClientError:
-                return ""
+                obj = self.s3_client.get_object(Bucket=self.bucket_name, Key=storage_key)
+                return obj['Body'].read()
+            except ClientError as e:
+                raise Exception(f"S3 download failed: {e}")
+        return _read_file(storage_key)
+    
+    async def download_file(self, storage_key: str) -> bytes:
+        return await asyncio.to_thread(self._get, storage_key)
+    
+    def _presign(self, storage_key: str) -> str:
+        try:
+            return self.s3_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket_name, 'Key': storage_key},
+                ExpiresIn=3600
+            )
+        except ClientError:
+            return ""
+    
+    async def get_file_url(self, storage_key: str) -> str:
+        if self.use_s3:
+            return await asyncio.to_thread(self._presign, storage_key)
         else:
             return storage_key
 
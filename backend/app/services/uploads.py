@@ -0,0 +1,142 @@
+"""
+Streaming upload handling.
+
+Request bodies are copied to storage in UPLOAD_CHUNK_SIZE pieces with a
+running sha256 and size count, so a handler never holds more than one
+chunk (plus, when it needs the pixels, the image itself, which is capped
+at UPLOAD_MAX_BYTES). The type is sniffed from the first bytes and the
+header's pixel count checked before anything is written.
+
+FastAPI spools a multipart body to a temporary file before the handler
+runs, so UploadSizeLimit caps the raw body of upload endpoints as it
+arrives: chunked bodies and false Content-Length headers included.
+"""
+import hashlib
+import json
+from typing import Callable, Optional
+import magic
+from fastapi import HTTPException, UploadFile
+from app.core.config import settings
+from app.utils.image_io import check_image_size
+
+# sniffed type -> stored extension; what cv2 can decode
+IMAGE_MIME_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/bmp": ".bmp",
+    "image/x-ms-bmp": ".bmp",
+    "image/tiff": ".tif"
+}
+SNIFF_BYTES = 2048
+# multipart framing (boundaries, part headers) on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadRejected(ValueError):
+    """The body isn't an acceptable upload; status_code is the HTTP status to answer with."""
+    status_code = 400
+
+
+class UploadTooLarge(UploadRejected):
+    status_code = 413
+
+
+class UnsupportedMediaType(UploadRejected):
+    status_code = 415
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware: answers 413 for requests to paths ending in
+    path_suffix whose body exceeds UPLOAD_MAX_BYTES (plus multipart
+    framing). A declared Content-Length over the limit is rejected before
+    anything is read; otherwise bytes are counted as they are received
+    and reading stops at the limit.
+    """
+
+    def __init__(self, app, path_suffix: str = "/upload"):
+        self.app = app
+        self.path_suffix = path_suffix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].endswith(self.path_suffix):
+            await self.app(scope, receive, send)
+            return
+        limit = settings.UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES
+        detail = f"File size must be at most {settings.UPLOAD_MAX_BYTES} bytes"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            body = json.dumps({"detail": detail}).encode("utf-8")
+            await send({"type": "http.response.start", "status": 413,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # HTTPException passes through FastAPI's body parsing as it is
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def sniff_image_type(head: bytes) -> str:
+    """MIME type from the leading bytes; raises UnsupportedMediaType unless it is a supported image."""
+    mime = magic.from_buffer(head[:SNIFF_BYTES], mime=True)
+    if mime not in IMAGE_MIME_TYPES:
+        raise UnsupportedMediaType(f"Unsupported file type: {mime}")
+    return mime
+
+
+async def receive_upload(file: UploadFile, open_writer: Callable[[str, str], object],
+                         keep: bool = False, max_bytes: Optional[int] = None) -> dict:
+    """
+    Stream `file` into the writer returned by open_writer(extension,
+    content_type), which has async write/commit/abort. Returns storage_key,
+    size, sha256, content_type and, with keep=True, the content. Raises
+    UploadRejected (empty, oversized or not an image) or ImageTooLarge;
+    nothing is left in storage when it does.
+    """
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+    if not chunk:
+        raise UploadRejected("File is empty")
+    content_type = sniff_image_type(chunk)
+    # the header is in the first chunk: decompression bombs stop here
+    check_image_size(chunk)
+
+    writer = open_writer(IMAGE_MIME_TYPES[content_type], content_type)
+    digest = hashlib.sha256()
+    size = 0
+    parts = []
+    try:
+        while chunk:
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"File size must be at most {max_bytes} bytes")
+            digest.update(chunk)
+            await writer.write(chunk)
+            if keep:
+                parts.append(chunk)
+            chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+        storage_key = await writer.commit()
+    except BaseException:
+        await writer.abort()
+        raise
+
+    return {
+        "storage_key": storage_key,
+        "size": size,
+        "sha256": digest.hexdigest(),
+        "content_type": content_type,
+        "content": b"".join(parts) if keep else None
+    }
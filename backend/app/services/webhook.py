@@ -0,0 +1,19 @@
+# backend/app/services/webhook.py
+import httpx
+from app.core.config import settings
+
+_client = None
+
+
+async def dispatch_event_async(event: str, payload: dict):
+    """POST {"event", "data"} to WEBHOOK_URL. Delivery is best-effort: failures are logged, never raised."""
+    global _client
+    if not settings.WEBHOOK_URL:
+        return
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=settings.WEBHOOK_TIMEOUT_SECONDS)
+    try:
+        res = await _client.post(settings.WEBHOOK_URL, json={"event": event, "data": payload})
+        res.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Webhook {event} failed: {e}")
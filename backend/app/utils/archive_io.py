@@ -0,0 +1,77 @@
+import asyncio
+import os
+import tarfile
+import zipfile
+from typing import AsyncIterator, BinaryIO, Iterator, Optional, Tuple
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+# (entry name, content, error): content is None when the entry was skipped
+ArchiveEntry = Tuple[str, Optional[bytes], Optional[str]]
+
+
+def _is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    # macOS resource forks and other dotfiles ride along in most zips
+    if not base or base.startswith(".") or "__MACOSX/" in name:
+        return False
+    return os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_archive_images(fileobj: BinaryIO, max_entry_bytes: int) -> Iterator[ArchiveEntry]:
+    """
+    Image entries of a zip or (optionally compressed) tar archive, one at a
+    time, so only the current entry is ever in memory. Tars are read as a
+    forward-only stream; zips need a seekable file (their index is at the
+    end). Entries over max_entry_bytes are reported, not read.
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not _is_image_name(info.filename):
+                    continue
+                if info.file_size > max_entry_bytes:
+                    yield info.filename, None, f"Entry larger than {max_entry_bytes} bytes"
+                    continue
+                with zf.open(info) as f:
+                    yield info.filename, f.read(), None
+        return
+
+    fileobj.seek(0)
+    try:
+        tf = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError:
+        raise ValueError("Not a zip or tar archive")
+    with tf:
+        for member in tf:
+            if not member.isfile() or not _is_image_name(member.name):
+                continue
+            if member.size > max_entry_bytes:
+                yield member.name, None, f"Entry larger than {max_entry_bytes} bytes"
+                continue
+            f = tf.extractfile(member)
+            yield member.name, f.read() if f else None, None if f else "Unreadable entry"
+
+
+async def aiter_archive_images(fileobj: BinaryIO, max_entry_bytes: int) -> AsyncIterator[ArchiveEntry]:
+    """
+    iter_archive_images with each read done off the event loop. Raises
+    ValueError if the file isn't an archive; an archive that breaks off
+    part way ends with an error entry instead.
+    """
+    entries = iter_archive_images(fileobj, max_entry_bytes)
+    done = object()
+    first = True
+    while True:
+        try:
+            entry = await asyncio.to_thread(next, entries, done)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError) as e:
+            if first:
+                raise ValueError(f"Unreadable archive: {e}")
+            yield "<archive>", None, f"Archive truncated or corrupt: {e}"
+            return
+        if entry is done:
+            return
+        first = False
+        yield entry
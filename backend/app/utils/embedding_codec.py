@@ -0,0 +1,48 @@
+import struct
+from typing import Optional, Union
+import numpy as np
+from bson import Binary
+
+# Packed embedding layout stored in Mongo as BSON binary:
+#   header: magic "FEMB", format version, dtype code, dim, model name length
+#   then the model name (utf-8) and dim little-endian floats
+MAGIC = b"FEMB"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sBBHB")
+_DTYPE_CODES = {"float32": 1, "float16": 2}
+_CODE_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+
+
+def encode_embedding(vector, dtype: str = "float32", model_version: str = "") -> Binary:
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    arr = np.asarray(vector, dtype=_CODE_DTYPES[_DTYPE_CODES[dtype]]).ravel()
+    model = model_version.encode("utf-8")[:255]
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, _DTYPE_CODES[dtype], arr.shape[0], len(model))
+    return Binary(header + model + arr.tobytes())
+
+
+def decode_embedding(value: Union[bytes, list, None]) -> Optional[np.ndarray]:
+    """
+    float32 numpy vector from a packed embedding, or from a legacy BSON
+    array of doubles. None if there is nothing to decode.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        magic, version, code, dim, model_len = _HEADER.unpack_from(value)
+        if magic != MAGIC or version != FORMAT_VERSION or code not in _CODE_DTYPES:
+            raise ValueError("Not a packed embedding")
+        offset = _HEADER.size + model_len
+        vec = np.frombuffer(value, dtype=_CODE_DTYPES[code], count=dim, offset=offset)
+        return vec.astype(np.float32, copy=False)
+    if len(value) == 0:
+        return None
+    return np.asarray(value, dtype=np.float32)
+
+
+def embedding_model_version(value) -> Optional[str]:
+    if not isinstance(value, (bytes, bytearray)):
+        return None
+    _, _, _, _, model_len = _HEADER.unpack_from(value)
+    return bytes(value[_HEADER.size:_HEADER.size + model_len]).decode("utf-8")
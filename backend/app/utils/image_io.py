@@ -0,0 +1,77 @@
+import io
+from typing import Optional, Tuple, Union
+import cv2
+import numpy as np
+from PIL import Image
+from app.core.config import settings
+
+# What the face pipeline accepts: encoded image bytes or a decoded BGR array
+ImageInput = Union[bytes, bytearray, memoryview, np.ndarray]
+
+# cv2 decodes JPEGs at 1/2, 1/4 or 1/8 scale straight from the DCT, without the full-size buffer
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class ImageTooLarge(ValueError):
+    """The image header declares more pixels than IMAGE_MAX_PIXELS (likely a decompression bomb)."""
+
+
+def image_size(data: Union[bytes, bytearray, memoryview]) -> Optional[Tuple[int, int]]:
+    """(width, height) from the image header, without decoding pixels; None if unreadable."""
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            return im.size
+    except Exception:
+        return None
+
+
+def check_image_size(data: Union[bytes, bytearray, memoryview]) -> Optional[Tuple[int, int]]:
+    """Header dimensions, raising ImageTooLarge before anything is decoded."""
+    size = image_size(data)
+    if size and size[0] * size[1] > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f"Image has {size[0]}x{size[1]} pixels, limit is {settings.IMAGE_MAX_PIXELS}")
+    return size
+
+
+def decode_image_scaled(data: Union[bytes, bytearray, memoryview]) -> Tuple[Optional[np.ndarray], float]:
+    """
+    Decode encoded image bytes (JPEG, PNG, ...) to a BGR array plus its
+    scale relative to the original; (None, 1.0) if undecodable. Large images
+    are decoded at the coarsest 1/2..1/8 scale whose long side is still at
+    least IMAGE_DECODE_MIN_SIDE, which is plenty for face crops.
+    Raises ImageTooLarge for decompression bombs.
+    """
+    if not data:
+        return None, 1.0
+    size = check_image_size(data)
+    flag = cv2.IMREAD_COLOR
+    if size:
+        for factor, reduced in _REDUCED_FLAGS:
+            if max(size) // factor >= settings.IMAGE_DECODE_MIN_SIDE:
+                flag = reduced
+                break
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if img is None:
+        return None, 1.0
+    return img, (max(img.shape[:2]) / max(size) if size else 1.0)
+
+
+def decode_image(data: Union[bytes, bytearray, memoryview]) -> Optional[np.ndarray]:
+    """decode_image_scaled without the scale, for callers that don't report coordinates."""
+    return decode_image_scaled(data)[0]
+
+
+def load_image(image: ImageInput) -> Tuple[Optional[np.ndarray], float]:
+    """BGR array and decode scale for either input form, decoding bytes in memory (never via a file)."""
+    if isinstance(image, np.ndarray):
+        return image, 1.0
+    return decode_image_scaled(image)
+
+
+def downscale(img: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    """img resized so its long side is at most max_side, and the scale applied (1.0 if untouched)."""
+    h, w = img.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return img, 1.0
+    scale = max_side / max(h, w)
+    return cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA), scale
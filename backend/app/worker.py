@@ -0,0 +1,63 @@
+"""
+Celery workers for async ingestion.
+
+    celery -A app.worker worker --concurrency 2
+
+Each worker process loads and warms the models once at startup and then
+runs upload jobs queued by the API, so inference scales with the number
+of workers rather than with API replicas.
+"""
+import asyncio
+import os
+from celery import Celery
+from celery.signals import worker_process_init
+from app.core.config import settings
+from app.services import inference_pool
+from app.services.ingestion import process_upload_job
+
+celery_app = Celery("facesaas", broker=settings.CELERY_BROKER_URL, backend=settings.CELERY_RESULT_BACKEND)
+celery_app.conf.update(
+    task_always_eager=settings.CELERY_TASK_ALWAYS_EAGER,
+    worker_concurrency=settings.CELERY_WORKER_CONCURRENCY,
+    # a job is acked once processed, so a worker that dies mid-job doesn't lose it
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # jobs are seconds long; don't let one process hoard queued jobs
+    worker_prefetch_multiplier=1,
+    # job state lives in the jobs collection
+    task_ignore_result=True
+)
+
+# one loop per worker process: the Mongo client binds to the loop it first runs on
+_loop = None
+
+
+def _run(coro):
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+@worker_process_init.connect
+def _preload_models(**kwargs):
+    # the worker processes are the inference workers; no nested pool
+    settings.INFERENCE_WORKERS = 0
+    threads = settings.INFERENCE_INTRA_OP_THREADS or max(1, (os.cpu_count() or 1) // max(1, settings.CELERY_WORKER_CONCURRENCY))
+    inference_pool.configure_threads(threads)
+
+    from app.services.face_detection import warmup_models
+    warmup_models()
+
+
+@celery_app.task(name="images.process_upload")
+def process_upload(job_id: str):
+    _run(process_upload_job(job_id))
+
+
+async def enqueue_upload_job(job_id: str):
+    if celery_app.conf.task_always_eager:
+        # eager (tests): run in this process, on the caller's loop
+        await process_upload_job(job_id)
+    else:
+        await asyncio.to_thread(process_upload.delay, job_id)
@@ -0,0 +1,16 @@
+import os
+import numpy as np
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("FAISS_INDEX_DIR", "/tmp/faiss-tests")
+
+
+@pytest.fixture
+def mongo_db():
+    return AsyncMongoMockClient()["facesaas_test"]
+
+
+def random_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    vecs = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
@@ -0,0 +1,61 @@
+import io
+import tarfile
+import zipfile
+import pytest
+from app.utils.archive_io import aiter_archive_images, iter_archive_images
+
+FILES = {
+    "a.jpg": b"a" * 10,
+    "nested/b.PNG": b"b" * 20,
+    "big.jpg": b"c" * 500,
+    "notes.txt": b"skip me",
+    "__MACOSX/._a.jpg": b"fork",
+    ".hidden.jpg": b"dot",
+}
+
+
+def _zip() -> io.BytesIO:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, data in FILES.items():
+            zf.writestr(name, data)
+    buf.seek(0)
+    return buf
+
+
+def _tar(mode="w:gz") -> io.BytesIO:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tf:
+        for name, data in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    buf.seek(0)
+    return buf
+
+
+@pytest.mark.parametrize("make", [_zip, _tar, lambda: _tar("w")])
+def test_only_image_entries_are_read(make):
+    entries = {name: (content, error) for name, content, error in iter_archive_images(make(), 100)}
+
+    assert set(entries) == {"a.jpg", "nested/b.PNG", "big.jpg"}
+    assert entries["a.jpg"] == (b"a" * 10, None)
+    assert entries["nested/b.PNG"] == (b"b" * 20, None)
+    # oversized entries are reported without being read
+    assert entries["big.jpg"][0] is None and "100 bytes" in entries["big.jpg"][1]
+
+
+@pytest.mark.asyncio
+async def test_async_reader_rejects_non_archives():
+    with pytest.raises(ValueError):
+        async for _ in aiter_archive_images(io.BytesIO(b"plain bytes, not an archive"), 100):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_async_reader_reports_truncated_archives():
+    data = _tar("w").getvalue()
+    # cut inside big.jpg's data
+    names = [name async for name, _, _ in aiter_archive_images(io.BytesIO(data[:2660]), 1000)]
+
+    assert names == ["a.jpg", "nested/b.PNG", "<archive>"]
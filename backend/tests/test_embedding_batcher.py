@@ -0,0 +1,100 @@
+import asyncio
+import cv2
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services import embedding_batcher, face_detection
+from app.services.embedding_batcher import EmbeddingBatcher, embed_probe
+from app.services.inference_cache import InferenceCache
+from app.utils.image_io import ImageTooLarge
+
+
+def _jpeg(height: int, width: int = 32) -> bytes:
+    return cv2.imencode(".jpg", np.full((height, width, 3), 128, dtype=np.uint8))[1].tobytes()
+
+
+@pytest.fixture
+def inline(monkeypatch):
+    # inference in a thread of the test process
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 0)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submits_share_batches(inline):
+    calls = []
+
+    def double(batch):
+        calls.append(len(batch))
+        return [x * 2 for x in batch]
+
+    batcher = EmbeddingBatcher(double, max_batch_size=4, max_wait_ms=50)
+    try:
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+    finally:
+        batcher.stop()
+
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert calls == [4, 2]
+    stats = batcher.stats()
+    assert (stats["batches"], stats["items"]) == (2, 6)
+    assert stats["batch_size_histogram"] == {"le_2": 1, "le_4": 1}
+
+
+@pytest.mark.asyncio
+async def test_a_failed_batch_fails_each_caller(inline):
+    def broken(batch):
+        raise RuntimeError("model crashed")
+
+    batcher = EmbeddingBatcher(broken, max_batch_size=4, max_wait_ms=10)
+    try:
+        results = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+    finally:
+        batcher.stop()
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Inference in a thread, with a 'model' that embeds a probe as its height."""
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 0)
+    monkeypatch.setattr(face_detection, "_load_model", lambda: None)
+    monkeypatch.setattr(face_detection, "_probe_face", lambda img, detector: img)
+    calls = []
+
+    def embed_face_batch(faces):
+        calls.append(len(faces))
+        return [[float(f.shape[0])] for f in faces]
+
+    monkeypatch.setattr(face_detection, "embed_face_batch", embed_face_batch)
+    monkeypatch.setattr(embedding_batcher, "inference_cache", InferenceCache(maxsize=100, ttl=60))
+    batcher = EmbeddingBatcher(face_detection.embed_probes, max_batch_size=8, max_wait_ms=50)
+    monkeypatch.setattr(embedding_batcher, "probe_embedder", batcher)
+    yield calls
+    batcher.stop()
+
+
+def test_embed_probes_decodes_bytes_in_the_worker(fake_model):
+    results = face_detection.embed_probes([(_jpeg(40), "fast"), (b"not an image", "fast"), (_jpeg(24), "fast")])
+    assert results == [[40.0], None, [24.0]]
+    assert fake_model == [2]
+
+
+@pytest.mark.asyncio
+async def test_embed_probe_batches_and_caches(fake_model):
+    results = await asyncio.gather(*(embed_probe(_jpeg(h), "fast") for h in (16, 24, 40)))
+    assert results == [[16.0], [24.0], [40.0]]
+    assert fake_model == [3]
+
+    assert await embed_probe(_jpeg(24), "fast") == [24.0]
+    assert fake_model == [3]
+    assert await embed_probe(b"garbage", "fast") is None
+    embedding_batcher.probe_embedder.stop()
+    await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_embed_probe_rejects_oversized_before_batching(fake_model, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_MAX_PIXELS", 100)
+    with pytest.raises(ImageTooLarge):
+        await embed_probe(_jpeg(40), "fast")
+    assert fake_model == []
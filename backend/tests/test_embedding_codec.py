@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from bson import BSON, Binary
+from app.utils.embedding_codec import decode_embedding, embedding_model_version, encode_embedding
+
+
+@pytest.mark.parametrize("dtype,atol", [("float32", 0.0), ("float16", 1e-3)])
+def test_round_trip(dtype, atol):
+    vec = np.random.default_rng(0).standard_normal(512).astype("float32") / 20
+    packed = encode_embedding(vec, dtype, "ArcFace")
+    assert isinstance(packed, Binary)
+    # survives a BSON round trip as stored in Mongo
+    stored = BSON.decode(BSON.encode({"v": packed}))["v"]
+    out = decode_embedding(stored)
+    assert out.dtype == np.float32 and out.shape == (512,)
+    assert np.allclose(out, vec, atol=atol)
+    assert embedding_model_version(stored) == "ArcFace"
+
+
+def test_packed_is_smaller_than_a_bson_array():
+    vec = [0.1] * 512
+    assert len(BSON.encode({"v": encode_embedding(vec, "float16")})) * 6 < len(BSON.encode({"v": vec}))
+
+
+def test_legacy_arrays_and_bad_input():
+    assert np.allclose(decode_embedding([0.5, 1.5]), [0.5, 1.5])
+    assert decode_embedding(None) is None
+    assert decode_embedding([]) is None
+    assert embedding_model_version([0.5]) is None
+    with pytest.raises(ValueError):
+        decode_embedding(b"XXXX" + bytes(20))
+    with pytest.raises(ValueError):
+        encode_embedding([1.0], "int8")
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services import face_attributes, faiss_index
+
+
+class _Index:
+    def __init__(self):
+        self.updates = []
+
+    def update_attributes(self, face_ids, attributes):
+        self.updates.append((list(face_ids), list(attributes)))
+
+
+class _Indexes:
+    def __init__(self):
+        self.indexes = {}
+
+    async def get(self, user_id, namespace="default"):
+        return self.indexes.setdefault((user_id, namespace), _Index())
+
+
+@pytest.fixture
+def db(mongo_db, monkeypatch):
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 0)
+    monkeypatch.setattr(face_attributes, "images_collection", mongo_db.images)
+    monkeypatch.setattr(face_attributes, "embeddings_collection", mongo_db.embeddings)
+    monkeypatch.setattr(face_attributes, "settings_collection", mongo_db.settings)
+    monkeypatch.setattr(faiss_index, "counters_collection", mongo_db.counters)
+    indexes = _Indexes()
+    monkeypatch.setattr(face_attributes, "tenant_indexes", indexes)
+    return mongo_db, indexes
+
+
+@pytest.mark.asyncio
+async def test_attribute_mode_defaults_off_and_follows_settings(db):
+    mongo_db, _ = db
+    assert await face_attributes.user_attribute_mode("u1") == "off"
+
+    await mongo_db.settings.insert_one({"user_id": "u1", "attribute_analysis": "deferred"})
+    assert await face_attributes.user_attribute_mode("u1") == "deferred"
+    # the per-request mode wins; unknown values fall back
+    assert await face_attributes.user_attribute_mode("u1", "sync") == "sync"
+    assert await face_attributes.user_attribute_mode("u1", "bogus") == "deferred"
+
+    await mongo_db.settings.update_one({"user_id": "u1"}, {"$set": {"attribute_analysis": "bogus"}})
+    assert await face_attributes.user_attribute_mode("u1") == "off"
+
+
+@pytest.mark.asyncio
+async def test_deferred_attributes_patch_docs_and_index(db, monkeypatch):
+    mongo_db, indexes = db
+    monkeypatch.setattr(face_attributes, "analyze_face_batch", lambda crops: [
+        {"age": 20 + i, "gender": "Woman", "emotion": "happy"} for i in range(len(crops))
+    ])
+    res = await mongo_db.images.insert_one({"faces": [{"face_id": "f0"}, {"face_id": "f1"}],
+                                            "attributes_status": "pending"})
+    image_id = str(res.inserted_id)
+    await mongo_db.embeddings.insert_many([
+        {"face_id": "f0", "user_id": "u1", "namespace": "default", "label": "ann"},
+        {"face_id": "f1", "user_id": "u1", "namespace": "staff"},
+    ])
+
+    crops = [np.zeros((8, 8, 3), dtype=np.uint8)] * 2
+    await face_attributes.patch_face_attributes("u1", image_id, ["f0", "f1"], crops)
+
+    image = await mongo_db.images.find_one({"_id": res.inserted_id})
+    assert image["attributes_status"] == "done"
+    assert [f["age"] for f in image["faces"]] == [20, 21]
+    assert (await mongo_db.embeddings.find_one({"face_id": "f1"}))["age"] == 21
+
+    # each namespace's index gets its faces' filter attributes, label kept
+    (ids, attrs), = indexes.indexes[("u1", "default")].updates
+    assert ids == ["f0"]
+    assert attrs[0]["label"] == "ann" and attrs[0]["gender"] == "Woman"
+    assert indexes.indexes[("u1", "staff")].updates[0][0] == ["f1"]
+
+
+@pytest.mark.asyncio
+async def test_failed_analysis_marks_the_image(db, monkeypatch):
+    mongo_db, indexes = db
+
+    def fail(crops):
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(face_attributes, "analyze_face_batch", fail)
+    res = await mongo_db.images.insert_one({"faces": [{"face_id": "f0"}]})
+
+    await face_attributes.patch_face_attributes("u1", str(res.inserted_id), ["f0"], [np.zeros((8, 8, 3))])
+
+    assert (await mongo_db.images.find_one({"_id": res.inserted_id}))["attributes_status"] == "failed"
+    assert indexes.indexes == {}
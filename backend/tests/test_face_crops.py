@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services import face_crops
+from app.services.storage_service import StorageService
+
+
+@pytest.fixture
+def env(mongo_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "USE_S3", False)
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    storage = StorageService()
+    monkeypatch.setattr(face_crops, "storage_service", storage)
+    monkeypatch.setattr(face_crops, "images_collection", mongo_db.images)
+    monkeypatch.setattr(face_crops, "settings_collection", mongo_db.settings)
+    return mongo_db, storage
+
+
+async def _stored_image(mongo_db, storage, user_id="u1"):
+    img = np.zeros((120, 160, 3), dtype=np.uint8)
+    img[20:80, 40:100] = 200
+    key = await storage.upload_file(cv2.imencode(".jpg", img)[1].tobytes(), ".jpg", user_id)
+    res = await mongo_db.images.insert_one({
+        "user_id": user_id, "s3_key": key,
+        "faces": [{"face_id": "f1", "bbox": [40, 20, 60, 60], "landmarks": None, "crop_s3": None}]
+    })
+    return str(res.inserted_id)
+
+
+@pytest.mark.asyncio
+async def test_persist_crops_stores_each_distinct_crop_once(env, monkeypatch):
+    _, storage = env
+    stored = []
+    put_many = storage.put_many
+
+    async def counting_put_many(objects, *args):
+        stored.append(len(objects))
+        return await put_many(objects, *args)
+
+    monkeypatch.setattr(storage, "put_many", counting_put_many)
+    faces = [{"crop_jpeg": b"same"}, {"crop_jpeg": b"same"}, {"crop_jpeg": b"other"}, {}]
+
+    await face_crops.persist_crops(faces)
+
+    assert stored == [2]
+    assert faces[0]["crop_s3"] == faces[1]["crop_s3"] != faces[2]["crop_s3"]
+    assert faces[3]["crop_s3"] is None
+    assert all("crop_jpeg" not in f for f in faces)
+    assert await storage.download_file(faces[2]["crop_s3"]) == b"other"
+
+
+@pytest.mark.asyncio
+async def test_failed_crop_upload_leaves_them_lazy(env, monkeypatch):
+    _, storage = env
+
+    async def fail(objects, *args):
+        raise RuntimeError("storage down")
+
+    monkeypatch.setattr(storage, "put_many", fail)
+    faces = [{"crop_jpeg": b"jpeg"}]
+    await face_crops.persist_crops(faces)
+    assert faces == [{}]
+
+
+@pytest.mark.asyncio
+async def test_lazy_crop_is_cut_once_then_served_from_storage(env, monkeypatch):
+    mongo_db, storage = env
+    image_id = await _stored_image(mongo_db, storage)
+    renders = []
+    render = face_crops.render_face_crop
+    monkeypatch.setattr(face_crops, "render_face_crop", lambda *a: renders.append(1) or render(*a))
+
+    first = await face_crops.get_face_crop("u1", image_id, "f1")
+    second = await face_crops.get_face_crop("u1", image_id, "f1")
+
+    assert cv2.imdecode(np.frombuffer(first, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (60, 60)
+    assert second == first
+    assert renders == [1]
+    face = (await mongo_db.images.find_one({}))["faces"][0]
+    assert face["crop_s3"] == storage.crop_key(first)
+
+
+@pytest.mark.asyncio
+async def test_crop_mode_off_never_stores(env):
+    mongo_db, storage = env
+    image_id = await _stored_image(mongo_db, storage)
+    await mongo_db.settings.insert_one({"user_id": "u1", "crop_storage": "off"})
+
+    assert await face_crops.get_face_crop("u1", image_id, "f1")
+    assert (await mongo_db.images.find_one({}))["faces"][0]["crop_s3"] is None
+
+
+@pytest.mark.asyncio
+async def test_crops_are_scoped_to_their_owner(env):
+    mongo_db, storage = env
+    image_id = await _stored_image(mongo_db, storage)
+
+    assert await face_crops.get_face_crop("u2", image_id, "f1") is None
+    assert await face_crops.get_face_crop("u1", image_id, "nope") is None
+    assert await face_crops.get_face_crop("u1", "not-an-id", "f1") is None
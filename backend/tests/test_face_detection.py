@@ -0,0 +1,230 @@
+import numpy as np
+import pytest
+from deepface.extendedmodels import Emotion, Gender
+
+from app.services import face_detection
+
+
+class _Output:
+    def __init__(self, array):
+        self.array = array
+
+    def numpy(self):
+        return self.array
+
+
+class _FakeModel:
+    """Records each forward pass; output is computed from the batch by fn."""
+
+    def __init__(self, fn, input_shape=(32, 32)):
+        self.fn = fn
+        self.input_shape = input_shape
+        self.batches = []
+
+    def model(self, batch, training=False):
+        self.batches.append(np.asarray(batch).shape)
+        return _Output(self.fn(np.asarray(batch)))
+
+
+def _one_hot(n_classes, label):
+    def fn(batch):
+        out = np.zeros((len(batch), n_classes), dtype=np.float32)
+        out[:, label] = 1.0
+        return out
+    return fn
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    models = {
+        face_detection.EMBED_MODEL_NAME: _FakeModel(lambda b: b.mean(axis=(1, 2, 3))[:, None]),
+        "Age": _FakeModel(_one_hot(101, 30)),
+        "Gender": _FakeModel(_one_hot(2, 1)),
+        "Emotion": _FakeModel(_one_hot(len(Emotion.labels), 3)),
+    }
+    monkeypatch.setattr(face_detection.DeepFace, "build_model", lambda name: models[name])
+    monkeypatch.setattr(face_detection, "_load_model", lambda: None)
+    return models
+
+
+def _crop(value, size=20):
+    return np.full((size, size, 3), value, dtype=np.float32)
+
+
+def test_embed_face_batch_is_one_forward_pass(fake_models):
+    embeddings = face_detection.embed_face_batch([_crop(0.1), _crop(0.5, 40), _crop(0.9)])
+
+    assert fake_models[face_detection.EMBED_MODEL_NAME].batches == [(3, 32, 32, 3)]
+    assert len(embeddings) == 3
+    assert embeddings[0][0] < embeddings[1][0] < embeddings[2][0]
+    assert face_detection.embed_face_batch([]) == []
+
+
+def test_analyze_face_batch_runs_each_model_once(fake_models):
+    attrs = face_detection.analyze_face_batch([_crop(0.2), _crop(0.4), _crop(0.6)])
+
+    assert fake_models["Age"].batches == [(3, 224, 224, 3)]
+    assert fake_models["Gender"].batches == [(3, 224, 224, 3)]
+    assert fake_models["Emotion"].batches == [(3, 48, 48, 1)]
+    assert attrs == [{"age": 30, "gender": Gender.labels[1], "emotion": Emotion.labels[3]}] * 3
+
+
+def _extracted(x, confidence, size=20, value=0.5):
+    return {
+        "face": np.full((size, size, 3), value, dtype=np.float32),
+        "facial_area": {"x": x, "y": 5, "w": size, "h": size},
+        "confidence": confidence,
+    }
+
+
+@pytest.fixture
+def fake_detector(monkeypatch):
+    """extract_faces stand-in: backend -> faces it finds; records the backends run."""
+    found = {}
+    calls = []
+
+    def extract_faces(img_path, detector_backend, enforce_detection=False, align=True):
+        calls.append(detector_backend)
+        # like DeepFace with enforce_detection=False: no face is the whole image at confidence 0
+        return found.get(detector_backend) or [_extracted(0, 0, size=img_path.shape[0])]
+
+    monkeypatch.setattr(face_detection.DeepFace, "extract_faces", extract_faces)
+    return found, calls
+
+
+def test_analyze_faces_detects_once_and_embeds_each_face(fake_models, fake_detector):
+    found, calls = fake_detector
+    found["mtcnn"] = [_extracted(10, 0.99), _extracted(50, 0.98), _extracted(90, 0.97)]
+    img = np.zeros((120, 160, 3), dtype=np.uint8)
+    for x, value in ((10, 50), (50, 100), (90, 200)):
+        img[5:25, x:x + 20] = value
+
+    faces = face_detection.analyze_faces(img)
+
+    assert calls == ["mtcnn"]
+    assert fake_models[face_detection.EMBED_MODEL_NAME].batches == [(3, 32, 32, 3)]
+    assert fake_models["Age"].batches == [(3, 224, 224, 3)]
+    assert [f["bbox"][0] for f in faces] == [10, 50, 90]
+    # each face gets its own embedding, not the first face's
+    assert len({f["embedding"][0] for f in faces}) == 3
+    assert len({f["face_id"] for f in faces}) == 3
+    assert all(f["age"] == 30 for f in faces)
+
+
+def test_analyze_faces_without_attributes(fake_models, fake_detector):
+    found, _ = fake_detector
+    found["mtcnn"] = [_extracted(10, 0.99)]
+
+    faces = face_detection.analyze_faces(np.zeros((64, 64, 3), dtype=np.uint8), with_attributes=False)
+
+    assert fake_models["Age"].batches == []
+    assert {k: faces[0][k] for k in ("age", "gender", "emotion")} == face_detection.NO_ATTRIBUTES
+
+
+def test_analyze_faces_maps_bboxes_to_source_scale(fake_models, fake_detector):
+    found, _ = fake_detector
+    found["mtcnn"] = [_extracted(10, 0.99)]
+
+    faces = face_detection.analyze_faces(np.zeros((64, 64, 3), dtype=np.uint8), source_scale=0.5)
+
+    assert faces[0]["bbox"] == [20, 10, 40, 40]
+
+
+def test_crops_are_aligned_the_same_with_or_without_downscaling(monkeypatch):
+    from app.core.config import settings
+    img = np.random.default_rng(0).integers(0, 255, (200, 200, 3), dtype=np.uint8)
+    area = {"x": 40, "y": 40, "w": 80, "h": 80, "left_eye": (70, 70), "right_eye": (100, 80)}
+    monkeypatch.setattr(face_detection.DeepFace, "extract_faces", lambda img_path, **kw: [{
+        "face": np.zeros((5, 5, 3)), "confidence": 0.9,
+        "facial_area": face_detection._rescale_area(area, img_path.shape[0] / 200),
+    }])
+
+    monkeypatch.setattr(settings, "DETECTION_MAX_SIDE", 400)
+    full = face_detection._detect_faces(img, "opencv")[0]["face"]
+    monkeypatch.setattr(settings, "DETECTION_MAX_SIDE", 100)
+    scaled = face_detection._detect_faces(img, "opencv")[0]["face"]
+
+    # not DeepFace's crop: both come from _aligned_crop on the full-resolution image
+    assert np.array_equal(full, face_detection._aligned_crop(img, area))
+    assert np.array_equal(scaled, full)
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    from app.services.detector_stats import DetectorStats
+    fresh = DetectorStats()
+    monkeypatch.setattr(face_detection, "detector_stats", fresh)
+    return fresh
+
+
+def _img():
+    return np.zeros((200, 200, 3), dtype=np.uint8)
+
+
+def test_fast_policy_stops_at_the_cheap_detector(fake_detector, stats):
+    found, calls = fake_detector
+    found["opencv"] = [_extracted(10, 0.5, size=20)]
+
+    faces = face_detection._cascade_detect(_img(), "fast")
+
+    # "fast" only falls back when nothing was found, not on weak faces
+    assert calls == ["opencv"]
+    assert len(faces) == 1
+    assert stats.snapshot()["opencv"]["fallbacks"] == 0
+
+
+def test_fast_policy_falls_back_when_nothing_found(fake_detector, stats):
+    found, calls = fake_detector
+    found["mtcnn"] = [_extracted(10, 0.99, size=60)]
+
+    faces = face_detection._cascade_detect(_img(), "fast")
+
+    assert calls == ["opencv", "mtcnn"]
+    assert faces[0]["confidence"] == 0.99
+    snapshot = stats.snapshot()
+    assert snapshot["opencv"] == {**snapshot["opencv"], "calls": 1, "fallbacks": 1}
+    assert snapshot["mtcnn"]["calls"] == 1
+
+
+def test_balanced_policy_falls_back_on_weak_or_small_faces(fake_detector, stats):
+    found, calls = fake_detector
+    found["mtcnn"] = [_extracted(10, 0.99, size=60)]
+
+    found["opencv"] = [_extracted(10, 0.5, size=60)]
+    face_detection._cascade_detect(_img(), "balanced")
+    found["opencv"] = [_extracted(10, 0.99, size=20)]
+    face_detection._cascade_detect(_img(), "balanced")
+    found["opencv"] = [_extracted(10, 0.99, size=60)]
+    face_detection._cascade_detect(_img(), "balanced")
+
+    assert calls == ["opencv", "mtcnn", "opencv", "mtcnn", "opencv"]
+    assert stats.snapshot()["opencv"]["fallbacks"] == 2
+
+
+def test_empty_fallback_keeps_earlier_faces(fake_detector, stats):
+    found, calls = fake_detector
+    found["opencv"] = [_extracted(10, 0.5, size=60)]
+
+    faces = face_detection._cascade_detect(_img(), "balanced")
+
+    assert calls == ["opencv", "mtcnn"]
+    assert faces[0]["confidence"] == 0.5
+
+
+def test_accurate_policy_and_single_backends(fake_detector, stats):
+    found, calls = fake_detector
+    face_detection._cascade_detect(_img(), "accurate")
+    face_detection._cascade_detect(_img(), "retinaface")
+    assert calls == ["mtcnn", "retinaface"]
+
+
+def test_pseudo_faces_are_dropped(fake_detector, stats):
+    found, calls = fake_detector
+    # nothing found anywhere: the confidence-0 whole image never comes back as a face
+    assert face_detection._cascade_detect(_img(), "balanced") == []
+    assert face_detection._detect_faces(_img(), "fast") == []
+
+    whole = {"face": np.zeros((200, 200, 3)), "facial_area": {"x": 0, "y": 0, "w": 200, "h": 200}, "confidence": 0.9}
+    found["retinaface"] = [whole, _extracted(10, 0.99, size=60)]
+    faces = face_detection._cascade_detect(_img(), "retinaface")
+    assert [f["facial_area"]["x"] for f in faces] == [10]
@@ -0,0 +1,49 @@
+import pytest
+from app.services import face_metadata
+from app.utils.cache import LRUCache
+
+
+class _CountingCollection:
+    """Wraps a collection and counts find() calls."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.finds = 0
+
+    def find(self, *args, **kwargs):
+        self.finds += 1
+        return self.collection.find(*args, **kwargs)
+
+
+@pytest.fixture
+def db(mongo_db, monkeypatch):
+    embeddings = _CountingCollection(mongo_db.embeddings)
+    images = _CountingCollection(mongo_db.images)
+    monkeypatch.setattr(face_metadata, "embeddings_collection", embeddings)
+    monkeypatch.setattr(face_metadata, "images_collection", images)
+    monkeypatch.setattr(face_metadata, "face_metadata_cache", LRUCache(maxsize=100, ttl=60))
+    return mongo_db, embeddings, images
+
+
+@pytest.mark.asyncio
+async def test_hits_are_hydrated_with_one_query_per_collection(db):
+    mongo_db, embeddings, images = db
+    res = await mongo_db.images.insert_one({"faces": [
+        {"face_id": f"f{i}", "crop_s3": f"crops/{i}.jpg"} for i in range(5)
+    ]})
+    await mongo_db.embeddings.insert_many([
+        {"face_id": f"f{i}", "image_id": str(res.inserted_id), "label": "bob" if i == 2 else None}
+        for i in range(5)
+    ])
+
+    meta = await face_metadata.get_face_metadata([f"f{i}" for i in range(5)] + ["unknown"])
+    assert set(meta) == {f"f{i}" for i in range(5)}
+    assert meta["f2"] == {"image_id": str(res.inserted_id), "label": "bob", "s3_crop": "crops/2.jpg"}
+    assert (embeddings.finds, images.finds) == (1, 1)
+
+    # cached now; invalidated entries are reloaded
+    await face_metadata.get_face_metadata(["f1", "f2"])
+    assert embeddings.finds == 1
+    face_metadata.invalidate_face_metadata("f2")
+    await face_metadata.get_face_metadata(["f1", "f2"])
+    assert embeddings.finds == 2
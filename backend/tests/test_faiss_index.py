@@ -0,0 +1,415 @@
+import numpy as np
+import pytest
+from app.services import faiss_index
+from app.services.faiss_index import FaissIndexManager
+from app.utils.embedding_codec import encode_embedding
+from tests.conftest import random_vectors
+
+DIM = 64
+N = 1200
+
+
+@pytest.fixture
+def gallery(mongo_db, monkeypatch):
+    monkeypatch.setattr(faiss_index, "embeddings_collection", mongo_db.embeddings)
+    monkeypatch.setattr(faiss_index, "counters_collection", mongo_db.counters)
+    # small enough to build quickly, large enough to train IVF/PQ
+    monkeypatch.setattr(faiss_index, "IVF_MIN_VECTORS", 500)
+    monkeypatch.setattr(faiss_index, "PQ_M", 4)
+    return mongo_db.embeddings
+
+
+async def _fill(collection, vecs, user_id="u1"):
+    await collection.insert_many([
+        {"face_id": f"f{i}", "user_id": user_id, "vector": encode_embedding(v),
+         "label": "alice" if i % 3 == 0 else None, "age": 20 + i % 50}
+        for i, v in enumerate(vecs)
+    ])
+
+
+async def _manager(tmp_path, monkeypatch, mode, mmap):
+    monkeypatch.setattr(faiss_index, "INDEX_MODE", mode)
+    monkeypatch.setattr(faiss_index, "MMAP_INDEX", mmap)
+    manager = FaissIndexManager(dim=DIM, index_dir=str(tmp_path), query={"user_id": "u1"})
+    await manager.build_index_from_db()
+    return manager
+
+
+def test_add_and_remove_without_a_build(gallery, tmp_path):
+    vecs = random_vectors(3, DIM)
+    manager = FaissIndexManager(dim=DIM, index_dir=str(tmp_path))
+
+    assert manager.add(["a", "b", "c"], vecs, [{"label": "x"}, None, None]) == 3
+    assert [f for f, _ in manager.search(vecs[1].tolist(), top_k=3)][0] == "b"
+    assert manager.remove(["b"]) == 1
+    assert "b" not in [f for f, _ in manager.search(vecs[1].tolist(), top_k=3)]
+    assert manager.index.ntotal == 2
+    assert manager.search(vecs[1].tolist(), filters={"label": "x"})[0][0] == "a"
+    assert manager.add([], []) == 0
+    with pytest.raises(ValueError):
+        manager.add(["d", "e"], vecs[:1])
+
+
+def test_readding_a_face_replaces_its_vector(gallery, tmp_path):
+    vecs = random_vectors(3, DIM)
+    manager = FaissIndexManager(dim=DIM, index_dir=str(tmp_path))
+    manager.add(["a", "b"], vecs[:2])
+
+    manager.add(["a"], vecs[2:])
+
+    assert manager.index.ntotal == 2
+    assert manager.search(vecs[2].tolist(), top_k=1)[0][0] == "a"
+    # the old vector is gone, not just outranked
+    assert all(score < 0.99 for _, score in manager.search(vecs[0].tolist(), top_k=2))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mmap", [False, True])
+@pytest.mark.parametrize("mode", faiss_index.INDEX_MODES)
+async def test_search_each_mode(gallery, tmp_path, monkeypatch, mode, mmap):
+    vecs = random_vectors(N, DIM)
+    await _fill(gallery, vecs)
+    manager = await _manager(tmp_path, monkeypatch, mode, mmap)
+    assert manager.mode == mode
+
+    results = manager.search(vecs[7].tolist(), top_k=5, nprobe=8, ef_search=32)
+    assert len(results) == 5
+    assert results[0][0] == "f7"
+    # PQ scores are computed on compressed codes
+    min_score = 0.5 if mode == "ivf_pq" else 0.9
+    assert results[0][1] > min_score
+
+    batch = manager.search_batch(vecs[[1, 2, 3]], top_k=3)
+    assert [r[0][0] for r in batch] == ["f1", "f2", "f3"]
+
+    assert manager.range_search(vecs[11].tolist(), min_score=min_score)[0][0] == "f11"
+    assert manager.best_match(vecs[12].tolist(), min_score=min_score)[0] == "f12"
+
+    # indexes that can't delete in place skip removed faces instead
+    assert manager.remove(["f7"]) == 1
+    assert "f7" not in [f for f, _ in manager.search(vecs[7].tolist(), top_k=5)]
+    manager.add(["new"], random_vectors(1, DIM, seed=1))
+    assert manager.search(vecs[8].tolist(), top_k=1)[0][0] == "f8"
+
+
+def test_auto_mode_follows_gallery_size(monkeypatch):
+    monkeypatch.setattr(faiss_index, "INDEX_MODE", "auto")
+    monkeypatch.setattr(faiss_index, "IVF_MIN_VECTORS", 100)
+    monkeypatch.setattr(faiss_index, "FLAT_MAX_VECTORS", 1000)
+    monkeypatch.setattr(faiss_index, "IVF_FLAT_MAX_VECTORS", 10000)
+
+    assert faiss_index.resolve_index_mode(999) == "flat"
+    assert faiss_index.resolve_index_mode(1000) == "ivf_flat"
+    assert faiss_index.resolve_index_mode(10000) == "ivf_pq"
+    # an explicit mode wins, but IVF can't train on a tiny gallery
+    assert faiss_index.resolve_index_mode(50, "hnsw") == "hnsw"
+    assert faiss_index.resolve_index_mode(50, "ivf_pq") == "flat"
+    with pytest.raises(ValueError):
+        faiss_index.resolve_index_mode(50, "lsh")
+
+
+@pytest.mark.asyncio
+async def test_writes_during_a_rebuild_are_replayed(gallery, tmp_path, monkeypatch):
+    vecs = random_vectors(22, DIM)
+    await _fill(gallery, vecs[:20])
+    manager = await _manager(tmp_path, monkeypatch, "flat", False)
+    read_embeddings = manager._read_embeddings
+
+    async def read_then_write():
+        result = await read_embeddings()
+        # arrives after the build read MongoDB, before the swap
+        manager.add(["late"], [vecs[20]])
+        manager.remove(["f3"])
+        manager.update_attributes(["f4"], [{"label": "zed"}])
+        return result
+
+    monkeypatch.setattr(manager, "_read_embeddings", read_then_write)
+    await manager.build_index_from_db()
+
+    assert manager.search(vecs[20].tolist(), top_k=1)[0][0] == "late"
+    assert "f3" not in [f for f, _ in manager.search(vecs[3].tolist(), top_k=5)]
+    assert manager.search(vecs[4].tolist(), top_k=1, filters={"label": "zed"})[0][0] == "f4"
+    assert manager._pending is None
+
+
+@pytest.mark.asyncio
+async def test_build_streams_in_batches(gallery, tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_index, "BUILD_BATCH_SIZE", 7)
+    vecs = random_vectors(30, DIM)
+    await _fill(gallery, vecs)
+    await gallery.insert_one({"face_id": "bad", "user_id": "u1", "vector": encode_embedding([1.0, 2.0])})
+    manager = await _manager(tmp_path, monkeypatch, "flat", False)
+    assert manager.index.ntotal == 30
+    assert manager.search(vecs[29].tolist(), top_k=1)[0][0] == "f29"
+
+    # a restart serves the persisted index until the next rebuild
+    restarted = FaissIndexManager(dim=DIM, index_dir=str(tmp_path), query={"user_id": "u1"})
+    assert restarted.load_index()
+    assert restarted.search(vecs[29].tolist(), top_k=1)[0][0] == "f29"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mmap", [False, True])
+@pytest.mark.parametrize("mode", ["flat", "ivf_flat", "hnsw"])
+async def test_remove_and_readd(gallery, tmp_path, monkeypatch, mode, mmap):
+    vecs = random_vectors(N + 1, DIM)
+    await _fill(gallery, vecs[:N])
+    manager = await _manager(tmp_path, monkeypatch, mode, mmap)
+
+    assert manager.remove(["f5", "missing"]) == 1
+    assert "f5" not in [f for f, _ in manager.search(vecs[5].tolist(), top_k=5)]
+    assert manager.remove(["f5"]) == 0
+
+    # re-enrolling f6 with a new vector: the old one must no longer find it
+    manager.add(["f6"], [vecs[N]], [{"label": "carol"}])
+    assert "f6" not in [f for f, _ in manager.search(vecs[6].tolist(), top_k=5)]
+    assert manager.search(vecs[N].tolist(), top_k=1)[0][0] == "f6"
+    assert manager.search(vecs[N].tolist(), top_k=1, filters={"label": "carol"})[0][0] == "f6"
+
+    # and again, back to the original vector
+    manager.add(["f6"], [vecs[6]])
+    assert manager.search(vecs[6].tolist(), top_k=1)[0][0] == "f6"
+    assert "f6" not in [f for f, _ in manager.search(vecs[N].tolist(), top_k=5)]
+    assert manager.search(vecs[N].tolist(), top_k=5, filters={"label": "carol"}) == []
+
+    manager.update_attributes(["f6"], [{"label": "dave"}])
+    assert manager.search(vecs[6].tolist(), top_k=1, filters={"label": "dave"})[0][0] == "f6"
+
+    assert manager.remove(["f6"]) == 1
+    assert "f6" not in [f for f, _ in manager.search(vecs[6].tolist(), top_k=5)]
+
+
+@pytest.mark.asyncio
+async def test_cold_start_maps_the_persisted_index(gallery, tmp_path, monkeypatch):
+    vecs = random_vectors(50, DIM)
+    await _fill(gallery, vecs)
+    await _manager(tmp_path, monkeypatch, "ivf_flat", True)
+
+    # a second worker: no MongoDB read, the id table is memory-mapped
+    manager = FaissIndexManager(dim=DIM, index_dir=str(tmp_path), query={"user_id": "u1"})
+    assert manager.load_index()
+    assert isinstance(manager.id_map.ids, np.memmap)
+    assert manager.search(vecs[42].tolist(), top_k=1)[0][0] == "f42"
+    assert manager.search(vecs[3].tolist(), top_k=1, filters={"label": "alice"})[0][0] == "f3"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", faiss_index.INDEX_MODES)
+async def test_only_ivf_is_mapped_behind_a_delta(gallery, tmp_path, monkeypatch, mode):
+    vecs = random_vectors(N + 1, DIM)
+    await _fill(gallery, vecs[:N])
+    built = await _manager(tmp_path, monkeypatch, mode, True)
+    restarted = FaissIndexManager(dim=DIM, index_dir=str(tmp_path), query={"user_id": "u1"})
+    assert restarted.load_index()
+
+    ivf = mode in ("ivf_flat", "ivf_pq")
+    for manager in (built, restarted):
+        assert (manager._delta is not None) == ivf
+        manager.add(["new"], [vecs[N]])
+        manager.remove(["f5"])
+        # flat and HNSW take writes in place (IVF adds go to the delta);
+        # flat deletes, the others keep the removed vector as a tombstone
+        assert manager.index.ntotal == (N + 1 if mode == "hnsw" else N)
+        assert manager._tombstones == (0 if mode == "flat" else 1)
+        assert manager.search(vecs[N].tolist(), top_k=1)[0][0] == "new"
+        assert "f5" not in [f for f, _ in manager.search(vecs[5].tolist(), top_k=5)]
+
+
+def test_id_table_overlays():
+    ids = np.array([30, 10, 20], dtype="int64")
+    table = faiss_index.IdTable.from_pairs(ids, ["c", "a", "b"])
+    assert list(table.ids) == [10, 20, 30]
+    assert table.get(20) == "b" and 40 not in table
+    table.update([(40, "d")])
+    assert table.pop(10) == "a" and table.get(10) is None
+    assert table.used(10) and not table.used(50)
+    assert table.get(40) == "d"
+
+
+@pytest.mark.asyncio
+async def test_batch_search_matches_single_probes(gallery, tmp_path, monkeypatch):
+    vecs = random_vectors(200, DIM)
+    await _fill(gallery, vecs)
+    manager = await _manager(tmp_path, monkeypatch, "flat", False)
+
+    probes = vecs[[4, 9, 15, 30]] * 3.0
+    before = probes.copy()
+    batch = manager.search_batch(probes, top_k=3)
+    assert batch == [manager.search(p.tolist(), top_k=3) for p in probes]
+    assert [hits[0][0] for hits in batch] == ["f4", "f9", "f15", "f30"]
+    # normalizing for the search leaves the caller's vectors alone
+    assert np.array_equal(probes, before)
+
+    filtered = manager.search_batch(probes, top_k=3, filters={"label": "alice"})
+    assert all(face_id in {f"f{i}" for i in range(0, 200, 3)} for hits in filtered for face_id, _ in hits)
+    # probes 9, 15 and 30 are labelled alice themselves; probe 4 is not
+    assert [hits[0][0] for hits in filtered[1:]] == ["f9", "f15", "f30"]
+    assert filtered[0][0][0] != "f4"
+    assert manager.search_batch(probes, filters={"label": "nobody"}) == [[]] * 4
+    assert manager.search_batch([]) == []
+
+
+@pytest.mark.asyncio
+async def test_tenant_dirs_never_collide(gallery, tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_index, "INDEX_DIR", str(tmp_path))
+    vecs = random_vectors(2, DIM)
+    await _fill(gallery, vecs[:1], user_id="a@b.com")
+    await _fill(gallery, vecs[1:], user_id="a_b.com")
+    registry = faiss_index.TenantIndexRegistry(dim=DIM)
+
+    first = await registry.get("a@b.com")
+    second = await registry.get("a_b.com")
+    assert first.index_dir != second.index_dir
+    assert first.search(vecs[0].tolist())[0][0] == "f0"
+    assert [f for f, _ in second.search(vecs[0].tolist())] == ["f0"]
+    assert second.search(vecs[0].tolist())[0][1] < 0.9
+
+    # files found in a directory written for someone else are not loaded
+    stranger = FaissIndexManager(dim=DIM, index_dir=first.index_dir, owner="someone/default")
+    assert not stranger.load_index()
+    same = FaissIndexManager(dim=DIM, index_dir=first.index_dir, owner=first.owner)
+    assert same.load_index()
+
+
+def _tenant_manager(tmp_path):
+    return FaissIndexManager(dim=DIM, index_dir=str(tmp_path), query={"user_id": "u1"}, owner="u1/default")
+
+
+@pytest.mark.asyncio
+async def test_load_replays_changes_logged_after_the_snapshot(gallery, tmp_path, monkeypatch):
+    vecs = random_vectors(21, DIM)
+    await _fill(gallery, vecs[:20])
+    await _tenant_manager(tmp_path).build_index_from_db()
+
+    # another process swaps one face for another: same count, different gallery
+    await gallery.delete_one({"face_id": "f5"})
+    await faiss_index.record_index_change("u1", "default", ["f5"])
+    await gallery.insert_one({"face_id": "late", "user_id": "u1", "vector": encode_embedding(vecs[20])})
+    await faiss_index.record_index_change("u1", "default", ["late"])
+
+    restarted = _tenant_manager(tmp_path)
+    rebuilds = []
+    monkeypatch.setattr(restarted, "_rebuild", lambda: rebuilds.append(1))
+    await restarted.ensure_loaded()
+    assert rebuilds == []
+    assert restarted.search(vecs[20].tolist(), top_k=1)[0][0] == "late"
+    assert restarted.search(vecs[5].tolist(), top_k=1)[0][0] != "f5"
+    assert restarted.version == 2
+
+
+@pytest.mark.asyncio
+async def test_load_rebuilds_when_the_log_was_trimmed(gallery, tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_index, "CHANGE_LOG_SIZE", 1)
+    vecs = random_vectors(22, DIM)
+    await _fill(gallery, vecs[:20])
+    await _tenant_manager(tmp_path).build_index_from_db()
+
+    for i in (20, 21):
+        await gallery.insert_one({"face_id": f"late{i}", "user_id": "u1", "vector": encode_embedding(vecs[i])})
+        await faiss_index.record_index_change("u1", "default", [f"late{i}"])
+
+    restarted = _tenant_manager(tmp_path)
+    await restarted.ensure_loaded()
+    assert restarted.search(vecs[20].tolist(), top_k=1)[0][0] == "late20"
+    assert restarted.version == 2
+    assert restarted._persisted_version() == 2
+
+
+@pytest.mark.asyncio
+async def test_unusable_docs_dont_force_a_rebuild_on_load(gallery, tmp_path, monkeypatch):
+    await _fill(gallery, random_vectors(10, DIM))
+    await gallery.insert_one({"face_id": "bad", "user_id": "u1", "vector": encode_embedding(random_vectors(1, 4)[0])})
+    await _tenant_manager(tmp_path).build_index_from_db()
+
+    restarted = _tenant_manager(tmp_path)
+    rebuilds = []
+    monkeypatch.setattr(restarted, "_rebuild", lambda: rebuilds.append(1))
+    await restarted.ensure_loaded()
+    assert rebuilds == []
+    assert len(restarted.id_map.ids) == 10
+
+
+@pytest.mark.asyncio
+async def test_workers_sync_each_others_changes(gallery, tmp_path, monkeypatch):
+    vecs = random_vectors(12, DIM)
+    await _fill(gallery, vecs[:10])
+    first, second = _tenant_manager(tmp_path), _tenant_manager(tmp_path)
+    await first.ensure_loaded()
+    await second.ensure_loaded()
+
+    # enrolled through the first worker
+    await gallery.insert_one({"face_id": "new", "user_id": "u1", "vector": encode_embedding(vecs[10]),
+                              "label": "bob"})
+    await faiss_index.record_index_change("u1", "default", ["new"])
+    first.add(["new"], [vecs[10]], [{"label": "bob"}])
+    await gallery.update_one({"face_id": "f0"}, {"$set": {"label": "carol"}})
+    await gallery.delete_one({"face_id": "f1"})
+    await faiss_index.record_index_change("u1", "default", ["f0", "f1"])
+
+    await second.sync(max_age=0)
+    assert second.search(vecs[10].tolist(), top_k=1, filters={"label": "bob"})[0][0] == "new"
+    assert second.search(vecs[0].tolist(), top_k=1, filters={"label": "carol"})[0][0] == "f0"
+    assert second.search(vecs[1].tolist(), top_k=1)[0][0] != "f1"
+    # the throttle skips MongoDB until max_age has passed
+    await gallery.delete_one({"face_id": "f2"})
+    await faiss_index.record_index_change("u1", "default", ["f2"])
+    await second.sync(max_age=60)
+    assert second.search(vecs[2].tolist(), top_k=1)[0][0] == "f2"
+    await first.sync(max_age=0)
+    assert first.search(vecs[2].tolist(), top_k=1)[0][0] != "f2"
+    assert first.search(vecs[10].tolist(), top_k=1)[0][0] == "new"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["flat", "hnsw"])
+async def test_range_search_returns_everything_above_the_threshold(gallery, tmp_path, monkeypatch, mode):
+    vecs = random_vectors(100, DIM)
+    probe = vecs[0]
+    # near-duplicates of the probe at decreasing similarity
+    near = [probe + noise * random_vectors(1, DIM, seed=i + 1)[0] for i, noise in enumerate((0.2, 0.4, 0.6))]
+    near = [v / np.linalg.norm(v) for v in near]
+    await _fill(gallery, np.vstack([vecs, near]).astype("float32"))
+    manager = await _manager(tmp_path, monkeypatch, mode, False)
+
+    results = manager.range_search(probe.tolist(), min_score=0.75)
+    scores = [score for _, score in results]
+    assert [face_id for face_id, _ in results] == ["f0", "f100", "f101", "f102"]
+    assert scores == sorted(scores, reverse=True) and min(scores) > 0.75
+
+    assert len(manager.range_search(probe.tolist(), min_score=0.75, max_results=2)) == 2
+    assert manager.best_match(probe.tolist(), min_score=0.75)[0] == "f0"
+    assert manager.best_match(random_vectors(1, DIM, seed=99)[0].tolist(), min_score=0.75) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["flat", "ivf_flat", "hnsw"])
+async def test_filtered_search(gallery, tmp_path, monkeypatch, mode):
+    vecs = random_vectors(N + 1, DIM)
+    await _fill(gallery, vecs[:N])
+    manager = await _manager(tmp_path, monkeypatch, mode, True)
+
+    # f7 is unlabelled: a label filter must skip it and still fill top_k
+    results = manager.search(vecs[7].tolist(), top_k=5, filters={"label": "alice"})
+    assert len(results) == 5
+    assert all(int(face_id[1:]) % 3 == 0 for face_id, _ in results)
+
+    results = manager.search(vecs[9].tolist(), top_k=3, filters={"label": "alice", "min_age": 29, "max_age": 29})
+    assert results[0][0] == "f9"
+    assert all(20 + int(face_id[1:]) % 50 == 29 for face_id, _ in results)
+
+    assert manager.search(vecs[9].tolist(), filters={"label": "nobody"}) == []
+    ranged = manager.range_search(vecs[9].tolist(), min_score=0.0, filters={"enrolled": False})
+    assert ranged and all(int(face_id[1:]) % 3 != 0 for face_id, _ in ranged)
+
+    # faces added since the build are filtered too
+    manager.add(["new"], [vecs[N]], [{"label": "bob"}])
+    assert manager.search(vecs[N].tolist(), top_k=1, filters={"label": "bob"})[0][0] == "new"
+
+
+@pytest.mark.asyncio
+async def test_rebuild_keeps_only_filter_attributes(gallery, tmp_path, monkeypatch):
+    await _fill(gallery, random_vectors(10, DIM))
+    manager = FaissIndexManager(dim=DIM, index_dir=str(tmp_path), query={"user_id": "u1"})
+    _, face_ids, attributes = await manager._read_embeddings()
+    assert len(face_ids) == 10
+    assert set(attributes[0]) == set(faiss_index.FILTER_FIELDS)
@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.utils.image_io import decode_image, decode_image_scaled, load_image
+
+
+def _encode(img, ext=".jpg"):
+    return cv2.imencode(ext, img)[1].tobytes()
+
+
+def test_load_image_passes_arrays_through():
+    img = np.zeros((10, 12, 3), dtype=np.uint8)
+    out, scale = load_image(img)
+    assert out is img
+    assert scale == 1.0
+
+
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview])
+def test_load_image_decodes_in_memory(wrap):
+    img = np.full((30, 40, 3), 200, dtype=np.uint8)
+    out, _ = load_image(wrap(_encode(img, ".png")))
+    assert out.shape == (30, 40, 3)
+    assert np.array_equal(out, img)
+
+
+def test_load_image_rejects_garbage():
+    assert load_image(b"not an image") == (None, 1.0)
+    assert decode_image(b"") is None
+
+
+@pytest.mark.asyncio
+async def test_face_service_decodes_bytes_for_the_pipeline(monkeypatch):
+    from app.services import face_service
+    from app.services.inference_cache import InferenceCache
+
+    seen = []
+
+    def analyze_faces(img, model_name, detector_backend, with_attributes=True, source_scale=1.0):
+        seen.append((type(img), img.shape, source_scale))
+        return [{"face_id": "f", "bbox": [0, 0, 1, 1], "confidence": 0.9, "embedding": [1.0]}]
+
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 0)
+    monkeypatch.setattr(face_service, "analyze_faces", analyze_faces)
+    monkeypatch.setattr(face_service, "inference_cache", InferenceCache(maxsize=10, ttl=60))
+
+    faces = await face_service.FaceService().analyze_image(_encode(np.zeros((48, 64, 3), dtype=np.uint8)))
+
+    assert seen == [(np.ndarray, (48, 64, 3), 1.0)]
+    assert faces[0]["embedding"] == [1.0]
+
+
+def test_oversized_header_raises_before_decoding(monkeypatch):
+    from app.utils.image_io import ImageTooLarge, check_image_size
+    data = _encode(np.zeros((100, 120, 3), dtype=np.uint8))
+    assert check_image_size(data) == (120, 100)
+
+    monkeypatch.setattr(settings, "IMAGE_MAX_PIXELS", 100 * 120 - 1)
+    with pytest.raises(ImageTooLarge):
+        check_image_size(data)
+    with pytest.raises(ImageTooLarge):
+        decode_image_scaled(data)
+
+
+def test_large_jpeg_decodes_at_reduced_scale(monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_DECODE_MIN_SIDE", 100)
+    data = _encode(np.full((400, 800, 3), 90, dtype=np.uint8))
+
+    img, scale = decode_image_scaled(data)
+
+    # 1/8 is the coarsest scale whose long side (800 / 8 = 100) still reaches the minimum
+    assert img.shape[:2] == (50, 100)
+    assert scale == pytest.approx(1 / 8)
+
+
+def test_small_images_decode_at_full_size(monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_DECODE_MIN_SIDE", 2048)
+    img, scale = decode_image_scaled(_encode(np.zeros((300, 400, 3), dtype=np.uint8)))
+    assert img.shape[:2] == (300, 400)
+    assert scale == 1.0
+
+
+def test_downscale_caps_the_long_side():
+    from app.utils.image_io import downscale
+    img = np.zeros((600, 1200, 3), dtype=np.uint8)
+
+    small, scale = downscale(img, 300)
+    assert small.shape[:2] == (150, 300)
+    assert scale == 0.25
+
+    assert downscale(img, 2000) == (img, 1.0)
+    assert downscale(img, 0)[1] == 1.0
+
+
+def test_detection_runs_on_a_downscaled_copy(monkeypatch):
+    from app.services import face_detection
+    monkeypatch.setattr(settings, "DETECTION_MAX_SIDE", 100)
+    seen = []
+
+    def extract_faces(img_path, detector_backend, enforce_detection, align=True):
+        seen.append(img_path.shape[:2])
+        return [{"face": np.zeros((10, 10, 3)), "confidence": 0.9,
+                 "facial_area": {"x": 10, "y": 20, "w": 10, "h": 10}}]
+
+    monkeypatch.setattr(face_detection.DeepFace, "extract_faces", extract_faces)
+    img = np.zeros((200, 400, 3), dtype=np.uint8)
+
+    detected = face_detection._detect_faces(img, "opencv")
+
+    assert seen == [(50, 100)]
+    # boxes come back in img coordinates, crops are cut from img at full resolution
+    assert detected[0]["facial_area"] == {"x": 40, "y": 80, "w": 40, "h": 40}
+    assert detected[0]["face"].shape[:2] == (40, 40)
+
+
+def test_probes_are_decoded_in_the_worker(monkeypatch):
+    from app.services import face_detection
+    monkeypatch.setattr(face_detection, "_load_model", lambda: None)
+    monkeypatch.setattr(face_detection, "_probe_face", lambda img, detector: img)
+    monkeypatch.setattr(face_detection, "embed_face_batch", lambda faces: [[float(f.shape[0])] for f in faces])
+    probes = [_encode(np.zeros((16, 16, 3), dtype=np.uint8)), b"", _encode(np.zeros((32, 32, 3), dtype=np.uint8))]
+
+    # search and verify hand over encoded bytes; the ones that don't decode come back as None
+    assert face_detection.compute_embeddings_from_images(probes) == [[16.0], None, [32.0]]
@@ -0,0 +1,31 @@
+import importlib
+import pytest
+
+SERVICE_MODULES = [
+    "app.db.mongo",
+    "app.services.faiss_index",
+    "app.services.ingestion",
+    "app.services.embedding_batcher",
+    "app.services.face_crops",
+    "app.services.face_attributes",
+    "app.services.face_metadata",
+    "app.services.webhook",
+]
+
+
+@pytest.mark.parametrize("name", SERVICE_MODULES)
+def test_service_modules_import(name):
+    importlib.import_module(name)
+
+
+def test_app_imports():
+    pytest.importorskip("deepface")
+    from app.main import app
+    paths = {route.path for route in app.routes}
+    assert {"/health", "/ready"} <= paths
+
+
+def test_worker_imports():
+    pytest.importorskip("deepface")
+    from app.worker import celery_app
+    assert "images.process_upload" in celery_app.tasks
@@ -0,0 +1,83 @@
+import pytest
+from app.core.config import settings
+from app.services import face_service
+from app.services.inference_cache import InferenceCache
+
+
+class _FakeRedis:
+    def __init__(self, fail=False):
+        self.data = {}
+        self.fail = fail
+
+    async def get(self, key):
+        if self.fail:
+            raise ConnectionError("redis down")
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.data[key] = value
+
+
+def test_key_covers_content_and_parameters():
+    key = InferenceCache.key("faces", b"abc", "ArcFace", "balanced")
+    assert key == InferenceCache.key("faces", b"abc", "ArcFace", "balanced")
+    assert key != InferenceCache.key("faces", b"abd", "ArcFace", "balanced")
+    assert key != InferenceCache.key("faces", b"abc", "ArcFace", "fast")
+    assert key != InferenceCache.key("probe", b"abc", "ArcFace", "balanced")
+
+
+@pytest.mark.asyncio
+async def test_hits_are_fresh_copies():
+    cache = InferenceCache(maxsize=10, ttl=60)
+    await cache.set("k", [{"face_id": "a"}])
+
+    hit = await cache.get("k")
+    hit[0]["face_id"] = "changed"
+    assert await cache.get("k") == [{"face_id": "a"}]
+    assert await cache.get("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_redis_layer_is_shared_and_optional():
+    writer, reader = InferenceCache(maxsize=10, ttl=60), InferenceCache(maxsize=10, ttl=60)
+    writer.redis = reader.redis = _FakeRedis()
+
+    await writer.set("k", [1.0, 2.0])
+    # another replica finds it in Redis, then keeps it locally
+    assert await reader.get("k") == [1.0, 2.0]
+    reader.redis.data.clear()
+    assert await reader.get("k") == [1.0, 2.0]
+
+    # a Redis outage degrades to the local LRU instead of failing
+    down = InferenceCache(maxsize=10, ttl=60)
+    down.redis = _FakeRedis(fail=True)
+    await down.set("k", "v")
+    assert await down.get("k") == "v"
+    assert await down.get("other") is None
+
+
+@pytest.mark.asyncio
+async def test_repeat_image_skips_inference_with_new_face_ids(monkeypatch):
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 0)
+    monkeypatch.setattr(face_service, "inference_cache", InferenceCache(maxsize=10, ttl=60))
+    calls = []
+
+    def analyze(image, model_name, detector, with_attributes):
+        calls.append(image)
+        return [{"face_id": f"face_{len(calls)}", "confidence": 0.9, "embedding": [0.5]}]
+
+    monkeypatch.setattr(face_service, "_analyze", analyze)
+    service = face_service.FaceService()
+
+    first = await service.analyze_image(b"image")
+    second = await service.analyze_image(b"image")
+    assert calls == [b"image"]
+    assert second[0]["embedding"] == first[0]["embedding"]
+    assert second[0]["face_id"] != first[0]["face_id"]
+
+    # other options or content miss the cache
+    await service.analyze_image(b"image", with_attributes=False)
+    await service.analyze_image(b"other")
+    assert len(calls) == 3
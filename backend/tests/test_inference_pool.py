@@ -0,0 +1,54 @@
+import threading
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+
+from app.core.config import settings
+from app.services import inference_pool
+
+
+def _thread_name(x, y=0):
+    return threading.current_thread().name, x + y
+
+
+@pytest.mark.asyncio
+async def test_inline_mode_runs_off_the_loop(monkeypatch):
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 0)
+    assert inference_pool.start() is None
+
+    name, total = await inference_pool.run_inference(_thread_name, 2, y=3)
+    assert total == 5
+    assert name != threading.current_thread().name
+
+
+def test_intra_op_threads_split_cores(monkeypatch):
+    monkeypatch.setattr(inference_pool.os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(settings, "INFERENCE_INTRA_OP_THREADS", 0)
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 3)
+    assert inference_pool.intra_op_threads() == 2
+
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 16)
+    assert inference_pool.intra_op_threads() == 1
+
+    monkeypatch.setattr(settings, "INFERENCE_INTRA_OP_THREADS", 4)
+    assert inference_pool.intra_op_threads() == 4
+
+
+class _BrokenExecutor:
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        raise BrokenProcessPool("worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+@pytest.mark.asyncio
+async def test_broken_pool_is_replaced(monkeypatch):
+    broken = _BrokenExecutor()
+    monkeypatch.setattr(inference_pool, "_executor", broken)
+    with pytest.raises(BrokenProcessPool):
+        await inference_pool.run_inference(_thread_name, 1)
+    assert broken.shut_down
+    assert inference_pool._executor is None
@@ -0,0 +1,259 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from app.services import faiss_index, ingestion
+from app.services.ingestion import JobIndexer
+from app.utils.embedding_codec import encode_embedding
+from tests.conftest import random_vectors
+
+DIM = 8
+
+
+@pytest.fixture
+def db(mongo_db, monkeypatch, tmp_path):
+    for name in ("jobs", "counters", "embeddings", "images"):
+        monkeypatch.setattr(ingestion, f"{name}_collection", mongo_db[name])
+    monkeypatch.setattr(faiss_index, "embeddings_collection", mongo_db.embeddings)
+    monkeypatch.setattr(faiss_index, "counters_collection", mongo_db.counters)
+    monkeypatch.setattr(faiss_index, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(ingestion, "tenant_indexes", faiss_index.TenantIndexRegistry(dim=DIM))
+    return mongo_db
+
+
+async def _finish_job(db, seq: int, image_id: str, vec):
+    await db.embeddings.insert_one({
+        "face_id": f"face-{image_id}", "image_id": image_id, "user_id": "u1",
+        "namespace": "default", "vector": encode_embedding(vec)
+    })
+    await db.jobs.insert_one({"status": "done", "user_id": "u1", "image_id": image_id, "seq": seq})
+
+
+@pytest.mark.asyncio
+async def test_job_seq_is_monotonic(db):
+    assert await ingestion.current_job_seq() == 0
+    assert [await ingestion.next_job_seq() for _ in range(3)] == [1, 2, 3]
+    assert await ingestion.current_job_seq() == 3
+
+
+@pytest.mark.asyncio
+async def test_indexer_waits_for_gaps_and_indexes_each_job_once(db):
+    vecs = random_vectors(3, DIM)
+    index = await ingestion.tenant_indexes.get("u1")
+    indexer = JobIndexer(after=0)
+
+    # job 2 is written before job 1, whose worker took its number first
+    await _finish_job(db, 2, "img2", vecs[2])
+    await indexer.poll()
+    assert indexer.after == 0
+    assert index.search(vecs[2].tolist(), top_k=1)[0][0] == "face-img2"
+
+    await _finish_job(db, 1, "img1", vecs[1])
+    await indexer.poll()
+    assert indexer.after == 2
+    assert index.search(vecs[1].tolist(), top_k=1)[0][0] == "face-img1"
+    # nothing was added twice
+    assert index.index.ntotal == 2
+
+
+@pytest.mark.asyncio
+async def test_indexer_gives_up_on_a_gap_after_the_timeout(db, monkeypatch):
+    monkeypatch.setattr(ingestion, "JOB_SEQ_GAP_TIMEOUT_SECONDS", 0.0)
+    await ingestion.tenant_indexes.get("u1")
+    indexer = JobIndexer(after=0)
+    await _finish_job(db, 3, "img3", random_vectors(1, DIM)[0])
+
+    await indexer.poll()
+    assert indexer.after == 0
+    await indexer.poll()
+    assert indexer.after == 3
+
+
+def _face(vec):
+    return {"face_id": ingestion.new_face_id(), "embedding": vec.tolist(), "bbox": [0, 0, 1, 1]}
+
+
+class _Storage:
+    def __init__(self, files):
+        self.files = files
+
+    async def download_file(self, key):
+        if key not in self.files:
+            raise FileNotFoundError(key)
+        return self.files[key]
+
+
+@pytest.fixture
+def worker(db, monkeypatch):
+    """process_upload_job with stubbed storage, detection and webhooks."""
+    events = []
+    detected = []
+
+    async def detect_faces_cached(content, mode, crop_mode="lazy"):
+        detected.append((content, mode))
+        return [_face(random_vectors(1, DIM, seed=len(detected))[0])]
+
+    async def dispatch(event, payload):
+        events.append(event)
+
+    monkeypatch.setattr(ingestion, "storage_service", _Storage({"uploads/a.jpg": b"jpeg"}))
+    monkeypatch.setattr(ingestion, "detect_faces_cached", detect_faces_cached)
+    monkeypatch.setattr(ingestion, "dispatch_event_async", dispatch)
+    # workers only write MongoDB; the API process indexes finished jobs
+    monkeypatch.setattr(ingestion, "tenant_indexes", None)
+    return db, detected, events
+
+
+@pytest.mark.asyncio
+async def test_upload_job_runs_once_and_leaves_indexing_to_the_api(worker):
+    db, detected, events = worker
+    job_id = await ingestion.create_upload_job("u1", "a.jpg", "uploads/a.jpg", "deferred")
+    assert (await ingestion.get_job("u1", job_id))["status"] == "queued"
+
+    await ingestion.process_upload_job(job_id)
+    await ingestion.process_upload_job(job_id)
+
+    job = await ingestion.get_job("u1", job_id)
+    assert job["status"] == "done" and job["faces"] == 1
+    # attributes are computed in the job, nobody waits on the response
+    assert detected == [(b"jpeg", "sync")]
+    assert events == ["image.uploaded"]
+    assert (await db.jobs.find_one({}))["seq"] == 1
+    assert await db.embeddings.count_documents({"image_id": job["image_id"]}) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_upload_job_records_the_error(worker):
+    db, _, events = worker
+    job_id = await ingestion.create_upload_job("u1", "b.jpg", "uploads/missing.jpg", "sync")
+
+    await ingestion.process_upload_job(job_id)
+
+    job = await ingestion.get_job("u1", job_id)
+    assert job["status"] == "failed" and "missing.jpg" in job["error"]
+    assert events == ["image.upload_failed"]
+    assert await ingestion.get_job("u2", job_id) is None
+    assert await ingestion.get_job("u1", "not-an-id") is None
+
+
+class _FailingCollection:
+    async def insert_many(self, docs, **kwargs):
+        raise RuntimeError("embeddings unavailable")
+
+
+@pytest.mark.asyncio
+async def test_bulk_writer_writes_images_embeddings_and_index(db):
+    vecs = random_vectors(2, DIM)
+    writer = ingestion._BulkWriter("u1", "off", batch_size=10)
+    results = [{"name": "a.jpg"}, {"name": "b.jpg"}]
+    await writer.add(results[0], "k/a.jpg", [_face(vecs[0])])
+    await writer.add(results[1], "k/b.jpg", [])
+    await writer.flush()
+
+    assert [r["status"] for r in results] == ["ok", "ok"]
+    assert await db.images.count_documents({}) == 2
+    emb = await db.embeddings.find_one({})
+    assert emb["image_id"] == results[0]["image_id"]
+    index = await ingestion.tenant_indexes.get("u1")
+    assert index.search(vecs[0].tolist(), top_k=1)[0][0] == emb["face_id"]
+
+
+@pytest.mark.asyncio
+async def test_bulk_writer_reports_stored_images_whose_faces_failed(db, monkeypatch):
+    monkeypatch.setattr(ingestion, "embeddings_collection", _FailingCollection())
+    writer = ingestion._BulkWriter("u1", "off", batch_size=10)
+    results = [{"name": "a.jpg"}, {"name": "b.jpg"}]
+    await writer.add(results[0], "k/a.jpg", [_face(random_vectors(1, DIM)[0])])
+    await writer.add(results[1], "k/b.jpg", [])
+    await writer.flush()
+
+    # both images were stored; only a's faces are missing
+    assert results[0]["status"] == "partial" and results[0]["image_id"]
+    assert results[1]["status"] == "ok"
+    assert await db.images.count_documents({}) == 2
+
+
+@pytest.mark.asyncio
+async def test_bulk_ingest_bounds_in_flight_work(db, monkeypatch):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "BULK_MAX_IN_FLIGHT", 2)
+    monkeypatch.setattr(settings, "BULK_MAX_ITEMS", 5)
+    monkeypatch.setattr(settings, "BULK_WRITE_BATCH_SIZE", 2)
+    active, peak, uploaded = [0], [0], []
+
+    async def detect_faces_cached(content, mode, crop_mode="lazy"):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        return [_face(random_vectors(1, DIM, seed=len(content))[0])]
+
+    class Storage:
+        async def upload_file(self, content, ext, user_id, content_type):
+            uploaded.append((ext, content_type))
+            return f"uploads/{len(uploaded)}{ext}"
+
+    async def dispatch(event, payload):
+        pass
+
+    monkeypatch.setattr(ingestion, "detect_faces_cached", detect_faces_cached)
+    monkeypatch.setattr(ingestion, "storage_service", Storage())
+    monkeypatch.setattr(ingestion, "dispatch_event_async", dispatch)
+
+    async def entries():
+        yield "skipped.jpg", None, "Entry larger than 100 bytes"
+        for i in range(6):
+            yield f"img{i}.jpg", b"x" * (i + 1), None
+
+    summary = await ingestion.ingest_bulk("u1", entries(), "off")
+
+    assert peak[0] <= 2
+    # BULK_MAX_ITEMS counts the error entry too; the rest of the stream is not read
+    assert (summary["items"], summary["truncated"]) == (5, True)
+    assert (summary["ok"], summary["partial"], summary["failed"], summary["faces"]) == (4, 0, 1, 4)
+    assert summary["results"][0]["error"] == "Entry larger than 100 bytes"
+    assert uploaded == [(".jpg", "image/jpeg")] * 4
+    assert await db.images.count_documents({}) == 4
+    index = await ingestion.tenant_indexes.get("u1")
+    assert len(index.search(random_vectors(1, DIM)[0].tolist(), top_k=10)) == 4
+
+
+@pytest.mark.asyncio
+async def test_processing_job_is_only_taken_over_after_its_lease(worker):
+    db, detected, _ = worker
+    job_id = await ingestion.create_upload_job("u1", "a.jpg", "uploads/a.jpg", "sync")
+    # another worker claimed it and is still within its lease
+    await db.jobs.update_one({}, {"$set": {"status": "processing", "lease_until": datetime.utcnow() + timedelta(minutes=5)}})
+
+    await ingestion.process_upload_job(job_id)
+    assert detected == []
+    assert (await ingestion.get_job("u1", job_id))["status"] == "processing"
+
+    await db.jobs.update_one({}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}})
+    await ingestion.process_upload_job(job_id)
+    assert len(detected) == 1
+    assert (await ingestion.get_job("u1", job_id))["status"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_retried_job_replaces_its_partial_writes(worker):
+    db, detected, events = worker
+    job_id = await ingestion.create_upload_job("u1", "a.jpg", "uploads/a.jpg", "sync")
+    await ingestion.process_upload_job(job_id)
+    first_face = (await db.embeddings.find_one({}))["face_id"]
+
+    # the worker died after ingesting: redelivered, the job is only completed
+    await db.jobs.update_one({}, {"$set": {"status": "queued"}, "$unset": {"seq": ""}})
+    await ingestion.process_upload_job(job_id)
+    assert len(detected) == 1
+    assert events == ["image.uploaded", "image.uploaded"]
+
+    # the worker died mid-ingestion: the retry overwrites the same image and its faces
+    await db.jobs.update_one({}, {"$set": {"status": "queued"}, "$unset": {"ingested": ""}})
+    await ingestion.process_upload_job(job_id)
+    assert len(detected) == 2
+    assert await db.images.count_documents({}) == 1
+    assert str((await db.images.find_one({}))["_id"]) == job_id
+    faces = [d["face_id"] async for d in db.embeddings.find({})]
+    assert len(faces) == 1 and faces[0] != first_face
+    job = await ingestion.get_job("u1", job_id)
+    assert job["status"] == "done" and job["image_id"] == job_id and job["faces"] == 1
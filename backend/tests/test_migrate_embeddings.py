@@ -0,0 +1,61 @@
+import subprocess
+import sys
+import numpy as np
+import pytest
+from app.db import migrate_embeddings
+from app.utils.embedding_codec import decode_embedding, encode_embedding
+
+
+def test_import_does_not_load_models():
+    code = "import sys, app.db.migrate_embeddings; sys.exit('deepface' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+
+@pytest.mark.asyncio
+async def test_migrate_packs_array_embeddings(mongo_db, monkeypatch):
+    monkeypatch.setattr(migrate_embeddings, "embeddings_collection", mongo_db.embeddings)
+    await mongo_db.embeddings.insert_many([{"face_id": f"f{i}", "vector": [0.5, float(i), 1.0]} for i in range(5)])
+
+    assert await migrate_embeddings.migrate_embeddings("float32", batch_size=2) == 5
+    doc = await mongo_db.embeddings.find_one({"face_id": "f3"})
+    assert np.allclose(decode_embedding(doc["vector"]), [0.5, 3.0, 1.0])
+    assert await migrate_embeddings.migrate_embeddings("float32", batch_size=2) == 0
+
+
+
+@pytest.mark.asyncio
+async def test_migrate_moves_the_legacy_embedding_field(mongo_db, monkeypatch):
+    monkeypatch.setattr(migrate_embeddings, "embeddings_collection", mongo_db.embeddings)
+    packed = encode_embedding([1.0, 2.0], "float16")
+    await mongo_db.embeddings.insert_many([
+        {"face_id": "array", "embedding": [0.5, 1.5]},
+        {"face_id": "packed", "embedding": packed},
+        {"face_id": "both", "vector": [3.0, 4.0], "embedding": [9.0, 9.0]},
+    ])
+
+    assert await migrate_embeddings.migrate_embeddings("float32", batch_size=2) == 3
+    docs = {d["face_id"]: d async for d in mongo_db.embeddings.find()}
+    assert all("embedding" not in d for d in docs.values())
+    assert np.allclose(decode_embedding(docs["array"]["vector"]), [0.5, 1.5])
+    assert docs["packed"]["vector"] == packed
+    assert np.allclose(decode_embedding(docs["both"]["vector"]), [3.0, 4.0])
+
+
+@pytest.mark.asyncio
+async def test_drop_inline_keeps_faces_without_a_packed_doc(mongo_db, monkeypatch):
+    monkeypatch.setattr(migrate_embeddings, "embeddings_collection", mongo_db.embeddings)
+    monkeypatch.setattr(migrate_embeddings, "images_collection", mongo_db.images)
+    await mongo_db.embeddings.insert_many([
+        {"face_id": "a", "vector": encode_embedding([1.0])},
+        {"face_id": "b", "vector": [1.0]},
+    ])
+    await mongo_db.images.insert_many([
+        {"_id": 1, "faces": [{"face_id": "a", "embedding": [1.0]}, {"face_id": "b", "embedding": [1.0]},
+                             {"face_id": "c", "embedding": [1.0]}]},
+        {"_id": 2, "faces": [{"face_id": "d", "embedding": [1.0]}]},
+    ])
+
+    assert await migrate_embeddings.drop_inline_embeddings(batch_size=1) == 1
+    faces = (await mongo_db.images.find_one({"_id": 1}))["faces"]
+    assert [("embedding" in f) for f in faces] == [False, True, True]
+    assert "embedding" in (await mongo_db.images.find_one({"_id": 2}))["faces"][0]
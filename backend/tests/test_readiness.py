@@ -0,0 +1,38 @@
+import threading
+import httpx
+import pytest
+
+pytest.importorskip("deepface")
+
+from app.main import app
+from app.core.config import settings
+from app.services import face_detection
+
+
+@pytest.fixture
+def not_warm(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_WARMUP", True)
+    monkeypatch.setattr(face_detection, "_models_ready", threading.Event())
+
+
+async def _get(path):
+    # no lifespan: the warmup task never starts, so readiness is driven by the test
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        return await client.get(path)
+
+
+@pytest.mark.asyncio
+async def test_ready_waits_for_models(not_warm):
+    assert (await _get("/health")).status_code == 200
+    assert (await _get("/ready")).status_code == 503
+
+    face_detection.mark_models_ready()
+    resp = await _get("/ready")
+    assert resp.status_code == 200
+    assert resp.json() == {"status": "ready"}
+
+
+@pytest.mark.asyncio
+async def test_ready_without_warmup(not_warm, monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_WARMUP", False)
+    assert (await _get("/ready")).status_code == 200
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import threading
+import time
+import boto3
+import pytest
+from moto import mock_aws
+from app.core.config import settings
+from app.services.storage_service import StorageService
+
+BUCKET = "facesaas-test"
+PART = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def local(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "USE_S3", False)
+    monkeypatch.setattr(settings, "LOCAL_STORAGE_PATH", str(tmp_path))
+    return StorageService()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setattr(settings, "USE_S3", True)
+    monkeypatch.setattr(settings, "AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setattr(settings, "AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(settings, "AWS_S3_BUCKET", BUCKET)
+    monkeypatch.setattr(settings, "AWS_S3_ENDPOINT_URL", None)
+    monkeypatch.setattr(settings, "S3_MULTIPART_PART_SIZE", PART)
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield StorageService()
+
+
+@pytest.mark.asyncio
+async def test_local_round_trip_and_key_ownership(local, tmp_path):
+    key = await local.upload_file(b"pixels", ".jpg", "u1")
+
+    assert key.startswith(str(tmp_path / "u1")) and key.endswith(".jpg")
+    assert await local.download_file(key) == b"pixels"
+    assert local.owns_key(key, "u1")
+    assert not local.owns_key(key, "u2")
+    assert not local.owns_key(os.path.join(str(tmp_path), "u1", "..", "u2", "x.jpg"), "u1")
+
+
+@pytest.mark.asyncio
+async def test_put_many_keeps_order_and_bounds_concurrency(local, monkeypatch):
+    monkeypatch.setattr(settings, "S3_MAX_CONCURRENCY", 2)
+    active, peak, threads = [0], [0], set()
+    lock = threading.Lock()
+
+    def put(storage_key, content, content_type):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        threads.add(threading.current_thread().name)
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+
+    monkeypatch.setattr(local, "_put", put)
+    keys = await local.put_many([(f"k{i}", b"x") for i in range(6)])
+
+    assert keys == [f"k{i}" for i in range(6)]
+    assert peak[0] == 2
+    # blocking I/O never runs on the event loop's thread
+    assert threading.current_thread().name not in threads
+
+
+def test_put_many_works_from_several_event_loops(local, monkeypatch):
+    monkeypatch.setattr(local, "_put", lambda storage_key, content, content_type: None)
+
+    # e.g. a Celery worker's loop and a test's loop; a shared semaphore would be bound to the first
+    for _ in range(2):
+        assert asyncio.run(local.put_many([("a", b"x"), ("b", b"y")])) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_s3_round_trip_and_presigned_url(s3):
+    key = await s3.upload_file(b"pixels", ".png", "u1", "image/png")
+
+    assert key.startswith("uploads/u1/")
+    assert await s3.download_file(key) == b"pixels"
+    assert s3.owns_key(key, "u1") and not s3.owns_key("uploads/u1/../u2/x.png", "u1")
+    assert key in await s3.get_file_url(key)
+    with pytest.raises(Exception, match="S3 download failed"):
+        await s3.download_file("uploads/u1/missing.png")
+
+
+@pytest.mark.asyncio
+async def test_s3_streaming_upload_small_and_multipart(s3):
+    small = s3.open_upload(".jpg", "u1", "image/jpeg")
+    await small.write(b"tiny")
+    small_key = await small.commit()
+    assert small._upload_id is None
+    assert await s3.download_file(small_key) == b"tiny"
+
+    body = os.urandom(2 * PART + 1000)
+    big = s3.open_upload(".jpg", "u1", "image/jpeg")
+    for i in range(0, len(body), 1024 * 1024):
+        await big.write(body[i:i + 1024 * 1024])
+    big_key = await big.commit()
+    assert len(big._parts) == 3
+    assert await s3.download_file(big_key) == body
+
+
+@pytest.mark.asyncio
+async def test_s3_aborted_upload_leaves_nothing(s3):
+    upload = s3.open_upload(".jpg", "u1", "image/jpeg")
+    await upload.write(os.urandom(PART + 10))
+    assert upload._upload_id is not None
+    await upload.abort()
+
+    client = s3.s3_client
+    assert client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+    assert client.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
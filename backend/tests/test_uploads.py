@@ -0,0 +1,122 @@
+import hashlib
+import io
+import cv2
+import numpy as np
+import pytest
+from fastapi import UploadFile
+from app.core.config import settings
+from app.services.storage_service import LocalUpload
+from app.services.uploads import UnsupportedMediaType, UploadRejected, UploadTooLarge, receive_upload
+from app.utils.image_io import ImageTooLarge
+
+
+def _png(height=64, width=64) -> bytes:
+    return cv2.imencode(".png", np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8))[1].tobytes()
+
+
+def _file(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="upload.bin")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 1024)
+    opened = []
+
+    def open_writer(ext, content_type):
+        opened.append((ext, content_type))
+        return LocalUpload(str(tmp_path / f"upload{ext}"))
+
+    return tmp_path, opened, open_writer
+
+
+@pytest.mark.asyncio
+async def test_upload_is_streamed_sniffed_and_hashed(store):
+    tmp_path, opened, open_writer = store
+    data = _png()
+
+    upload = await receive_upload(_file(data), open_writer, keep=True)
+
+    # the declared filename doesn't matter, the bytes do
+    assert opened == [(".png", "image/png")]
+    assert upload["storage_key"] == str(tmp_path / "upload.png")
+    assert (tmp_path / "upload.png").read_bytes() == data
+    assert upload["size"] == len(data) > 1024
+    assert upload["sha256"] == hashlib.sha256(data).hexdigest()
+    assert upload["content"] == data
+
+
+@pytest.mark.asyncio
+async def test_empty_and_non_image_bodies_are_rejected_before_storage(store):
+    tmp_path, opened, open_writer = store
+    with pytest.raises(UploadRejected) as empty:
+        await receive_upload(_file(b""), open_writer)
+    with pytest.raises(UnsupportedMediaType) as text:
+        await receive_upload(_file(b"just some text, no pixels here"), open_writer)
+
+    assert (empty.value.status_code, text.value.status_code) == (400, 415)
+    assert opened == []
+
+
+@pytest.mark.asyncio
+async def test_pixel_bomb_is_rejected_from_the_header(store, monkeypatch):
+    _, opened, open_writer = store
+    monkeypatch.setattr(settings, "IMAGE_MAX_PIXELS", 64 * 64 - 1)
+    with pytest.raises(ImageTooLarge):
+        await receive_upload(_file(_png()), open_writer)
+    assert opened == []
+
+
+@pytest.mark.asyncio
+async def test_oversized_upload_is_aborted(store):
+    tmp_path, _, open_writer = store
+    data = _png()
+
+    with pytest.raises(UploadTooLarge) as err:
+        await receive_upload(_file(data), open_writer, max_bytes=len(data) - 1)
+
+    assert err.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_declared_length_over_the_limit_is_rejected_unread(monkeypatch):
+    pytest.importorskip("deepface")
+    import httpx
+    from app.main import app
+    monkeypatch.setattr(settings, "UPLOAD_MAX_BYTES", 1000)
+
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        resp = await client.post("/api/v1/images/upload", content=b"x" * (100 * 1024),
+                                 headers={"content-type": "application/octet-stream"})
+
+    assert resp.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_chunked_body_is_cut_off_at_the_limit(monkeypatch):
+    import httpx
+    from fastapi import FastAPI, Request
+    from app.services.uploads import MULTIPART_OVERHEAD_BYTES, UploadSizeLimit
+    monkeypatch.setattr(settings, "UPLOAD_MAX_BYTES", 1000)
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimit)
+    read = []
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        async for chunk in request.stream():
+            read.append(len(chunk))
+        return {"size": sum(read)}
+
+    async def body(n_chunks):
+        for _ in range(n_chunks):
+            yield b"x" * 16 * 1024
+
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        # no Content-Length: only the bytes actually received count
+        resp = await client.post("/upload", content=body(100))
+        assert resp.status_code == 413
+        assert sum(read) <= 1000 + MULTIPART_OVERHEAD_BYTES
+        read.clear()
+        assert (await client.post("/upload", content=body(2))).json() == {"size": 32 * 1024}
@@ -1,11 +1,15 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, Literal
 from datetime import datetime
 
 class UserSettings(BaseModel):
     user_id: str
     threshold_percentage: int = Field(75, ge=0, le=100)
     store_raw_images: bool = Field(True)
+    # age/gender/emotion at upload: off, sync, or deferred (patched in after the response)
+    attribute_analysis: Literal["off", "sync", "deferred"] = Field("off")
+    # face crops: eager (stored at upload), lazy (stored on first view) or off (never stored)
+    crop_storage: Literal["eager", "lazy", "off"] = Field("lazy")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: Optional[datetime] = None
 